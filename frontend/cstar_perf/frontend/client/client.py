@@ -32,6 +32,9 @@ from cstar_perf.frontend.lib.crypto import APIKey, BadConfigFileException
 from cstar_perf.frontend.lib.util import random_token, timeout, TimeoutError, format_bytesize, cd
 from cstar_perf.frontend.lib.socket_comms import Command, Response, CommandResponseBase, receive_data, UnauthenticatedError
 from cstar_perf.tool.stress_compare import stress_compare
+from cstar_perf.tool.benchmark import results_journal_path, journal_finalize
+from cstar_perf.tool.intervals import interval_count
+from cstar_perf.tool.analysis import analyze_file
 from api_client import APIClient
 
 logging.basicConfig(level=logging.DEBUG)
@@ -248,6 +251,8 @@ class JobRunner(object):
 
         response = self.receive(response, assertions={'message':'stream_received', 'done':True})
 
+        finalize_stats(stats_path)
+
         # Find the log tarball for each revision by introspecting the stats json:
         system_logs = []
         log_dir = os.path.join(os.path.expanduser("~"), '.cstar_perf','logs')
@@ -305,6 +310,7 @@ class JobRunner(object):
             We already stream console logs during the job itself, but
             these can get interrupted, so, better to send it again.
           stats       - stress statistics (intervals, aggregates) JSON
+          analysis    - comparison of the revisions' stats JSON (see analysis.py)
           system_logs - cassandra logs
 
         returns a namedtuple of sent, failed to transmit, or missing artifacts.
@@ -326,9 +332,14 @@ class JobRunner(object):
             else:
                 missing.append(kind)
 
+        stats_path = os.path.join(job_dir, 'stats.{job_id}.json'.format(job_id=job_id))
+        finalize_stats(stats_path)
+        analyze_stats(stats_path, os.path.join(job_dir, 'analysis.{job_id}.json'.format(job_id=job_id)))
+
         for kind, pattern, binary in (
                 ('console', 'stress_compare.{job_id}.log', False),
                 ('stats', 'stats.{job_id}.json', False),
+                ('analysis', 'analysis.{job_id}.json', False),
                 ('system_logs', 'cassandra_logs.{job_id}.tar.gz', True)):
             stream(kind, pattern, binary)
 
@@ -417,7 +428,7 @@ class JobRunner(object):
                         assert stats['stats'][op_num]['type'] == op['type']
                         assert stats['stats'][op_num]['command'].startswith(op['command'])
                         if op['type'] == 'stress':
-                            assert len(stats['stats'][op_num]['intervals']) > 0
+                            assert interval_count(stats['stats'][op_num]['intervals']) > 0
         except Exception, e:
             message = e.message
             stacktrace = traceback.format_exc(e)
@@ -527,6 +538,28 @@ class JobCancellationTracker(threading.Thread):
                     log.info("Killing cassandra-stress - pid:{}".format(proc.pid))
                     proc.kill()
 
+def finalize_stats(stats_path):
+    """Build the stats json from the results journal if stress_compare didn't get to
+
+    stress_compare builds the stats json when it exits, but it may
+    have been killed (eg. a cancelled job) before then. The journal
+    has everything recorded up to that point."""
+    journal = results_journal_path(stats_path)
+    if not os.path.exists(stats_path) and os.path.exists(journal):
+        log.info("Recovering {stats_path} from results journal".format(stats_path=stats_path))
+        journal_finalize(journal, stats_path)
+
+def analyze_stats(stats_path, analysis_path):
+    """Compare the revisions in the stats json, unless that was already done
+
+    A failed analysis is logged, it shouldn't keep the other artifacts
+    from being sent."""
+    if os.path.exists(stats_path) and not os.path.exists(analysis_path):
+        try:
+            analyze_file(stats_path, analysis_path)
+        except Exception:
+            log.exception("Could not analyze {stats_path}".format(stats_path=stats_path))
+
 def create_credentials():
     """Create ecdsa keypair for authenticating with server. Save these to
     a config file in the home directory."""
@@ -204,6 +204,14 @@ def cluster_comms(ws):
             db.update_test_artifact(command['test_id'], 'failure', msg)
         # Send response:
         command.respond(test_id=command['test_id'], message='test_update', done=True)
+        # Analyze the stats if the client didn't (an older client, or
+        # it's analysis failed):
+        artifacts = [a['artifact_type'] for a in db.get_test_artifacts(command['test_id'])]
+        if 'stats' in artifacts and 'analysis' not in artifacts:
+            try:
+                db.update_test_analysis(command['test_id'])
+            except Exception:
+                log.exception("Could not analyze the stats of test {test_id}".format(test_id=command['test_id']))
 
     def receive_stream(command):
         """Receive a stream of data"""
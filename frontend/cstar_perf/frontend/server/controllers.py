@@ -17,11 +17,12 @@ from oauth2client.client import ( AccessTokenRefreshError,
                                   FlowExchangeError)
 
 from app import app, db, sockets
-from model import Model, UnknownUserError, UnknownTestError
+from model import Model, UnknownUserError, UnknownTestError, UnknownArtifactError
 from notifications import console_subscribe
 from cstar_perf.frontend.lib.util import random_token
 from cstar_perf.frontend import SERVER_KEY_PATH
 from cstar_perf.frontend.lib.crypto import APIKey
+from cstar_perf.tool.intervals import is_columnar, expand_stats_intervals
 
 import logging
 log = logging.getLogger('cstar_perf.controllers')
@@ -209,7 +210,17 @@ def view_test(test_id):
 def get_artifact(test_id, artifact_type):
     if artifact_type == 'graph':
         return redirect("/graph?stats={test_id}".format(test_id=test_id))
-    artifact, description = db.get_test_artifact_data(test_id, artifact_type)
+    try:
+        artifact, description = db.get_test_artifact_data(test_id, artifact_type)
+    except UnknownArtifactError:
+        return make_response('Unknown {artifact_type} artifact for test {test_id}.'.format(
+            artifact_type=artifact_type, test_id=test_id), 404)
+    if artifact_type == 'stats' and request.args.get('format') != 'columnar':
+        # The graph wants each interval as a row, expand any intervals
+        # stored in the columnar encoding:
+        stats = json.loads(artifact)
+        if any(is_columnar(s.get('intervals')) for s in stats.get('stats', [])):
+            artifact = json.dumps(expand_stats_intervals(stats))
     if description.endswith(".tar.gz"):
         mimetype = 'application/gzip'
     elif description.endswith(".json"):
@@ -313,6 +324,18 @@ def cancel_test():
                             .format(test_id=test_id)}), 401)
     return jsonify({'success':'Test cancelled'})
     
+@app.route('/api/tests/analyze', methods=['POST'])
+@requires_auth('user')
+def analyze_test():
+    """(Re)compute the analysis artifact of a test from it's stats"""
+    test_id = request.form['test_id']
+    try:
+        db.update_test_analysis(test_id)
+    except UnknownArtifactError:
+        return make_response(jsonify({'error':'Test {test_id} has no stats to analyze.'
+                                      .format(test_id=test_id)}), 404)
+    return jsonify({'success':'Test analyzed', 'url':'/tests/artifacts/{test_id}/analysis'.format(test_id=test_id)})
+
 @app.route('/api/tests/id/<test_id>')
 @requires_auth('user')
 def get_test(test_id):
@@ -25,6 +25,8 @@
 ###    - get_completed_tests
 ###  * Get completed test artifacts,  logs, stats, graph url.
 ###    - get_test_artifacts
+###  * Compare the revisions of a test, from it's stats artifact
+###    - update_test_analysis
 ###
 ### Users:
 ###  * Retrieve user by id (email), including set of roles (user, admin)
@@ -48,6 +50,7 @@ from collections import namedtuple
 
 from cstar_perf.frontend.lib.util import random_token, uuid_to_datetime
 from cstar_perf.frontend.server.email_notifications import TestStatusUpdateEmail
+from cstar_perf.tool.analysis import analyze
 
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger('cstar_perf.model')
@@ -58,6 +61,8 @@ class UnknownUserError(Exception):
     pass
 class UnknownTestError(Exception):
     pass
+class UnknownArtifactError(Exception):
+    pass
 class APIKeyExistsError(Exception):
     pass
 class UnknownAPIKeyError(Exception):
@@ -261,6 +266,17 @@ class Model(object):
         session.execute(self.__prepared_statements['update_test_artifact'], (description, artifact, test_id, artifact_type))
         return test_id
 
+    def update_test_analysis(self, test_id):
+        """Compute the analysis artifact of a test from it's stats
+        artifact (see cstar_perf.tool.analysis), replacing any sent by
+        the client
+
+        Raises UnknownArtifactError if the test has no stats."""
+        stats = json.loads(self.get_test_artifact_data(test_id, 'stats').artifact)
+        artifact = json.dumps(analyze(stats), sort_keys=True, indent=4, separators=(', ', ': '))
+        self.update_test_artifact(test_id, 'analysis', artifact, 'analysis.{test_id}.json'.format(test_id=test_id))
+        return artifact
+
     def get_test_artifact(self, test_id, artifact_type):
         """Retrieve one test artifact type"""
         session = self.get_session()
@@ -283,7 +299,12 @@ class Model(object):
         if not isinstance(test_id, uuid.UUID):
             test_id = uuid.UUID(test_id)
         rows = session.execute(self.__prepared_statements['select_test_artifact_data'], (test_id, artifact_type))
-        return namedtuple('Artifact', 'artifact description')(rows[0].artifact.decode("hex"), rows[0].description)
+        try:
+            row = rows[0]
+        except IndexError:
+            raise UnknownArtifactError('Unknown {artifact_type} artifact for test {test_id}'.format(
+                artifact_type=artifact_type, test_id=test_id))
+        return namedtuple('Artifact', 'artifact description')(row.artifact.decode("hex"), row.description)
 
     ################################################################################
     ####  Retrieve tests by status:
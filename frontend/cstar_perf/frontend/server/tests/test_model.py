@@ -3,8 +3,9 @@ import uuid
 import string
 import random
 import time
+import json
 
-from ..model import Model, Cluster, NoTestsScheduledError, APIKeyExistsError, UnknownAPIKeyError
+from ..model import Model, Cluster, NoTestsScheduledError, APIKeyExistsError, UnknownAPIKeyError, UnknownArtifactError
 
 ## This isn't a true unit test, but an integration test against a real
 ## C* instance. It uses a separate keyspace so it shouldn't interfere
@@ -138,6 +139,29 @@ class TestModel(unittest.TestCase):
         self.assertEqual(artifact.artifact, 'GRAPH data 1')
         self.assertEqual(artifact.description, 'stats.json')
 
+        with self.assertRaises(UnknownArtifactError):
+            m.get_test_artifact_data(test_id, 'analysis')
+
+    def test_analysis(self):
+        test_id = uuid.uuid1()
+        m = self.model
+        with self.assertRaises(UnknownArtifactError):
+            m.update_test_analysis(test_id)
+        columns = ['op/s', 'mean', 'time']
+        stats = {'stats': [{'type': 'stress', 'test': '1_write', 'label': label, 'revision_index': i,
+                            'interval_columns': columns,
+                            'intervals': [[rate, 1000.0 / rate, t] for t in range(1, 51)]}
+                           for i, (label, rate) in enumerate([('base', 1000.0), ('slow', 800.0)])]}
+        m.update_test_artifact(test_id, 'stats', json.dumps(stats), 'stats.json')
+        m.update_test_analysis(test_id)
+        artifact = m.get_test_artifact_data(test_id, 'analysis')
+        self.assertEqual(artifact.description, 'analysis.{test_id}.json'.format(test_id=test_id))
+        report = json.loads(artifact.artifact)
+        self.assertEqual(report['baseline'], 'base')
+        slow = report['operations'][0]['revisions'][1]
+        self.assertEqual(slow['label'], 'slow')
+        self.assertAlmostEqual(slow['deltas']['op_rate']['relative'], -0.2)
+
     def test_clusters(self):
         m = self.model
 
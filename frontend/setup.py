@@ -19,7 +19,10 @@ requires = (
     'blist',
     'superlance',
     'requests',
-    'psutil'
+    'psutil',
+    # The client runs the tool, and the server reads the stats it
+    # records (see the tool directory of this repository):
+    'cstar_perf.tool'
 )
 
 setup(
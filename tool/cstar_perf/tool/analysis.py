@@ -0,0 +1,510 @@
+"""
+Statistical comparison of the revisions in a stress_compare stats log.
+
+For each stress operation, every revision's throughput and latency are
+summarized from its stress intervals, with a bootstrap confidence
+interval of the mean (when an operation was repeated in several
+trials, see stress_compare, a t interval of the mean of each trial
+instead). Each revision is then compared to a baseline
+revision (the first one, by default): the relative delta of each
+metric, with its own confidence interval (Welch's t interval when both
+were repeated in trials), is flagged as a
+regression or an improvement when that interval excludes zero and the
+delta is larger than a minimum effect size.
+
+By default only the steady state part of each run is compared: the
+warm-up intervals (JIT compilation, cache fill, first flushes) at the
+start of the run are trimmed with the MSER-5 rule, see steady_state().
+The window used is recorded with each revision.
+
+Consecutive intervals aren't independent (a slow compaction slows down
+a whole run of them), so the bootstrap resamples blocks of consecutive
+intervals rather than single ones. The random generator is seeded, so
+analyzing the same stats log always gives the same report.
+
+When the revisions were interleaved in blocks (see stress_compare's
+interleave setting), each revision is instead compared to the baseline
+within each block it ran in, and the confidence interval of the delta
+is a t interval of those paired, per block deltas. Drift of the
+cluster over the course of the run (disk wear, neighbours, thermal
+throttling) then affects both sides of each pair alike.
+
+The report is json serializable, and stored as the 'analysis'
+artifact of a test:
+
+  {"format": "analysis",
+   "version": 1,
+   "baseline": "<label>",
+   "confidence": 0.95,
+   "window": "steady_state",
+   "operations": [{"test": "1_write", "command": "...",
+                   "revisions": [{"label": "...", "revision": "...", "window": {"start": 12, "end": 300, ...},
+                                  "metrics": {"op_rate": {"mean": ..., "ci_low": ..., "ci_high": ..., "samples": ...}, ...},
+                                  "latency_histograms": {"WRITE-rt": {...}, ...},
+                                  "deltas": {"op_rate": {"relative": ..., "ci_low": ..., "ci_high": ..., "verdict": "regression",
+                                                         "paired_blocks": ...}, ...}},
+                                 ...]},
+                  ...]}
+"""
+
+import argparse
+import json
+import math
+import random
+
+from intervals import interval_rows, interval_columns
+from hdr_histogram import is_histogram, summarize, merge_interval_logs
+
+ANALYSIS_FORMAT = 'analysis'
+ANALYSIS_VERSION = 1
+
+# The metrics compared, the interval columns they may be named in (2.1
+# and 2.0 stress), and whether a higher value is better:
+METRICS = (('op_rate', ('op/s', 'interval_op_rate'), True),
+           ('mean_latency', ('mean', 'latency'), False),
+           ('median_latency', ('med', 'median'), False),
+           ('95th_latency', ('.95', '95th'), False),
+           ('99th_latency', ('.99', '99th'), False),
+           ('99.9th_latency', ('.999', '99.9th'), False))
+
+# The interval columns of 2.1 stress, for intervals stored as rows
+# without their header:
+DEFAULT_COLUMNS = ['total ops', 'adj row/s', 'op/s', 'pk/s', 'row/s', 'mean', 'med', '.95', '.99',
+                   '.999', 'max', 'time', 'stderr', 'gc: #', 'max ms', 'sum ms', 'sdv ms', 'mb']
+
+
+def metric_columns(columns):
+    """Find the index of each metric in the interval columns, see METRICS"""
+    indexes = {}
+    names = [c.strip() for c in columns]
+    for metric, candidates, higher_is_better in METRICS:
+        for candidate in candidates:
+            if candidate in names:
+                indexes[metric] = names.index(candidate)
+                break
+    return indexes
+
+def interval_samples(stats, start=0, end=None):
+    """Get the per interval samples of each metric of a stress operation
+
+    start, end - the range of intervals to get the samples of"""
+    intervals = stats.get('intervals')
+    if not intervals:
+        return {}
+    columns = interval_columns(intervals) or stats.get('interval_columns') or DEFAULT_COLUMNS
+    rows = interval_rows(intervals)[start:end]
+    samples = {}
+    for metric, index in metric_columns(columns).items():
+        values = [row[index] for row in rows if len(row) > index]
+        values = [v for v in values if not (math.isnan(v) or math.isinf(v))]
+        if values:
+            samples[metric] = values
+    return samples
+
+def mean(values):
+    return float(sum(values)) / len(values)
+
+def mser_truncation(values, batch_size=5, max_fraction=0.5):
+    """Find where the warm-up ends in a series, with the MSER rule
+
+    The values are averaged in batches of batch_size (MSER-5 by
+    default), and the warm-up is the number of batches d minimizing the
+    marginal standard error of the remaining batches:
+
+      MSER(d) = sum((x[i] - mean(x[d:]))**2 for i >= d) / (n - d)**2
+
+    Only the first max_fraction of the series may be trimmed. Returns
+    the index of the first steady state value."""
+    batches = [mean(values[i:i + batch_size]) for i in xrange(0, len(values) - batch_size + 1, batch_size)]
+    n = len(batches)
+    if n < 2:
+        return 0
+    best, best_d = None, 0
+    # Suffix sums, to compute the variance of each tail in constant time:
+    total = total_squares = 0.0
+    suffixes = [None] * n
+    for i in xrange(n - 1, -1, -1):
+        total += batches[i]
+        total_squares += batches[i] ** 2
+        suffixes[i] = (total, total_squares)
+    for d in xrange(0, int(n * max_fraction) + 1):
+        count = n - d
+        total, total_squares = suffixes[d]
+        mser = (total_squares - total ** 2 / count) / count ** 2
+        if best is None or mser < best:
+            best, best_d = mser, d
+    return best_d * batch_size
+
+def steady_state(stats, metric='op_rate', batch_size=5):
+    """Detect the steady state of a stress operation, and aggregate the intervals in and out of it
+
+    The warm-up is detected on the metric (throughput by default, see
+    mser_truncation). Returns the chosen window of intervals (start
+    inclusive, end exclusive, and the elapsed time it starts at) with
+    the mean of every metric over the whole run and over the steady
+    state, or None if there are no intervals to detect it in."""
+    whole_run = interval_samples(stats)
+    if not whole_run.has_key(metric):
+        return None
+    end = len(interval_rows(stats['intervals']))
+    start = mser_truncation(whole_run[metric], batch_size)
+    columns = interval_columns(stats['intervals']) or stats.get('interval_columns') or DEFAULT_COLUMNS
+    start_time = None
+    if 'time' in columns and start < end:
+        start_time = interval_rows(stats['intervals'])[start][columns.index('time')]
+    steady = interval_samples(stats, start, end)
+    return {'method': 'mser-{batch_size}'.format(batch_size=batch_size),
+            'metric': metric,
+            'start': start,
+            'end': end,
+            'start_time': start_time,
+            'whole_run': dict((m, mean(values)) for m, values in whole_run.items()),
+            'steady_state': dict((m, mean(values)) for m, values in steady.items())}
+
+def block_bootstrap_means(values, resamples, rng, block_size=None):
+    """Return the means of resamples of the values, drawn in blocks of consecutive values
+
+    block_size defaults to the square root of the number of values."""
+    n = len(values)
+    if block_size is None:
+        block_size = max(1, int(round(math.sqrt(n))))
+    block_size = min(block_size, n)
+    starts = n - block_size + 1
+    means = []
+    for i in xrange(resamples):
+        total = 0.0
+        count = 0
+        while count < n:
+            start = rng.randrange(starts)
+            block = values[start:start + min(block_size, n - count)]
+            total += sum(block)
+            count += len(block)
+        means.append(total / n)
+    return means
+
+def confidence_interval(samples, confidence):
+    """Return the percentile interval of the bootstrap samples"""
+    samples = sorted(samples)
+    tail = (1 - confidence) / 2
+    low = samples[int(math.floor(tail * (len(samples) - 1)))]
+    high = samples[int(math.ceil((1 - tail) * (len(samples) - 1)))]
+    return low, high
+
+def stress_operations(stats_log):
+    """Group the stress operations of a stats log by test, in order
+
+    Returns a list of (test, [stats, ...]), the stats of each revision that ran the test."""
+    tests = []
+    by_test = {}
+    for stats in stats_log.get('stats', []):
+        if stats.get('type', 'stress') != 'stress' or not stats.get('intervals'):
+            continue
+        test = stats.get('test', stats.get('command'))
+        if not by_test.has_key(test):
+            by_test[test] = []
+            tests.append(test)
+        by_test[test].append(stats)
+    return [(name, by_test[name]) for name in tests]
+
+def revision_label(stats):
+    return stats.get('label') or stats.get('revision')
+
+def revision_key(stats):
+    """Identify the revision of the run a stats entry belongs to
+
+    Revisions are told apart by their position in the run, since two of
+    them can share a label (the same branch with different settings).
+    Older stats, without the position, are only grouped if they were
+    trials of the same operation."""
+    if stats.get('revision_index') is not None:
+        return ('revision_index', stats['revision_index'])
+    if stats.get('trials_id') is not None:
+        return ('trials_id', stats['trials_id'])
+    return ('id', stats.get('id'))
+
+def operation_window(stats, window='steady_state'):
+    """Get the range of intervals of an operation to compare, and the recorded window, if any"""
+    if window == 'steady_state':
+        detected = stats.get('steady_state') or steady_state(stats)
+        if detected is not None:
+            return detected['start'], detected['end'], dict(
+                (k, detected[k]) for k in ('method', 'metric', 'start', 'end', 'start_time'))
+    return 0, None, None
+
+def operation_metric(stats, metric='op_rate', window='steady_state'):
+    """Get the mean of a metric over the window of an operation, or None if it wasn't reported"""
+    start, end, recorded = operation_window(stats, window)
+    values = interval_samples(stats, start, end).get(metric)
+    return mean(values) if values else None
+
+def revision_metrics(trials, window, confidence, resamples, rng):
+    """Summarize the metrics of one or more trials of an operation on a revision
+
+    A single trial is bootstrapped from its intervals. Several trials
+    get a t interval of the mean of each trial instead, as the run to
+    run variation is what matters then, and a bootstrap of so few
+    values understates it.
+
+    Returns the revision's entry of the report, the bootstrap samples
+    of each metric, and the mean of each trial, by metric (None for a
+    single trial)."""
+    first = trials[0]
+    revision = {'label': revision_label(first), 'revision': first.get('revision'),
+                'id': first.get('id'), 'metrics': {}}
+    bootstrap = {}
+    if len(trials) == 1:
+        start, end, recorded = operation_window(first, window)
+        if recorded is not None:
+            revision['window'] = recorded
+        samples = interval_samples(first, start, end)
+        block_size = None
+    else:
+        revision['trials'] = len(trials)
+        revision['ids'] = [stats.get('id') for stats in trials]
+        revision['windows'] = [operation_window(stats, window)[2] for stats in trials]
+        samples = {}
+        for stats in trials:
+            start, end, recorded = operation_window(stats, window)
+            for metric, values in interval_samples(stats, start, end).items():
+                samples.setdefault(metric, []).append(mean(values))
+        block_size = 1
+    for metric, values in samples.items():
+        bootstrap[metric] = block_bootstrap_means(values, resamples, rng, block_size)
+        if len(trials) == 1:
+            ci_low, ci_high = confidence_interval(bootstrap[metric], confidence)
+        else:
+            summary = trial_summary(values, confidence)
+            ci_low, ci_high = summary['ci_low'], summary['ci_high']
+        revision['metrics'][metric] = {'mean': mean(values), 'ci_low': ci_low,
+                                       'ci_high': ci_high, 'samples': len(values)}
+    histograms = [stats['histograms'] for stats in trials if stats.get('histograms')]
+    if histograms:
+        merged = histograms[0] if len(histograms) == 1 else merge_interval_logs(histograms)
+        revision['latency_histograms'] = dict(
+            (tag, summarize(data['histogram'])) for tag, data in merged.items()
+            if is_histogram(data.get('histogram')))
+    return revision, bootstrap, (samples if len(trials) > 1 else None)
+
+def block_means(trials, metric, window='steady_state'):
+    """Get the mean of a metric in each block of an interleaved run, by
+    block number, or None if the trials weren't run in blocks"""
+    values = {}
+    for stats in trials:
+        if stats.get('block') is None:
+            return None
+        value = operation_metric(stats, metric, window)
+        if value is not None:
+            values.setdefault(stats['block'], []).append(value)
+    return dict((block, mean(block_values)) for block, block_values in values.items())
+
+def paired_deltas(trials, base_trials, metric, window='steady_state'):
+    """Get the relative delta of a metric to the baseline in each block
+    both revisions ran in, or None if they weren't interleaved"""
+    means = block_means(trials, metric, window)
+    base_means = block_means(base_trials, metric, window)
+    if means is None or base_means is None:
+        return None
+    return [(means[block] - base_means[block]) / base_means[block]
+            for block in sorted(means) if base_means.get(block)]
+
+def welch_interval(values, base_values, confidence):
+    """Welch's t interval of the difference of the means of two sets of
+    trials, relative to the mean of the base trials"""
+    base_mean = mean(base_values)
+    variances = []
+    for trial_values in (values, base_values):
+        average = mean(trial_values)
+        variances.append(sum((v - average) ** 2 for v in trial_values) / (len(trial_values) - 1) /
+                         len(trial_values))
+    delta = mean(values) - base_mean
+    standard_error = math.sqrt(sum(variances))
+    if standard_error == 0:
+        return delta / base_mean, delta / base_mean
+    df = sum(variances) ** 2 / (variances[0] ** 2 / (len(values) - 1) +
+                                variances[1] ** 2 / (len(base_values) - 1))
+    half_width = t_quantile(confidence, max(1, int(df))) * standard_error
+    return (delta - half_width) / base_mean, (delta + half_width) / base_mean
+
+# Two sided quantiles of Student's t distribution, by confidence, for
+# 1 to 30 degrees of freedom:
+T_QUANTILES = {
+    0.90: (6.314, 2.920, 2.353, 2.132, 2.015, 1.943, 1.895, 1.860, 1.833, 1.812,
+           1.796, 1.782, 1.771, 1.761, 1.753, 1.746, 1.740, 1.734, 1.729, 1.725,
+           1.721, 1.717, 1.714, 1.711, 1.708, 1.706, 1.703, 1.701, 1.699, 1.697),
+    0.95: (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+           2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+           2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042),
+    0.99: (63.657, 9.925, 5.841, 4.604, 4.032, 3.707, 3.499, 3.355, 3.250, 3.169,
+           3.106, 3.055, 3.012, 2.977, 2.947, 2.921, 2.898, 2.878, 2.861, 2.845,
+           2.831, 2.819, 2.807, 2.797, 2.787, 2.779, 2.771, 2.763, 2.756, 2.750)}
+
+def normal_quantile(confidence):
+    """Two sided quantile of the standard normal distribution"""
+    target = (1 + confidence) / 2
+    low, high = 0.0, 10.0
+    for i in xrange(100):
+        middle = (low + high) / 2
+        if 0.5 * (1 + math.erf(middle / math.sqrt(2))) < target:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+def t_quantile(confidence, df):
+    """Two sided quantile of Student's t distribution
+
+    Exact (to 3 decimals) for the confidences in T_QUANTILES up to 30
+    degrees of freedom, otherwise a Cornish-Fisher approximation."""
+    if T_QUANTILES.has_key(confidence) and df <= 30:
+        return T_QUANTILES[confidence][df - 1]
+    z = normal_quantile(confidence)
+    return (z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2) +
+            (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3))
+
+def trial_summary(values, confidence=0.95):
+    """Summarize the results of repeated trials, with a t confidence interval of their mean
+
+    relative_half_width is the half width of the confidence interval as
+    a fraction of the mean, None until there are at least two trials."""
+    summary = {'trials': len(values), 'values': list(values), 'confidence': confidence,
+               'mean': None, 'stdev': None, 'ci_low': None, 'ci_high': None, 'relative_half_width': None}
+    if not values:
+        return summary
+    summary['mean'] = average = mean(values)
+    if len(values) < 2:
+        return summary
+    summary['stdev'] = stdev = math.sqrt(sum((v - average) ** 2 for v in values) / (len(values) - 1))
+    half_width = t_quantile(confidence, len(values) - 1) * stdev / math.sqrt(len(values))
+    summary['ci_low'], summary['ci_high'] = average - half_width, average + half_width
+    if average != 0:
+        summary['relative_half_width'] = half_width / abs(average)
+    return summary
+
+def analyze(stats_log, baseline=None, confidence=0.95, resamples=1000, min_effect=0.02, seed=0,
+            window='steady_state'):
+    """Analyze a stats log, see the module documentation
+
+    baseline - the label (or revision) to compare the others to,
+               defaults to the first revision
+    window - 'steady_state' to compare the steady state intervals, as
+             recorded by stress (or detected now, for older stats), or
+             'whole_run' to compare all of them
+    confidence - the confidence level of the intervals
+    resamples - the number of bootstrap resamples
+    min_effect - the smallest relative delta flagged as a regression or
+                 an improvement, even if significant
+    seed - the seed of the bootstrap random generator
+    """
+    rng = random.Random(seed)
+    higher_is_better = dict((metric, higher) for metric, candidates, higher in METRICS)
+    report = {'format': ANALYSIS_FORMAT,
+              'version': ANALYSIS_VERSION,
+              'title': stats_log.get('title'),
+              'baseline': baseline,
+              'confidence': confidence,
+              'window': window,
+              'resamples': resamples,
+              'min_effect': min_effect,
+              'operations': []}
+    for test, revisions_stats in stress_operations(stats_log):
+        operation = {'test': test, 'command': revisions_stats[0].get('command'), 'revisions': []}
+        bootstraps = []
+        trial_values = []
+        # The trials of a revision are summarized together:
+        keys = []
+        trials = {}
+        for stats in revisions_stats:
+            key = revision_key(stats)
+            if not trials.has_key(key):
+                trials[key] = []
+                keys.append(key)
+            trials[key].append(stats)
+        revision_trials = [trials[trial_key] for trial_key in keys]
+        for stats in revision_trials:
+            revision, bootstrap, values = revision_metrics(stats, window, confidence, resamples, rng)
+            operation['revisions'].append(revision)
+            bootstraps.append(bootstrap)
+            trial_values.append(values)
+
+        # Compare each revision to the baseline:
+        baseline_i = 0
+        for i, revision in enumerate(operation['revisions']):
+            if baseline in (revision['label'], revision['revision']):
+                baseline_i = i
+                break
+        base = operation['revisions'][baseline_i]
+        operation['baseline'] = base['label']
+        for revision, bootstrap, stats, values in zip(operation['revisions'], bootstraps, revision_trials,
+                                                      trial_values):
+            if revision is base:
+                continue
+            revision['deltas'] = {}
+            for metric, stat in revision['metrics'].items():
+                base_stat = base['metrics'].get(metric)
+                if base_stat is None or base_stat['mean'] == 0:
+                    continue
+                paired = paired_deltas(stats, revision_trials[baseline_i], metric, window)
+                base_values = trial_values[baseline_i]
+                if paired is not None and len(paired) > 1:
+                    # Interleaved blocks, compare within each block:
+                    summary = trial_summary(paired, confidence)
+                    delta, ci_low, ci_high = summary['mean'], summary['ci_low'], summary['ci_high']
+                elif values is not None and base_values is not None and \
+                        values.get(metric) and base_values.get(metric):
+                    # Repeated trials of both, compare the trial means:
+                    delta = (stat['mean'] - base_stat['mean']) / base_stat['mean']
+                    ci_low, ci_high = welch_interval(values[metric], base_values[metric], confidence)
+                else:
+                    base_bootstrap = bootstraps[baseline_i][metric]
+                    relative = [(m - b) / b for m, b in zip(bootstrap[metric], base_bootstrap) if b != 0]
+                    delta = (stat['mean'] - base_stat['mean']) / base_stat['mean']
+                    ci_low, ci_high = confidence_interval(relative, confidence)
+                verdict = 'unchanged'
+                if (ci_low > 0 or ci_high < 0) and abs(delta) >= min_effect:
+                    verdict = 'improvement' if (delta > 0) == higher_is_better[metric] else 'regression'
+                revision['deltas'][metric] = {'relative': delta, 'ci_low': ci_low, 'ci_high': ci_high,
+                                              'verdict': verdict}
+                if paired is not None and len(paired) > 1:
+                    revision['deltas'][metric]['paired_blocks'] = len(paired)
+        report['operations'].append(operation)
+    if report['baseline'] is None and report['operations']:
+        report['baseline'] = report['operations'][0]['baseline']
+    return report
+
+def regressions(report):
+    """List (test, label, metric, delta) for every regression flagged in a report"""
+    found = []
+    for operation in report['operations']:
+        for revision in operation['revisions']:
+            for metric, delta in sorted(revision.get('deltas', {}).items()):
+                if delta['verdict'] == 'regression':
+                    found.append((operation['test'], revision['label'], metric, delta['relative']))
+    return found
+
+def analyze_file(stats_path, analysis_path, **kwargs):
+    """Analyze a stats json file, writing the report to analysis_path"""
+    with open(stats_path) as f:
+        stats_log = json.loads(f.read())
+    report = analyze(stats_log, **kwargs)
+    with open(analysis_path, 'w') as f:
+        f.write(json.dumps(report, sort_keys=True, indent=4, separators=(', ', ': ')))
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the revisions of a stress_compare stats log')
+    parser.add_argument('stats', help='stats json file')
+    parser.add_argument('output', help='file to write the analysis json to')
+    parser.add_argument('-b', '--baseline', help='label of the revision to compare to, defaults to the first')
+    parser.add_argument('-c', '--confidence', type=float, default=0.95)
+    parser.add_argument('-m', '--min-effect', type=float, default=0.02, dest='min_effect',
+                        help='smallest relative change to flag')
+    parser.add_argument('-w', '--window', choices=['steady_state', 'whole_run'], default='steady_state',
+                        help='intervals to compare')
+    args = parser.parse_args()
+    report = analyze_file(args.stats, args.output, baseline=args.baseline,
+                          confidence=args.confidence, min_effect=args.min_effect, window=args.window)
+    for test, label, metric, delta in regressions(report):
+        print("{test}: {label} {metric} regressed {delta:+.1%}".format(**locals()))
+
+if __name__ == "__main__":
+    main()
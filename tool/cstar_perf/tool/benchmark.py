@@ -5,7 +5,6 @@ Bootstrap Cassandra onto a cluster and benchmark stress.
 import argparse
 import shlex
 import subprocess
-import tempfile
 import os, sys
 import time
 import datetime
@@ -15,10 +14,28 @@ import uuid
 import re
 import json
 import threading
+import Queue
 import socket
 import getpass
 import logging
 import yaml
+import atexit
+import tempfile
+import tarfile
+import shutil
+import fcntl
+import contextlib
+import hashlib
+
+from stress_parser import StressOutputParser, StressHeader, StressInterval, StressAggregate, parse_stress_output
+from intervals import ColumnarIntervals
+from jmx_agent import JMXAgent, JMXAgentError
+import sysstat_capture
+from gc_log import read_gc_archive, gc_stats
+from hdr_histogram import collect_interval_log, merge_interval_logs
+from multi_client import merge_intervals, merge_aggregates
+import log_collector
+from analysis import steady_state
 
 # Import the default config first:
 import fab_cassandra as cstar
@@ -31,22 +48,20 @@ logger.setLevel(logging.INFO)
 
 
 CASSANDRA_STRESS   = os.path.expanduser("~/fab/stress/default/tools/bin/cassandra-stress")
-CASSANDRA_NODETOOL = os.path.expanduser("~/fab/cassandra/bin/nodetool")
-CASSANDRA_CQLSH    = os.path.expanduser("~/fab/cassandra/bin/cqlsh")
+CASSANDRA_HOME     = os.path.expanduser("~/fab/cassandra")
+CASSANDRA_NODETOOL = os.path.join(CASSANDRA_HOME, "bin", "nodetool")
+CASSANDRA_CQLSH    = os.path.join(CASSANDRA_HOME, "bin", "cqlsh")
 JAVA_HOME          = os.path.expanduser("~/fab/java")
 
-def bootstrap(cfg=None, destroy=False, leave_data=False, git_fetch=True):
-    """Deploy and start cassandra on the cluster
-    
-    cfg - the cluster configuration
-    destroy - whether to destroy the existing build before bootstrap
-    leave_data - if destroy==True, leave the Cassandra data/commitlog/etc directories intact.
-    git_fetch - Do a git fetch before building/running C*? (Multi-revision tests should only update on the first run to maintain revision consistency in case someone checks something in mid-operation.)
+# Shared JMX agent, see get_jmx_agent():
+jmx_agent = None
 
-    Return the gid id of the branch checked out
-    """
-    if cfg is not None:
-        cstar.setup(cfg)
+# Private copy of the controller's cassandra install, see use_controller_install():
+controller_install = None
+
+def apply_config(cfg):
+    """Setup the fab_cassandra config from a revision's configuration"""
+    cstar.setup(cfg)
 
     # Parse yaml 
     if cfg.has_key('yaml'):
@@ -63,6 +78,61 @@ def bootstrap(cfg=None, destroy=False, leave_data=False, git_fetch=True):
             cstar.config.update(cfg['options'])
             del cstar.config['options']
 
+@contextlib.contextmanager
+def controller_lock(name):
+    """Hold an exclusive lock, shared by every process on the controller"""
+    lock_dir = os.path.join(os.path.expanduser("~"), ".cstar_perf", "locks")
+    try:
+        os.makedirs(lock_dir)
+    except OSError:
+        if not os.path.isdir(lock_dir):
+            raise
+    with open(os.path.join(lock_dir, "{name}.lock".format(name=name)), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def use_controller_install(path):
+    """Run nodetool and cqlsh from a private copy of the controller's install
+
+    Several stress_compare processes can share the controller (see
+    stress_compare's partitions), and any of them may reinstall
+    ~/fab/cassandra while another is using it. Each of them copies the
+    install to it's own directory instead, every time it bootstraps."""
+    global controller_install, CASSANDRA_NODETOOL, CASSANDRA_CQLSH
+    controller_install = path
+    CASSANDRA_NODETOOL = os.path.join(path, "bin", "nodetool")
+    CASSANDRA_CQLSH = os.path.join(path, "bin", "cqlsh")
+
+def copy_controller_install():
+    """Copy the controller's install to the private copy, see use_controller_install"""
+    if os.path.exists(controller_install):
+        shutil.rmtree(controller_install)
+    parent = os.path.dirname(controller_install)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    # ~/fab/cassandra may be a link to a saved installation (see
+    # fab_cassandra.activate_installation), copy what it points to:
+    shutil.copytree(os.path.realpath(CASSANDRA_HOME), controller_install, symlinks=True)
+
+def bootstrap(cfg=None, destroy=False, leave_data=False, git_fetch=True, revisions=None, stats=None, start=True):
+    """Deploy and start cassandra on the cluster
+    
+    cfg - the cluster configuration
+    destroy - whether to destroy the existing build before bootstrap
+    leave_data - if destroy==True, leave the Cassandra data/commitlog/etc directories intact.
+    git_fetch - Do a git fetch before building/running C*? (Multi-revision tests should only update on the first run to maintain revision consistency in case someone checks something in mid-operation.)
+    revisions - All the revisions that will be tested, so the git fetch can be limited to what they need.
+    stats - An optional dictionary to record bootstrap statistics (build cache hits/misses and timings, node shutdown and startup times) to.
+    start - whether to start cassandra once it's installed and configured.
+
+    Return the gid id of the branch checked out
+    """
+    if cfg is not None:
+        apply_config(cfg)
+
     logger.info("### Config: ###")
     pprint(cstar.config)
 
@@ -73,52 +143,355 @@ def bootstrap(cfg=None, destroy=False, leave_data=False, git_fetch=True):
             raise AssertionError('blockdev_readahead setting requires block_devices to be set in cluster_config.')
         set_device_read_ahead(cfg['blockdev_readahead'])
 
+    waves = {}
+    if stats is not None:
+        stats['waves'] = waves
+
     # Destroy cassandra deployment and data:
     if destroy:
-        execute(cstar.destroy, leave_data=leave_data)
-        execute(cstar.ensure_stopped)
+        results, waves['destroy'] = execute_in_waves(cstar.destroy, leave_data=leave_data)
     else:
         #Shutdown cleanly:
         execute(cstar.stop)
-        execute(cstar.ensure_stopped)
+    shutdown_stats = execute(cstar.ensure_stopped)
+    if stats is not None:
+        stats['shutdown'] = shutdown_stats
+
+    # Several stress_compare processes can share the controller (see
+    # stress_compare's partitions), only one of them builds or installs
+    # on it at a time:
+    with controller_lock('build'):
+        # Bootstrap C* onto the cluster nodes, as well as the localhost,
+        # so we have access to nodetool, stress etc - the local host will
+        # not be added to the cluster unless it has a corresponding entry
+        # in the cluster config:
+        hosts = list(cstar.fab.env['hosts'])
+        localhost = socket.gethostname().split(".")[0]
+        for controller in hosts:
+            if controller.split(".")[0] == localhost:
+                break
+        else:
+            # Use the local username for this host, as it may be different
+            # than the cluster defined 'user' parameter:
+            controller = getpass.getuser() + "@" + localhost
+            hosts += [controller]
+        if cstar.config['build_distribution']:
+            # Build only on the controller, and copy the build to the
+            # nodes, so node CPUs and page caches are left alone:
+            with cstar.fab.settings(hosts=[controller]):
+                artifact = execute(cstar.build_artifact, git_fetch=git_fetch, revisions=revisions).values()[0]
+            config_options = get_cassandra_config_options(artifact['git_id'], controller)
+            logger.info("Distributing build {git_id} ({sha256}) to {n} nodes".format(
+                n=len(hosts), **artifact))
+            results, waves['install'] = execute_in_waves(cstar.install_artifact, artifact,
+                                                         config_options=config_options, hosts=hosts)
+            build_cache_stats = {'controller': artifact['build_cache']}
+        else:
+            results, waves['build'] = execute_in_waves(cstar.bootstrap, git_fetch=git_fetch, revisions=revisions,
+                                                       configure=False, hosts=hosts)
+            build_cache_stats = {}
+        build_cache_stats['hosts'] = dict((host, r['build_cache']) for host, r in results.items())
+        build_cache_stats['hits'] = len([r for r in results.values() if r['build_cache'].get('hit')])
+        build_cache_stats['misses'] = len(results) - build_cache_stats['hits']
+        logger.info("Build cache hits: {hits}, misses: {misses}".format(**build_cache_stats))
+        if stats is not None:
+            stats['build_cache'] = build_cache_stats
 
-    # Bootstrap C* onto the cluster nodes, as well as the localhost,
-    # so we have access to nodetool, stress etc - the local host will
-    # not be added to the cluster unless it has a corresponding entry
-    # in the cluster config:
-    hosts = list(cstar.fab.env['hosts'])
-    localhost = socket.gethostname().split(".")[0]
-    if localhost not in [host.split(".")[0] for host in hosts]:
-        # Use the local username for this host, as it may be different
-        # than the cluster defined 'user' parameter:
-        hosts += [getpass.getuser() + "@" + localhost]
-    with cstar.fab.settings(hosts=hosts):
-        git_ids = execute(cstar.bootstrap, git_fetch=git_fetch)
-
-    git_id = list(set(git_ids.values()))
-    assert len(git_id) == 1, "Not all nodes had the same cassandra version: {git_ids}".format(git_ids=git_ids)
-    git_id = git_id[0]
+        git_ids = dict((host, r['git_id']) for host, r in results.items())
+        git_id = list(set(git_ids.values()))
+        assert len(git_id) == 1, "Not all nodes had the same cassandra version: {git_ids}".format(git_ids=git_ids)
+        git_id = git_id[0]
 
+        if not cstar.config['build_distribution']:
+            # Now that every node has the build, configure them with the
+            # options found once for this revision:
+            config_options = get_cassandra_config_options(git_id, controller)
+            execute(cstar.configure_cassandra, config_options=config_options)
+
+        if controller_install is not None:
+            copy_controller_install()
+
+    if not start:
+        logger.info("Installed cassandra on {n} nodes with git SHA: {git_id}".format(
+            n=len(cstar.fab.env['hosts']), git_id=git_id))
+        return git_id
+
+    started = time.time()
     execute(cstar.start)
-    execute(cstar.ensure_running, hosts=[cstar.config['seeds'][0]])
-    time.sleep(30)
+    startup_stats = wait_for_cluster_ready(since=started)
+    if stats is not None:
+        stats['startup'] = startup_stats
 
     logger.info("Started cassandra on {n} nodes with git SHA: {git_id}".format(
         n=len(cstar.fab.env['hosts']), git_id=git_id))
     return git_id
 
+def get_cassandra_config_options(git_id, host):
+    """Get the valid cassandra.yaml options for a build
+
+    The options only depend on the build, so they are cached per git
+    SHA in ~/.cstar_perf/config_options. On a cache miss, they are
+    found on the given host, which must have the build installed."""
+    cache_dir = os.path.join(os.path.expanduser("~"), ".cstar_perf", "config_options")
+    cache_file = os.path.join(cache_dir, "{git_id}.json".format(git_id=git_id))
+    if os.path.exists(cache_file):
+        with open(cache_file) as f:
+            return json.loads(f.read())
+    with cstar.fab.settings(hosts=[host]):
+        config_options = execute(cstar.get_cassandra_config_options, git_id=git_id).values()[0]
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    with open(cache_file, 'w') as f:
+        f.write(json.dumps(config_options))
+    return config_options
+
 def restart():
     execute(cstar.stop)
     execute(cstar.ensure_stopped)
+    started = time.time()
     execute(cstar.start)
-    execute(cstar.ensure_running)
+    return wait_for_cluster_ready(since=started)
+
+def switch_revision(cfg, slot, leave_data=True, stats=None):
+    """Stop cassandra and start the revision installed side by side as slot
+
+    The revision must have been installed with bootstrap(start=False)
+    and saved with save_installation, so switching is only a restart.
+
+    cfg - the revision's configuration
+    slot - the installation to switch to, see save_installation
+    leave_data - keep the data of the previous revision, otherwise it's removed.
+    stats - An optional dictionary to record the shutdown and startup times to.
+    """
+    apply_config(cfg)
+    if leave_data:
+        execute(cstar.stop)
+    else:
+        execute(cstar.destroy, leave_data=False)
+    shutdown_stats = execute(cstar.ensure_stopped)
+    execute(cstar.activate_installation, slot)
+    started = time.time()
+    execute(cstar.start)
+    startup_stats = wait_for_cluster_ready(since=started)
+    if stats is not None:
+        stats['shutdown'] = shutdown_stats
+        stats['startup'] = startup_stats
+    logger.info("Switched cassandra on {n} nodes to installation {slot}".format(
+        n=len(cstar.fab.env['hosts']), slot=slot))
+
+# Stress options that don't change the data written, left out of
+# dataset keys:
+DATASET_IGNORED_OPTIONS = ('-node', '-rate', '-log', '-port', '-mode', '-sendto', '-errors')
+
+def sstable_format_version():
+    """Get the sstable format version the running cluster writes"""
+    with cstar.fab.settings(hosts=[cstar.fab.env.hosts[0]]):
+        return execute(cstar.get_sstable_format_version).values()[0]
+
+def dataset_key(cmd, sstable_format):
+    """Get the key of the dataset a stress load command writes, see capture_dataset
+
+    The key covers what the data on the nodes depends on: the stress
+    command and profile, the partitioner, the sstable format version,
+    and the hosts and tokens of the cluster."""
+    options = [o.strip() for o in re.split(r'\s(?=-[a-z])', cmd.strip())]
+    options = [o for o in options if o.split(' ')[0] not in DATASET_IGNORED_OPTIONS]
+    profile = None
+    match = re.search(r'profile=(\S+)', cmd)
+    if match and os.path.exists(os.path.expanduser(match.group(1))):
+        with open(os.path.expanduser(match.group(1))) as f:
+            profile = hashlib.sha1(f.read()).hexdigest()
+    hosts = sorted((host, host_config.get('internal_ip'), host_config.get('initial_token'))
+                   for host, host_config in cstar.config['hosts'].items())
+    material = json.dumps({'command': options, 'profile': profile, 'sstable_format': sstable_format,
+                           'partitioner': cstar.config['partitioner'], 'use_vnodes': cstar.config['use_vnodes'],
+                           'num_tokens': cstar.config['num_tokens'], 'hosts': hosts}, sort_keys=True)
+    return hashlib.sha1(material).hexdigest()[:16]
+
+def dataset_cached(key):
+    """Does every node have a snapshot of the dataset with this key?"""
+    return all(execute(cstar.has_dataset, key).values())
+
+def capture_dataset(key):
+    """Drain and stop the cluster, snapshot it's data as the dataset with
+    this key, and start it again
+
+    Returns the key and timings of the capture."""
+    start = time.time()
+    nodetool_multi(cstar.fab.env.hosts, 'drain')
+    execute(cstar.stop)
+    execute(cstar.ensure_stopped)
+    snapshot_start = time.time()
+    evicted = execute(cstar.capture_dataset, key, cstar.config['cluster_name'])
+    started = time.time()
+    execute(cstar.start)
+    startup_stats = wait_for_cluster_ready(since=started)
+    logger.info("Captured dataset {key} in {seconds:.1f}s".format(key=key, seconds=started - snapshot_start))
+    return {'key': key, 'hit': False,
+            'capture_seconds': started - snapshot_start,
+            'total_seconds': time.time() - start,
+            'startup': startup_stats,
+            'evicted': sorted(set(k for keys in evicted.values() for k in keys))}
+
+def restore_dataset(key):
+    """Stop the cluster, replace it's data with the dataset with this
+    key, and start it again
+
+    Returns the key and timings of the restore."""
+    start = time.time()
+    execute(cstar.stop)
+    execute(cstar.ensure_stopped)
+    restore_start = time.time()
+    cluster_names = execute(cstar.restore_dataset, key)
+    started = time.time()
+    execute(cstar.start)
+    startup_stats = wait_for_cluster_ready(since=started)
+    logger.info("Restored dataset {key} in {seconds:.1f}s".format(key=key, seconds=started - restore_start))
+    # The cluster now has the name recorded with the dataset:
+    cstar.config['cluster_name'] = cluster_names.values()[0]
+    return {'key': key, 'hit': True,
+            'restore_seconds': started - restore_start,
+            'total_seconds': time.time() - start,
+            'startup': startup_stats,
+            'cluster_name': cstar.config['cluster_name']}
 
 def teardown(destroy=False, leave_data=False):
+    """Stop cassandra on the cluster, or destroy it along with it's data
+
+    Returns the duration and hosts of each wave of the teardown."""
     if destroy:
-        execute(cstar.destroy, leave_data=leave_data)
+        results, waves = execute_in_waves(cstar.destroy, leave_data=leave_data)
     else:
+        start = time.time()
         execute(cstar.stop)
         execute(cstar.ensure_stopped)
+        waves = [{'hosts': list(cstar.fab.env.hosts), 'duration': time.time() - start}]
+    return waves
+
+def execute_in_waves(task, *args, **kwargs):
+    """Execute a task on a wave of hosts at a time, see the 'wave_size' setting
+
+    hosts - the hosts to run the task on (None == all)
+    The remaining arguments are passed to the task.
+
+    Returns the combined results of all the hosts, and a list of the
+    duration and hosts of each wave."""
+    hosts = kwargs.pop('hosts', None)
+    if hosts is None:
+        hosts = list(cstar.fab.env.hosts)
+    wave_size = cstar.config.get('wave_size') or len(hosts)
+    results = {}
+    waves = []
+    for i in range(0, len(hosts), wave_size):
+        wave = hosts[i:i + wave_size]
+        start = time.time()
+        results.update(execute(task, *args, hosts=wave, **kwargs))
+        waves.append({'hosts': wave, 'duration': time.time() - start})
+        if len(wave) < len(hosts):
+            logger.info("{task} wave {n} finished on {hosts} in {duration:.1f}s".format(
+                task=task.__name__, n=len(waves), hosts=", ".join(wave), duration=waves[-1]['duration']))
+    return results, waves
+
+def probe_port(address, port, timeout=1):
+    """Check whether a TCP port accepts connections"""
+    try:
+        sock = socket.create_connection((address, port), timeout)
+    except (socket.error, socket.timeout):
+        return False
+    sock.close()
+    return True
+
+def client_ports():
+    """Get the client ports to probe on each node
+
+    Returns a dictionary of name -> (port, required). Thrift is only
+    required to be up if start_rpc is explicitly enabled, as its default
+    depends on the Cassandra version."""
+    cass_yaml = cstar.config.get('yaml', {})
+    return {'native': (cass_yaml.get('native_transport_port', 9042),
+                       cass_yaml.get('start_native_transport', True)),
+            'thrift': (cass_yaml.get('rpc_port', 9160),
+                       cass_yaml.get('start_rpc', False))}
+
+def gossip_states(node):
+    """Get the state of each node in the ring, as seen by the given node
+
+    Returns a dictionary of broadcast address -> state, in the same
+    form as nodetool status ('UN', 'DN', 'UJ', etc). The dictionary is
+    empty if the node couldn't be queried."""
+    agent = get_jmx_agent()
+    if agent is not None:
+        try:
+            gossip = agent.gossip(node)
+        except JMXAgentError:
+            pass
+        else:
+            states = {}
+            for address in gossip['live'] + gossip['unreachable']:
+                states[address] = 'U' if address in gossip['live'] else 'D'
+                for key, state in (('joining', 'J'), ('leaving', 'L'), ('moving', 'M')):
+                    if address in gossip[key]:
+                        states[address] += state
+                        break
+                else:
+                    states[address] += 'N'
+            return states
+    status_pattern = re.compile("^([UD][NLJM])\s+(\S+)\s", re.MULTILINE)
+    output = nodetool("-h {node} status".format(node=node))
+    return dict((address, state) for state, address in status_pattern.findall(output))
+
+def wait_for_cluster_ready(hosts=None, since=None, timeout=None, interval=1):
+    """Wait for cassandra to be ready on all (or just the specified) nodes
+
+    A node is ready once its client ports accept connections and it is
+    up and normal (UN) in gossip.
+
+    hosts - the nodes to check (None == all)
+    since - the time the nodes were started, startup times are relative to this (None == now)
+    timeout - the time to wait before aborting (None == the 'startup_timeout' setting)
+    interval - the time to wait between checks
+
+    Returns a dictionary of stats, with the number of seconds it took
+    each node to open each client port and to be up in gossip."""
+    if hosts is None:
+        hosts = list(cstar.fab.env.hosts)
+    if since is None:
+        since = time.time()
+    if timeout is None:
+        timeout = cstar.config.get('startup_timeout', 300)
+    ports = client_ports()
+    host_stats = dict((host, {}) for host in hosts)
+    # Probe what each node has configured as it's rpc_address and
+    # broadcast_address:
+    rpc_addresses = dict((host, cstar.config['hosts'][host]['internal_ip']) for host in hosts)
+    broadcast_addresses = dict((host, cstar.config['hosts'][host].get('external_ip', cstar.config['hosts'][host]['internal_ip']))
+                               for host in hosts)
+    while True:
+        for host in hosts:
+            for name, (port, required) in ports.items():
+                key = '{name}_port'.format(name=name)
+                if key not in host_stats[host] and probe_port(rpc_addresses[host], port):
+                    host_stats[host][key] = time.time() - since
+                    logger.info("{host} is accepting {name} connections".format(host=host, name=name))
+        listening = [host for host in hosts
+                     if all('{name}_port'.format(name=name) in host_stats[host]
+                            for name, (port, required) in ports.items() if required)]
+        if listening:
+            # Any node that's listening knows the state of the ring:
+            states = gossip_states(listening[0])
+            for host in listening:
+                if 'up' not in host_stats[host] and states.get(broadcast_addresses[host]) == 'UN':
+                    host_stats[host]['up'] = time.time() - since
+        not_ready = [host for host in hosts if 'up' not in host_stats[host]]
+        if len(not_ready) == 0:
+            break
+        if time.time() - since > timeout:
+            cstar.fab.abort("Timed out waiting for all nodes to startup: {hosts}".format(hosts=", ".join(not_ready)))
+        time.sleep(interval)
+
+    duration = time.time() - since
+    logger.info("All nodes available! Startup took {duration:.1f}s".format(duration=duration))
+    return {'duration': duration, 'hosts': host_stats}
 
 def nodetool(cmd):
     """Run a nodetool command"""
@@ -159,81 +532,200 @@ def cqlsh(script, node):
     return output[0]
 
 def nodetool_multi(nodes, command):
-    """Run a nodetool command simultaneously on each node specified"""
-    class NodetoolThread(threading.Thread):
-        """Run nodetool in a thread"""
-        def __init__(self, cmd):
-            threading.Thread.__init__(self)
-            self.node = node
-            self.cmd = cmd
-        def run(self):
-            self.output = nodetool(self.cmd)
-    threads = {}
+    """Run a nodetool command simultaneously on each node specified
+
+    At most 'parallel_pool_size' nodetool commands are run at once."""
+    pending = Queue.Queue()
     for node in nodes:
-        t = NodetoolThread("-h {node} {cmd}".format(node=node, cmd=command))
-        t.start()
-        threads[node] = t
+        pending.put(node)
     output = {}
-    for node, t in threads.items():
+    def run():
+        while True:
+            try:
+                node = pending.get_nowait()
+            except Queue.Empty:
+                return
+            output[node] = nodetool("-h {node} {cmd}".format(node=node, cmd=command))
+    pool_size = cstar.config.get('parallel_pool_size') or pending.qsize()
+    threads = [threading.Thread(target=run) for i in range(min(pool_size, pending.qsize()))]
+    for t in threads:
+        t.start()
+    for t in threads:
         t.join()
-        output[node] = t.output
     return output
 
-def wait_for_compaction(nodes=None, check_interval=30, idle_confirmations=3, compaction_throughput=16):
+def get_jmx_agent():
+    """Get the shared JMX agent, starting it on first use
+
+    Returns None if the agent is disabled with the 'use_jmx_agent'
+    setting, or couldn't be started, in which case callers should fall
+    back to nodetool."""
+    global jmx_agent
+    if not cstar.config.get('use_jmx_agent', True):
+        return None
+    if jmx_agent is None:
+        agent = JMXAgent(JAVA_HOME, port=cstar.config.get('jmx_port', 7199))
+        try:
+            agent.start()
+        except (OSError, subprocess.CalledProcessError), e:
+            logger.warn("Could not start the JMX agent, falling back to nodetool: {e}".format(e=e))
+            cstar.config['use_jmx_agent'] = False
+            return None
+        jmx_agent = agent
+        atexit.register(agent.stop)
+    return jmx_agent
+
+def jmx_query_multi(nodes, query, *args):
+    """Run a query on each node with the JMX agent
+
+    Returns None if the agent isn't available or the query failed."""
+    agent = get_jmx_agent()
+    if agent is None:
+        return None
+    try:
+        return agent.query_multi(nodes, query, *args)
+    except JMXAgentError, e:
+        logger.warn("JMX agent query failed, falling back to nodetool: {e}".format(e=e))
+        return None
+
+def compactions_idle(nodes):
+    """Check each node for pending compaction tasks (compactionstats)
+
+    Returns a dictionary of node -> (idle, details)"""
+    status = jmx_query_multi(nodes, 'compaction')
+    if status is not None:
+        return dict((node, (s['pending_tasks'] == 0, s)) for node, s in status.items())
+    pattern = re.compile("(^|\n)pending tasks: 0\n")
+    output = nodetool_multi(nodes, 'compactionstats')
+    return dict((node, (pattern.search(out) is not None, out)) for node, out in output.items())
+
+def compaction_executor_idle(nodes):
+    """Check each node's CompactionExecutor for active, pending or blocked tasks (tpstats)
+
+    Returns a dictionary of node -> (idle, details), or None if the
+    CompactionExecutor is not reported by the nodes. A node whose
+    thread pools couldn't be read (eg. nodetool failed) is not idle."""
+    pools = jmx_query_multi(nodes, 'thread_pools')
+    if pools is not None:
+        status = {}
+        for node, node_pools in pools.items():
+            executor = node_pools.get('CompactionExecutor')
+            if executor is None:
+                return None
+            idle = (executor.get('ActiveCount', 0) == 0 and executor.get('PendingTasks', 0) == 0
+                    and executor.get('CurrentlyBlockedTasks', 0) == 0)
+            status[node] = (idle, executor)
+        return status
+    stat_exists_pattern = re.compile("^CompactionExecutor", re.MULTILINE)
+    no_compactions_pattern = re.compile("CompactionExecutor\W*0\W*0\W*[0-9]*\W*0", re.MULTILINE)
+    listing_pattern = re.compile("^Pool Name", re.MULTILINE)
+    output = nodetool_multi(nodes, 'tpstats')
+    status = {}
+    for node, out in output.items():
+        if not stat_exists_pattern.search(out):
+            if listing_pattern.search(out):
+                # tpstats worked, this version just doesn't list it:
+                return None
+            logger.warn("Couldn't get tpstats from {node}, assuming it's busy: {out}".format(node=node, out=out))
+            status[node] = (False, out)
+            continue
+        status[node] = (no_compactions_pattern.search(out) is not None, out)
+    return status
+
+def compaction_progress(nodes):
+    """Get the pending compaction tasks and the progress of the active compactions of each node
+
+    Returns a dictionary of node -> {'pending_tasks': number of pending tasks (None if unknown),
+                                     'compactions': {compaction key: (completed bytes, total bytes)}}"""
+    progress = {}
+    status = jmx_query_multi(nodes, 'compaction')
+    if status is not None:
+        for node, s in status.items():
+            compactions = {}
+            for c in s['compactions']:
+                if c.get('unit', 'bytes').lower() != 'bytes':
+                    continue
+                key = (c.get('compactionId', c.get('id')), c.get('keyspace'),
+                       c.get('columnfamily'), c.get('total'))
+                compactions[key] = (long(c['completed']), long(c['total']))
+            progress[node] = {'pending_tasks': int(s['pending_tasks']), 'compactions': compactions}
+        return progress
+    pending_pattern = re.compile("pending tasks: ([0-9]+)")
+    output = nodetool_multi(nodes, 'compactionstats')
+    for node, out in output.items():
+        m = pending_pattern.search(out)
+        compactions = {}
+        for line in out.split("\n"):
+            # Compaction rows look like: [id] type keyspace table completed total bytes progress
+            fields = line.split()
+            if 'bytes' not in fields or fields.index('bytes') < 2:
+                continue
+            i = fields.index('bytes')
+            try:
+                completed, total = long(fields[i-2]), long(fields[i-1])
+            except ValueError:
+                continue
+            compactions[tuple(fields[:i-2]) + (total,)] = (completed, total)
+        progress[node] = {'pending_tasks': int(m.group(1)) if m else None, 'compactions': compactions}
+    return progress
+
+def wait_for_compaction(nodes=None, check_interval=30, idle_confirmations=3, compaction_throughput=16,
+                        mode=None, stats=None, min_check_interval=1, timeout=None):
     """Wait for all currently scheduled compactions to finish on all (or just specified) nodes
 
     nodes - the nodes to check (None == all)
-    check_interval - the time to wait between checks
+    check_interval - the time to wait between checks (the longest time between checks in adaptive mode)
     idle_confirmations - the number of checks that must show 0 compactions before we assume compactions are really done.
     compaction_throughput - the default compaction_throughput_mb_per_sec setting from the cassandra.yaml
+    mode - 'adaptive' or 'fixed', defaults to the 'compaction_wait' setting. See wait_for_compaction_adaptive.
+           'fixed' checks compactionstats and tpstats every check_interval.
+    stats - if a dictionary is given, the compaction stats are recorded to stats['compaction']
+    min_check_interval - the shortest time between checks in adaptive mode
+    timeout - the longest time to wait, defaults to the 'compaction_timeout' setting (None == no limit).
+              When it runs out, the wait ends with a warning recorded in the compaction stats.
 
-    returns the duration all compactions took (margin of error: check_interval * idle_confirmations)
+    returns the duration all compactions took (margin of error: check_interval * idle_confirmations in fixed mode)
     """
 
-    def compactionstats(nodes, check_interval):
-        """Check for compactions via nodetool compactionstats"""
-        pattern = re.compile("(^|\n)pending tasks: 0\n")
+    def compactionstats(nodes, check_interval, deadline):
+        """Check for compactions via compactionstats
+
+        Returns False if the deadline passed first."""
         nodes = set(nodes)
         while True:
-            output = nodetool_multi(nodes, 'compactionstats')
+            status = compactions_idle(nodes)
             for node in list(nodes):
-                if pattern.search(output[node]):
+                if status[node][0]:
                     nodes.remove(node)
             if len(nodes) == 0:
-                break
+                return True
+            if deadline is not None and time.time() >= deadline:
+                return False
             logger.info("Waiting for compactions (compactionstats) on nodes:")
             for node in nodes:
-                logger.info("{node} - {output}".format(node=node, output=output[node]))
+                logger.info("{node} - {output}".format(node=node, output=status[node][1]))
             time.sleep(check_interval)
 
-        assert len(nodes) == 0, ("Compactions (compactionstats) should have finished, but they didn't"
-                            " on nodes: {nodes}. output: {output}".format(
-                                nodes=nodes, output=output))
-
-    def tpstats(nodes, check_interval):
-        """Check for compactions via nodetool tpstats"""
-        stat_exists_pattern = re.compile("^CompactionExecutor", re.MULTILINE)
-        no_compactions_pattern = re.compile("CompactionExecutor\W*0\W*0\W*[0-9]*\W*0", re.MULTILINE)
+    def tpstats(nodes, check_interval, deadline):
+        """Check for compactions via tpstats
 
+        Returns False if the deadline passed first."""
         nodes = set(nodes)
         while True:
-            output = nodetool_multi(nodes, 'tpstats')
+            status = compaction_executor_idle(nodes)
+            if status is None:
+                logger.warn("CompactionExecutor not listed in tpstats, can't check for compactions this way.")
+                return True
             for node in list(nodes):
-                if stat_exists_pattern.search(output[node]):
-                    if no_compactions_pattern.search(output[node]):
-                        nodes.remove(node)
-                else:
-                    logger.warn("CompactionExecutor not listed in nodetool tpstats, can't check for compactions this way.")
-                    return
+                if status[node][0]:
+                    nodes.remove(node)
             if len(nodes) == 0:
-                break
+                return True
+            if deadline is not None and time.time() >= deadline:
+                return False
             logger.info("Waiting for compactions (tpstats) on nodes: {nodes}".format(nodes=nodes))
             time.sleep(check_interval)
 
-        assert len(nodes) == 0, ("Compactions (tpstats) should have finished, but they didn't"
-                            " on nodes: {nodes}. output: {output}".format(
-                                nodes=nodes, output=output))
-
     if nodes is None:
         nodes = set(cstar.fab.env.hosts)
     else:
@@ -242,21 +734,132 @@ def wait_for_compaction(nodes=None, check_interval=30, idle_confirmations=3, com
     # Disable compaction throttling to speed things up:
     nodetool_multi(nodes, 'setcompactionthroughput 0')
 
-    # Perform checks multiple times to ensure compactions are really done:
+    if mode is None:
+        mode = cstar.config.get('compaction_wait', 'adaptive')
+    if timeout is None:
+        timeout = cstar.config.get('compaction_timeout')
     start = time.time()
-    for i in range(idle_confirmations):
-        compactionstats(nodes, check_interval)
-        tpstats(nodes, check_interval)
+    deadline = start + timeout if timeout is not None else None
+    if mode == 'adaptive':
+        compaction_stats = wait_for_compaction_adaptive(nodes, check_interval, idle_confirmations,
+                                                        min_check_interval, deadline)
+    elif mode == 'fixed':
+        # Perform checks multiple times to ensure compactions are really done:
+        timed_out = False
+        for i in range(idle_confirmations):
+            if not (compactionstats(nodes, check_interval, deadline) and
+                    tpstats(nodes, check_interval, deadline)):
+                timed_out = True
+                break
+        compaction_stats = {'timed_out': timed_out}
+    else:
+        raise ValueError("Unknown compaction wait mode: {mode}".format(mode=mode))
 
     duration = time.time() - start
+    compaction_stats['mode'] = mode
+    compaction_stats['duration'] = duration
+    if compaction_stats['timed_out']:
+        compaction_stats['warning'] = ("Compactions didn't finish within {timeout}s, "
+                                       "stopped waiting for them".format(timeout=timeout))
+        logger.warn(compaction_stats['warning'])
+    if stats is not None:
+        stats['compaction'] = compaction_stats
 
     # Re-enable compaction throttling:
     nodetool_multi(nodes, 'setcompactionthroughput {compaction_throughput}'.format(**locals()))
 
-    logger.info("Compactions finished on all nodes. Duration of checks: {duration}".format(**locals()))
+    if not compaction_stats['timed_out']:
+        logger.info("Compactions finished on all nodes. Duration of checks: {duration}".format(**locals()))
 
     return duration
 
+def wait_for_compaction_adaptive(nodes, max_check_interval=30, idle_confirmations=3, min_check_interval=1,
+                                 deadline=None):
+    """Wait for compactions to finish, polling more often the closer they are to finishing
+
+    The time between checks starts at min_check_interval and doubles
+    up to max_check_interval while compactions are running, but never
+    exceeds half of the estimated time remaining, which is based on the
+    bytes left in the active compactions and the rate they have been
+    compacted at so far. Once every node is idle, the idle
+    confirmations are done max_check_interval apart, to catch the
+    compactions scheduled after the flushes.
+
+    deadline - the time to stop waiting at, if compactions haven't finished by then
+
+    Returns a dictionary of stats, with the duration, bytes compacted and
+    throughput (MB/s) of each node, and whether the deadline passed."""
+    nodes = set(nodes)
+    start = time.time()
+    node_stats = dict((node, {'duration': 0, 'bytes_compacted': 0}) for node in nodes)
+    previous = {}
+    interval = min_check_interval
+    confirmations = 0
+    checks = 0
+    timed_out = False
+    while True:
+        progress = compaction_progress(nodes)
+        now = time.time()
+        checks += 1
+        busy = set()
+        remaining = {}
+        for node in nodes:
+            p = progress[node]
+            compactions = p['compactions']
+            # Count the bytes compacted since the last check, including
+            # the rest of the compactions that have since finished:
+            for key, (completed, total) in previous.get(node, {}).items():
+                if key in compactions:
+                    node_stats[node]['bytes_compacted'] += max(0, compactions[key][0] - completed)
+                else:
+                    node_stats[node]['bytes_compacted'] += max(0, total - completed)
+            previous[node] = compactions
+            remaining[node] = sum(total - completed for completed, total in compactions.values())
+            # A node whose pending tasks couldn't be read (nodetool
+            # failed) is not known to be idle:
+            if p['pending_tasks'] is None or p['pending_tasks'] or compactions:
+                busy.add(node)
+                node_stats[node]['duration'] = now - start
+
+        if len(busy) == 0:
+            executor = compaction_executor_idle(nodes)
+            if executor is None or all(idle for idle, details in executor.values()):
+                confirmations += 1
+                if confirmations >= idle_confirmations:
+                    break
+                interval = max_check_interval
+            else:
+                confirmations = 0
+                interval = min_check_interval
+        else:
+            confirmations = 0
+            interval = min(interval * 2, max_check_interval)
+            eta = None
+            for node in busy:
+                elapsed = node_stats[node]['duration']
+                if node_stats[node]['bytes_compacted'] > 0 and elapsed > 0:
+                    node_eta = remaining[node] / (node_stats[node]['bytes_compacted'] / elapsed)
+                    eta = node_eta if eta is None else max(eta, node_eta)
+            if eta is not None:
+                interval = max(min_check_interval, min(interval, eta / 2))
+            logger.info("Waiting for compactions on nodes: {nodes}".format(nodes=", ".join(sorted(busy))))
+            for node in sorted(busy):
+                logger.info("{node} - pending tasks: {pending}, active compactions: {active}, bytes remaining: {remaining}".format(
+                    node=node, pending=progress[node]['pending_tasks'],
+                    active=len(progress[node]['compactions']), remaining=remaining[node]))
+            if eta is not None:
+                logger.info("Estimated time remaining: {eta:.0f}s".format(eta=eta))
+        if deadline is not None and now >= deadline:
+            timed_out = True
+            break
+        if deadline is not None:
+            interval = max(0, min(interval, deadline - now))
+        time.sleep(interval)
+
+    for node, s in node_stats.items():
+        s['throughput'] = s['bytes_compacted'] / 1024.0**2 / s['duration'] if s['duration'] > 0 else None
+    return {'checks': checks, 'nodes': node_stats, 'timed_out': timed_out}
+
 def set_device_read_ahead(read_ahead, devices=None):
     """Set device read ahead.
     
@@ -269,8 +872,69 @@ def drop_page_cache():
     """Drop the page cache"""
     bash(['sync', 'echo 3 > /proc/sys/vm/drop_caches'], user='root')
     
-def stress(cmd, revision_tag, stats=None):
-    """Run stress command and collect average statistics"""
+def stream_stress(cmd):
+    """Run a cassandra-stress command and generate parsed records as it runs
+
+    The stress output is echoed to stdout as it arrives, and each
+    StressHeader, StressInterval and StressAggregate is yielded as
+    soon as its line has been read."""
+    proc = subprocess.Popen('JAVA_HOME={JAVA_HOME} {CASSANDRA_STRESS} {cmd}'
+                            .format(JAVA_HOME=JAVA_HOME,
+                                    CASSANDRA_STRESS=CASSANDRA_STRESS,
+                                    cmd=cmd),
+                            stdout=subprocess.PIPE, shell=True)
+    parser = StressOutputParser()
+    try:
+        # Iterating over the pipe directly would read ahead in large
+        # blocks, readline gives us each line as soon as it's printed:
+        for line in iter(proc.stdout.readline, ''):
+            sys.stdout.write(line)
+            sys.stdout.flush()
+            record = parser.feed(line)
+            if record is not None:
+                yield record
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+# Whether each stress build can write histogram logs, by path:
+stress_hdr_support = {}
+
+def stress_supports_hdr_log():
+    """Check if the installed cassandra-stress can write HdrHistogram logs (-log hdrfile=)"""
+    path = os.path.realpath(CASSANDRA_STRESS)
+    if not stress_hdr_support.has_key(path):
+        proc = subprocess.Popen('JAVA_HOME={JAVA_HOME} {CASSANDRA_STRESS} help -log'.format(
+            JAVA_HOME=JAVA_HOME, CASSANDRA_STRESS=CASSANDRA_STRESS),
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
+        output = proc.communicate()[0]
+        stress_hdr_support[path] = 'hdrfile' in output
+    return stress_hdr_support[path]
+
+def add_stress_log_option(cmd, option):
+    """Add a sub option (eg. hdrfile=x) to the -log option of a stress command"""
+    if re.search(r'\s-log\s', cmd):
+        return re.sub(r'(\s-log\s)', r'\g<1>{option} '.format(option=option), cmd, count=1)
+    return "{cmd} -log {option}".format(cmd=cmd.rstrip(), option=option)
+
+def stress(cmd, revision_tag, stats=None, interval_callback=None, interval_format='columnar',
+           capture_histograms=None):
+    """Run stress command and collect average statistics
+
+    interval_callback - an optional function called with each
+                        StressInterval while stress is still running.
+    interval_format - 'columnar' to store intervals in the compact
+                      columnar encoding (see intervals.py), or 'rows' to
+                      store them as a list of rows.
+    capture_histograms - record the full latency histogram of the whole
+                         operation in stats['histograms'] (see
+                         hdr_histogram.py). By default, it is recorded
+                         if this version of stress can log them, or if
+                         the command already gives an hdrfile to log
+                         them to. 'intervals' also records the
+                         histogram of each interval, which takes a few
+                         KB per interval.
+    """
     # Check for compatible stress commands. This doesn't yet have full
     # coverage of every option:
     # Make sure that if this is a read op, that the number of threads
@@ -279,7 +943,6 @@ def stress(cmd, revision_tag, stats=None):
     if cmd.strip().startswith("read") and 'threads' not in cmd:
         raise AssertionError('Stress read commands must specify #/threads when used with this tool.')
 
-    temp_log = tempfile.mktemp()
     logger.info("Running stress : %s" % cmd)
 
     # Record the type of operation being performed:
@@ -290,59 +953,250 @@ def stress(cmd, revision_tag, stats=None):
                  "test":operation, "revision": revision_tag, 
                  "date":datetime.datetime.now().isoformat()}
 
-    # Run stress:
-    # Subprocess communicate() blocks, preventing us from seeing any
-    # realtime output, so pipe the output to a file as a workaround:
-    proc = subprocess.Popen('JAVA_HOME={JAVA_HOME} {CASSANDRA_STRESS} {cmd} | tee {temp_log}'
-                            .format(JAVA_HOME=JAVA_HOME,
-                                    CASSANDRA_STRESS=CASSANDRA_STRESS,
-                                    cmd=cmd, temp_log=temp_log), shell=True)
-    proc.wait()
-    log = open(temp_log)
-    collecting_aggregates = False
-    collecting_values = False
-    
-    # Regex that matches 2.0 or 2.1 stress intervals:
-    start_of_intervals_re = re.compile('(partitions|ops|total|total ops).*,.*(op/s|interval_op_rate|adj row/s),.*(pk/s|key/s|interval_key_rate|op/s)')
-    
-    for line in log:
-        if line.startswith("Results:"):
-            collecting_aggregates = True
-            continue
-        if not collecting_aggregates:
-            if start_of_intervals_re.match(line):
-                collecting_values = True
-                continue
-            if collecting_values:
-                try:
-                    stats['intervals'].append([float(x) for x in line.split(",")])
-                except:
-                    pass
-                continue
-            continue
-        if line.startswith("END") or line == "":
+    # Log the latency histograms:
+    hdr_log = None
+    hdr_log_is_temporary = False
+    hdrfile = re.search(r'hdrfile=(\S+)', cmd)
+    if hdrfile:
+        hdr_log = os.path.expanduser(hdrfile.group(1))
+    elif capture_histograms or (capture_histograms is None and stress_supports_hdr_log()):
+        fd, hdr_log = tempfile.mkstemp(prefix='stress-', suffix='.hdr')
+        os.close(fd)
+        hdr_log_is_temporary = True
+        cmd = add_stress_log_option(cmd, 'hdrfile={path}'.format(path=hdr_log))
+
+    # Used to align data collected on the nodes with the intervals:
+    stats['start_timestamp'] = time.time()
+    columnar = None
+    for record in stream_stress(cmd):
+        if isinstance(record, StressHeader):
+            if columnar is None:
+                columnar = ColumnarIntervals(record.columns)
+        elif isinstance(record, StressInterval):
+            if interval_format == 'columnar':
+                if not columnar.append(record.values):
+                    logger.warn("Ignoring stress interval that doesn't match the header: {values}".format(
+                        values=record.values))
+                    continue
+            else:
+                stats['intervals'].append(record.values)
+            if interval_callback is not None:
+                interval_callback(record)
+        elif isinstance(record, StressAggregate):
+            stats[record.name] = record.value
+    if interval_format == 'columnar' and columnar is not None:
+        stats['intervals'] = columnar.encode()
+    # Record the steady state window, and the aggregates of the
+    # intervals in it, next to the whole run aggregates from stress:
+    if stats['intervals']:
+        stats['steady_state'] = steady_state(stats)
+    if hdr_log is not None:
+        if os.path.exists(hdr_log):
+            with open(hdr_log) as f:
+                stats['histograms'] = collect_interval_log(f, intervals=capture_histograms == 'intervals')
+            if hdr_log_is_temporary:
+                os.remove(hdr_log)
+        else:
+            logger.warn("Stress did not write a histogram log to {path}".format(path=hdr_log))
+    return stats
+
+def collect_stress_output(lines):
+    """Parse the complete output of a stress command
+
+    Returns the ColumnarIntervals (None if stress printed no intervals),
+    and a dictionary of the Results: aggregates."""
+    columnar = None
+    aggregates = {}
+    for record in parse_stress_output(lines):
+        if isinstance(record, StressHeader):
+            if columnar is None:
+                columnar = ColumnarIntervals(record.columns)
+        elif isinstance(record, StressInterval):
+            if columnar is not None:
+                columnar.append(record.values)
+        elif isinstance(record, StressAggregate):
+            aggregates[record.name] = record.value
+    return columnar, aggregates
+
+def stress_multi(cmd, revision_tag, stats, clients, capture_histograms=None, start_delay=10):
+    """Run the same stress command from several load generators at once
+
+    clients - the load generator hosts to run stress on
+    capture_histograms - as for stress()
+    start_delay - seconds to give every client to be ready to start
+                  stress at the same time
+
+    The results of the clients are merged into the same stats stress()
+    records (see multi_client.py), and the results of each client are
+    kept in stats['clients'].
+    """
+    if cmd.strip().startswith("read") and 'threads' not in cmd:
+        raise AssertionError('Stress read commands must specify #/threads when used with this tool.')
+
+    hdr_log = None
+    if capture_histograms or (capture_histograms is None and stress_supports_hdr_log()):
+        hdr_log = '/tmp/stress-{id}.hdr'.format(id=uuid.uuid1())
+        cmd = add_stress_log_option(cmd, 'hdrfile={path}'.format(path=hdr_log))
+
+    logger.info("Running stress from {n} clients : {cmd}".format(n=len(clients), cmd=cmd))
+    start_at = time.time() + start_delay
+    stats['start_timestamp'] = start_at
+    # Every client must run at once for them to start in sync:
+    with cstar.fab.settings(pool_size=len(clients)):
+        results = execute(cstar.run_stress, cmd=cmd, start_at=start_at, hdr_log=hdr_log, hosts=clients)
+
+    stats['clients'] = client_stats = {}
+    client_intervals = []
+    client_aggregates = []
+    client_histograms = []
+    for client in clients:
+        result = results[client]
+        lines = result['output'].splitlines()
+        for line in lines:
+            sys.stdout.write("[{client}] {line}\n".format(client=client, line=line))
+        columnar, aggregates = collect_stress_output(lines)
+        client_stats[client] = {'return_code': result['return_code'],
+                                'clock_offset': result['clock_offset'],
+                                'aggregates': aggregates,
+                                'intervals': columnar.encode() if columnar is not None else []}
+        if columnar is None or len(columnar) == 0:
+            logger.error("Stress client {client} reported no intervals (return code {rc})".format(
+                client=client, rc=result['return_code']))
             continue
-        # Collect aggregates:
-        stat, value  = line.split(":", 1)
-        stats[stat.strip()] = value.strip()
-    log.close()
-    os.remove(temp_log)
+        client_intervals.append(columnar)
+        client_aggregates.append(aggregates)
+        if result['hdr_log']:
+            collected = collect_interval_log(result['hdr_log'].splitlines(),
+                                             intervals=capture_histograms == 'intervals')
+            client_histograms.append(collected)
+            client_stats[client]['histograms'] = dict(
+                (tag, {'histogram': data['histogram'], 'summary': data['summary']})
+                for tag, data in collected.items())
+    sys.stdout.flush()
+
+    if client_intervals:
+        stats['intervals'] = merge_intervals(client_intervals).encode()
+        stats.update(merge_aggregates(client_aggregates))
+        stats['steady_state'] = steady_state(stats)
+    if client_histograms:
+        stats['histograms'] = merge_interval_logs(client_histograms)
     return stats
 
 def retrieve_logs(local_directory):
-    """Retrieve each node's logs to the given local directory."""
-    execute(cstar.copy_logs, local_directory=local_directory)
+    """Retrieve each node's logs to the given local directory.
+
+    Returns the duration and hosts of each wave of copies."""
+    results, waves = execute_in_waves(cstar.copy_logs, local_directory=local_directory)
+    return waves
+
+def collect_logs(archive_path, root, fincore=False):
+    """Archive each node's logs, and optionally it's fincore log, to a tar.gz
+
+    Only the parts of the logs written since the previous collection
+    are compressed on the nodes and copied, see log_collector. The
+    archive holds the logs of each node under root/<hostname>, and the
+    fincore logs as root/fincore.<hostname>.log.
+
+    Returns the duration and hosts of each wave of copies, and the
+    bytes copied and archived."""
+    paths = [os.path.join(cstar.config['log_dir'], '*')]
+    names = ['{hostname}/{{name}}']
+    if fincore:
+        paths.append('/tmp/fincore.stats.log')
+        names.append('fincore.{hostname}.log')
+    cache_dir = os.path.join(os.path.expanduser('~'), '.cstar_perf', 'log_cache')
+    mirrors = {}
+    for host in cstar.fab.env.hosts:
+        mirrors[host] = os.path.join(cache_dir, cstar.config['hosts'][host]['hostname'])
+    known = dict((host, log_collector.mirror_state(mirror)) for host, mirror in mirrors.items())
+    bundle_dir = tempfile.mkdtemp()
+    try:
+        results, waves = execute_in_waves(cstar.fetch_log_segments, paths, known, bundle_dir)
+        copied = 0
+        for host, fetched in results.items():
+            hostname = cstar.config['hosts'][host]['hostname']
+            copied += log_collector.add_bundle(mirrors[host], fetched,
+                                               [name.format(hostname=hostname) for name in names])
+    finally:
+        shutil.rmtree(bundle_dir)
+    archived = log_collector.write_archive(archive_path, root, [mirrors[host] for host in sorted(mirrors)])
+    logger.info("Copied {copied} bytes of new log segments, archived {archived} bytes to {path}".format(
+        copied=copied, archived=archived, path=archive_path))
+    return {'waves': waves, 'bytes_copied': copied, 'bytes_archived': archived}
 
 def retrieve_fincore_logs(local_directory):
     """Retrieve each node's fincore logs to the given local directory."""
     execute(cstar.copy_fincore_logs, local_directory=local_directory)
 
+def start_sysstat_capture(interval=1):
+    """Start system metrics sampling on each node
+
+    Returns the clock offset of each node from the controller, see collect_sysstat"""
+    return execute(cstar.start_sysstat_capture, interval=interval)
+
+def stop_sysstat_capture():
+    """Stop system metrics sampling"""
+    execute(cstar.stop_sysstat_capture)
+
+def retrieve_sysstat_logs(local_directory):
+    """Retrieve each node's system metrics log to the given local directory."""
+    execute(cstar.copy_sysstat_logs, local_directory=local_directory)
+
+def collect_sysstat(local_directory, clock_offsets, start_timestamp):
+    """Read the system metrics logs retrieved to a directory
+
+    clock_offsets - the clock offset of each node, as returned by start_sysstat_capture
+    start_timestamp - the controller time the operation started at
+
+    Returns a dictionary of host -> columnar intervals (see
+    intervals.py). The node timestamps are replaced by an 'elapsed'
+    column of seconds since start_timestamp, in controller time, so the
+    samples line up with the stress intervals."""
+    sysstat = {}
+    for host, offset in clock_offsets.items():
+        path = os.path.join(local_directory, "sysstat.{hostname}.log".format(
+            hostname=cstar.config['hosts'][host]['hostname']))
+        if not os.path.exists(path):
+            logger.warn("No system metrics were retrieved from {host}".format(host=host))
+            continue
+        columns, rows = sysstat_capture.read_log(path)
+        columnar = ColumnarIntervals(['elapsed'] + columns[1:])
+        for row in rows:
+            columnar.append([row[0] - offset - start_timestamp] + row[1:])
+        sysstat[host] = columnar.encode()
+    return sysstat
+
+def collect_gc_stats(log_archive, start_timestamp, end_timestamp, clock_offsets=None):
+    """Summarize the GC pauses of each node during an operation
+
+    log_archive - the archive the node logs were collected to, see collect_logs
+    start_timestamp, end_timestamp - the controller times the operation started and ended at
+    clock_offsets - the clock offset of each node, as returned by
+                    start_sysstat_capture. Without them, the node clocks
+                    are assumed to be in sync with the controller.
+
+    Returns a dictionary of host -> pause statistics (see gc_log.gc_stats)"""
+    clock_offsets = clock_offsets or {}
+    stats = {}
+    with tarfile.open(log_archive) as tar:
+        directories = set(os.path.dirname(m.name) for m in tar.getmembers() if m.isfile())
+        root = tar.getnames()[0]
+        for host, cfg in cstar.config['hosts'].items():
+            host_log_dir = os.path.join(root, cfg['hostname'])
+            if host_log_dir not in directories:
+                logger.warn("No logs were retrieved from {host}".format(host=host))
+                continue
+            offset = clock_offsets.get(host, 0)
+            events = read_gc_archive(tar, host_log_dir)
+            stats[host] = gc_stats(events, start_timestamp + offset, end_timestamp + offset)
+    return stats
+
 def start_fincore_capture(interval=10):
-    """Start linux-fincore monitoring of Cassandra data files on each node"""
+    """Start page cache monitoring of Cassandra data files on each node"""
     execute(cstar.start_fincore_capture, interval=interval)
 
 def stop_fincore_capture():
-    """Stop linux-fincore monitoring"""
+    """Stop page cache monitoring"""
     execute(cstar.stop_fincore_capture)
 
 def log_add_data(file, data):
@@ -377,3 +1231,66 @@ def log_stats(stats, memo=None, file='stats.json'):
     with open(file, 'w') as f:
         f.write(log)
 
+
+def results_journal_path(file):
+    """Get the path of the append-only results journal for a json log file"""
+    return file + '.journal'
+
+def journal_append(journal, record_type, data):
+    """Append a single record to the results journal.
+
+    Each record is one line of json, written and synced on it's own,
+    so the cost of logging doesn't grow with the size of the log, and a
+    crash can at most lose the record being written."""
+    line = json.dumps({'type': record_type, 'data': data}, sort_keys=True)
+    with open(journal, 'a') as f:
+        f.write(line + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def journal_stats(journal, stats, memo=None):
+    """Record the stats of a single operation in the results journal"""
+    if memo:
+        stats.update({'memo': memo})
+    journal_append(journal, 'stats', stats)
+
+def journal_add_data(journal, data):
+    """Record data to be merged into the json log file root"""
+    journal_append(journal, 'data', data)
+
+def journal_records(journal):
+    """Generate the records from a results journal.
+
+    A partially written last line (from a crash mid-write) is skipped."""
+    with open(journal) as f:
+        for line_num, line in enumerate(f, 1):
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logger.warn("Skipping unreadable record on line {line_num} of {journal}".format(
+                    line_num=line_num, journal=journal))
+
+def journal_import_log(file, journal):
+    """Seed a new results journal with the contents of an existing json log file"""
+    with open(file) as f:
+        log = json.loads(f.read())
+    stats = log.pop('stats', [])
+    journal_add_data(journal, log)
+    for s in stats:
+        journal_stats(journal, s)
+
+def journal_finalize(journal, file):
+    """Build the json log file, in the layout the frontend expects, from the results journal"""
+    log = {'title': 'Title goes here', 'stats':[]}
+    for record in journal_records(journal):
+        if record['type'] == 'stats':
+            log['stats'].append(record['data'])
+        elif record['type'] == 'data':
+            log.update(record['data'])
+    log = json.dumps(log, sort_keys=True, indent=4, separators=(', ', ': '))
+    # Write to a temporary file first, so a failure here never leaves
+    # a truncated log behind:
+    tmp_file = file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        f.write(log)
+    os.rename(tmp_file, file)
@@ -23,10 +23,14 @@ import fabric
 from fabric import api as fab
 import os
 import yaml
+import json
 from cluster_config import config as cluster_config
 import re
 import uuid
+import pipes
 from util import random_token
+from remote_script import RemoteScript, result_by_name
+import ssh_pool
 
 fab.env.use_ssh_config = True
 fab.env.connection_attempts = 10
@@ -156,7 +160,58 @@ def setup(my_config=None):
         'use_jna': True,
         # Extra environment settings to prepend to cassandra-env.sh:
         'env': '',
-        'java_home': '~/fab/java'
+        'java_home': '~/fab/java',
+        # The number of git remotes to fetch from at the same time:
+        'git_fetch_concurrency': 4,
+        # Only fetch the branches named by the revisions being tested,
+        # rather than every branch of every remote:
+        'git_fetch_revisions_only': False,
+        # Build each revision once on the controlling node and copy
+        # the build to the cluster nodes, rather than building on
+        # every node:
+        'build_distribution': False,
+        # The total size of the builds to keep in ~/fab/cassandra_builds,
+        # the least recently used builds are removed beyond this:
+        'build_cache_max_bytes': 5 * 1024**3,
+        # How to install a cached build: 'hardlink', 'reflink' or 'copy'
+        # (see copy_build)
+        'build_cache_restore': 'hardlink',
+        # Query node metrics (compactions, thread pools) from the
+        # controller through a persistent JMX agent instead of running
+        # nodetool each time:
+        'use_jmx_agent': True,
+        # Keep a multiplexed SSH connection open to each host for the
+        # whole of a stress_compare run, see ssh_pool:
+        'ssh_pool': True,
+        # The most hosts a parallel task runs on at once, and the most
+        # nodetool commands run at once (None == all of them):
+        'parallel_pool_size': None,
+        # Run the heavy phases (build/install, destroy, log copies) on
+        # this many hosts at a time, one wave after the other (None ==
+        # all the hosts in a single wave):
+        'wave_size': None,
+        # The JMX port of the nodes:
+        'jmx_port': 7199,
+        # How to wait for compactions after stress operations:
+        #  'adaptive' - poll more often as compactions near completion
+        #  'fixed' - poll every 30s
+        'compaction_wait': 'adaptive',
+        # The longest time to wait for compactions after a stress
+        # operation, in seconds (None == no limit). The operation's
+        # stats record a warning when the wait is cut short:
+        'compaction_timeout': 4 * 3600,
+        # The time to wait for all the nodes to accept client
+        # connections and be up in gossip after starting cassandra:
+        'startup_timeout': 300,
+        # Load generator hosts, to run stress operations from several
+        # clients at once (see benchmark.stress_multi). Each needs
+        # stress in ~/fab/stress/default and java in ~/fab/java, like
+        # the controller:
+        'stress_clients': [],
+        # The number of load phase datasets to keep snapshots of on
+        # each node, the least recently used are removed beyond this
+        # (see capture_dataset):
+        'dataset_cache_keep': 2
     }
 
     public_ips = "node0, node1, node2, node3"
@@ -211,6 +266,8 @@ def setup(my_config=None):
     if not CMD_LINE_HOSTS_SPECIFIED:
         fab.env.hosts = [h for h in config['hosts']]
     fab.env.user = config['user']
+    # Limit how many hosts parallel tasks fork for at once:
+    fab.env.pool_size = config['parallel_pool_size']
 
 ## Setup default configuration:
 # First call without arguments sets up default config:
@@ -219,10 +276,21 @@ setup()
 # for the configured cluster:
 setup(cluster_config)
 
-def get_cassandra_config_options():
+def get_cassandra_config_options(git_id=None):
     """Parse Cassandra's Config class to get all possible config values. 
 
-    Unfortunately, some are hidden from the default cassandra.yaml file, so this appears the only way to do this."""
+    Unfortunately, some are hidden from the default cassandra.yaml file, so this appears the only way to do this.
+
+    If the git id of the installed build is given, the options are
+    cached alongside that build in the build cache."""
+    cache_file = '~/fab/cassandra_builds/{git_id}/0.CONFIG_OPTIONS.json'.format(git_id=git_id)
+    if git_id is not None:
+        cached = fab.run('cat {cache_file}'.format(cache_file=cache_file), quiet=True)
+        if cached.return_code == 0:
+            try:
+                return json.loads(cached)
+            except ValueError:
+                pass
 
     # Get Jython helper : 
     jython_status = fab.run('test -f ~/fab/jython.jar', quiet=True)
@@ -238,54 +306,116 @@ def get_cassandra_config_options():
         fab.abort('Failed to run Jython Config parser : ' + out.stderr)
     opts = yaml.load(out)
     p = re.compile("^[a-z][^A-Z]*$")
-    return [o for o in opts if p.match(o)]
-    
-@fab.parallel
-def bootstrap(git_fetch=True):
-    """Install and configure Cassandra on each host
+    opts = [o for o in opts if p.match(o)]
+
+    if git_id is not None and is_build_cached(git_id):
+        fab.put(StringIO(json.dumps(opts)), cache_file)
+    return opts
     
+def get_git_fetch_refspecs(revisions):
+    """Get the git fetch arguments needed to fetch just the given revisions
+
+    Revisions of the form 'remote/branch' fetch only that branch from
+    that remote. Returns the fetch arguments of each remote (the remote
+    followed by it's refspecs), or None if any revision can't be mapped
+    to a remote branch this way (a SHA, or a tag), meaning that every
+    remote needs to be fetched."""
+    remotes = dict(git_repos)
+    refspecs = {}
+    for revision in revisions:
+        parts = revision.split('/', 1)
+        if len(parts) != 2 or parts[0] not in remotes:
+            return None
+        name, branch = parts
+        refspecs.setdefault(name, [name]).append('+refs/heads/{branch}:refs/remotes/{name}/{branch}'.format(
+            name=name, branch=branch))
+    return [" ".join(args) for name, args in sorted(refspecs.items())]
+
+def git_fetch_remotes(revisions=None):
+    """Fetch the git remotes, several at a time
+
+    revisions - the revisions that will be checked out. If the
+    'git_fetch_revisions_only' setting is enabled, only the branches
+    these name will be fetched.
+    """
+    concurrency = max(1, int(config['git_fetch_concurrency']))
+    refspecs = None
+    if revisions and config['git_fetch_revisions_only']:
+        refspecs = get_git_fetch_refspecs(revisions)
+    if refspecs is None:
+        # git runs the fetches itself, so they don't race on the refs or
+        # auto gc:
+        fab.run('git --git-dir=$HOME/fab/cassandra.git fetch --multiple --jobs={concurrency} {remotes}'.format(
+            remotes=" ".join(name for name, url in reversed(git_repos)), concurrency=concurrency))
+        return
+    # One fetch per remote, without auto gc, retried in case another
+    # fetch held a lock on the refs, then gc once they're done:
+    fab.run('echo -e "{refspecs}" | xargs -L 1 -P {concurrency} sh -c \''
+            'for attempt in 1 2 3; do git -c gc.auto=0 --git-dir=$HOME/fab/cassandra.git fetch "$@" && exit 0; sleep 1; done; exit 1'
+            '\' git-fetch'.format(refspecs="\n".join(refspecs), concurrency=concurrency))
+    fab.run('git --git-dir=$HOME/fab/cassandra.git gc --auto')
+
+def build(git_fetch=True, revisions=None, stats=None):
+    """Fetch, build and install the configured revision to ~/fab/cassandra on the current host
+
+    Builds are cached in ~/fab/cassandra_builds by git SHA, so a
+    revision is only built once per host.
+
+    stats - an optional dictionary to record build cache statistics to.
+
     Returns the git id for the version checked out.
     """
+    if stats is None:
+        stats = {}
     revision = config['revision']
-    partitioner = config['partitioner']
 
-    fab.run('mkdir -p fab')
+    script = RemoteScript()
+    script.run('mkdir -p fab')
 
     #Fetch latest git changes:
     if git_fetch:
-        git_checkout_status = fab.run('test -d ~/fab/cassandra.git', quiet=True)
-        if git_checkout_status.return_code > 0:
-            fab.run('git init --bare ~/fab/cassandra.git')
-            for name,url in git_repos:
-                fab.run('git --git-dir=$HOME/fab/cassandra.git remote add {name} {url}'
-                        .format(name=name, url=url), quiet=True)
-
-        for name,url in reversed(git_repos):
-            fab.run('git --git-dir=$HOME/fab/cassandra.git fetch {name}'.format(name=name))
-            # TODO: What did this used to do? This used to be necessary,
-            # but now it appears to delete branches: 
-            # fab.run('git --git-dir=$HOME/fab/cassandra.git fetch -fup {name} +refs/*:refs/*'
-            #         .format(name=name))
-
-    fab.run('rm -rf ~/fab/cassandra')
-
+        script.run('test -d ~/fab/cassandra.git || git init --bare ~/fab/cassandra.git')
+        for name,url in git_repos:
+            # Fails if the remote was already added:
+            script.run('git --git-dir=$HOME/fab/cassandra.git remote add {name} {url}'
+                       .format(name=name, url=url), ignore_errors=True)
+        script.execute()
+
+        git_fetch_remotes(revisions)
+    else:
+        script.execute()
+        # TODO: What did this used to do? This used to be necessary,
+        # but now it appears to delete branches: 
+        # fab.run('git --git-dir=$HOME/fab/cassandra.git fetch -fup {name} +refs/*:refs/*'
+        #         .format(name=name))
+
+    script = RemoteScript()
+    script.run('rm -rf ~/fab/cassandra')
     # Find the SHA for the revision requested:
-    git_id = fab.run('git --git-dir=$HOME/fab/cassandra.git rev-parse {revision}'.format(revision=revision)).strip()
+    rev_parse = 'git --git-dir=$HOME/fab/cassandra.git rev-parse {revision}'.format(revision=revision)
+    script.run(rev_parse, name='git_id')
     # Check if we have already built the revision requested.
     # This speeds up consecutive runs of the same revision.
-    fab.run('mkdir -p ~/fab/cassandra_builds')
-    test_already_built = fab.run('test -d ~/fab/cassandra_builds/{git_id}'.format(git_id=git_id), quiet=True)
-    if test_already_built.return_code == 0:
+    script.run('mkdir -p ~/fab/cassandra_builds')
+    script.run('test -d ~/fab/cassandra_builds/$({rev_parse})'.format(rev_parse=rev_parse),
+               name='cached', ignore_errors=True)
+    results = script.execute()
+    git_id = result_by_name(results, 'git_id').output.strip()
+    if result_by_name(results, 'cached').return_code == 0:
         # Copy previously built Cassandra
-        fab.run('cp -a ~/fab/cassandra_builds/{git_id} ~/fab/cassandra'.format(git_id=git_id))
+        restore_cached_build(git_id, stats)
     else:
+        stats['hit'] = False
+        start = time.time()
         # Build Cassandra
         # Checkout revision/tag:
-        fab.run('mkdir ~/fab/cassandra')
-        fab.run('git --git-dir=$HOME/fab/cassandra.git archive %s |'
-                ' tar x -C ~/fab/cassandra' % revision)
-        fab.run('echo -e \'%s\\n%s\\n%s\' > ~/fab/cassandra/0.GIT_REVISION.txt' % 
-                (revision, git_id, config.get('log','')))
+        script = RemoteScript()
+        script.run('mkdir ~/fab/cassandra')
+        script.run('git --git-dir=$HOME/fab/cassandra.git archive %s |'
+                   ' tar x -C ~/fab/cassandra' % revision)
+        script.put('%s\n%s\n%s\n' % (revision, git_id, config.get('log','')),
+                   '~/fab/cassandra/0.GIT_REVISION.txt')
+        script.execute()
 
         fab.run('JAVA_HOME={java_home} ~/fab/ant/bin/ant -f ~/fab/cassandra/build.xml clean'.format(java_home=config['java_home']))
         if config['override_version'] is not None:
@@ -293,48 +423,226 @@ def bootstrap(git_fetch=True):
         else:
             fab.run('JAVA_HOME={java_home} ~/fab/ant/bin/ant -f ~/fab/cassandra/build.xml'.format(java_home=config['java_home']))
 
+        stats['build_seconds'] = time.time() - start
+
         # Archive this build for future runs:
-        fab.run('cp -a ~/fab/cassandra ~/fab/cassandra_builds/{git_id}'.format(git_id=git_id))
+        cache_build(git_id, stats)
 
-        # Remove old builds:
-        num_builds = int(fab.run('ls -1 ~/fab/cassandra_builds | wc -l').strip())
-        if num_builds > MAX_CACHED_BUILDS:
-            fab.run('ls -t1 ~/fab/cassandra_builds | tail -n {num_to_delete} | xargs -iXX rm -rf ~/fab/cassandra_builds/XX'.format(
-                num_to_delete=num_builds-MAX_CACHED_BUILDS))
+    return git_id
 
-    # Get host config:
-    try:
-        cfg = config['hosts'][fab.env.host]
-    except KeyError:
-        # If host has no config, don't configure it. This is used for
-        # compiling the source on the controlling node which is
-        # usually not a part of the cluster.
-        return git_id
+def is_build_cached(git_id):
+    """Check if a build of the given git SHA is in the build cache"""
+    fab.run('mkdir -p ~/fab/cassandra_builds')
+    test_already_built = fab.run('test -d ~/fab/cassandra_builds/{git_id}'.format(git_id=git_id), quiet=True)
+    return test_already_built.return_code == 0
+
+def copy_build(src, dest):
+    """Copy a build directory, according to the 'build_cache_restore' setting
+
+    'hardlink' - hardlink every file, except the conf directory which is
+                 rewritten in place when the node is configured. Sstables
+                 aside, nothing else in the build is ever modified.
+    'reflink'  - copy-on-write copy, on filesystems that support it,
+                 otherwise a full copy.
+    'copy'     - full copy.
+    """
+    fab.run(copy_build_command(src, dest))
+
+def copy_build_command(src, dest):
+    """Get the shell command for copy_build"""
+    mode = config['build_cache_restore']
+    if mode == 'hardlink':
+        return 'cp -al {src} {dest} && rm -rf {dest}/conf && cp -a {src}/conf {dest}/conf'.format(src=src, dest=dest)
+    elif mode == 'reflink':
+        return 'cp -a --reflink=auto {src} {dest}'.format(src=src, dest=dest)
+    elif mode == 'copy':
+        return 'cp -a {src} {dest}'.format(src=src, dest=dest)
+    else:
+        raise ValueError('Unknown build_cache_restore mode: {mode}'.format(mode=mode))
+
+def restore_cached_build(git_id, stats=None):
+    """Install a build from the build cache to ~/fab/cassandra"""
+    if stats is None:
+        stats = {}
+    start = time.time()
+    script = RemoteScript()
+    script.run(copy_build_command('~/fab/cassandra_builds/{git_id}'.format(git_id=git_id), '~/fab/cassandra'))
+    # The directory mtime records when the build was last used, for
+    # evicting the least recently used builds:
+    script.run('touch ~/fab/cassandra_builds/{git_id}'.format(git_id=git_id))
+    script.execute()
+    stats['hit'] = True
+    stats['restore_seconds'] = time.time() - start
+
+def cache_build(git_id, stats=None):
+    """Archive the build in ~/fab/cassandra to the build cache"""
+    if stats is None:
+        stats = {}
+    copy_build('~/fab/cassandra', '~/fab/cassandra_builds/{git_id}'.format(git_id=git_id))
+    stats['evicted'] = evict_cached_builds(keep=git_id)
+
+def evict_cached_builds(keep=None):
+    """Remove the least recently used builds until the build cache fits
+    within the 'build_cache_max_bytes' and MAX_CACHED_BUILDS limits
+
+    keep - a git id to never evict (the build being installed)
+
+    Returns the git ids that were evicted.
+    """
+    # One line per build: last use time, size in bytes, git id
+    listing = fab.run('cd ~/fab/cassandra_builds && for d in */; do '
+                      'echo "$(stat -c %Y "$d") $(du -sb "$d" | cut -f1) ${d%/}"; done', quiet=True)
+    builds = []
+    for line in listing.splitlines():
+        try:
+            last_used, size, build_id = line.split()
+            builds.append((int(last_used), int(size), build_id))
+        except ValueError:
+            continue
+    builds.sort()
+    total_bytes = sum(size for last_used, size, build_id in builds)
+    num_builds = len(builds)
+    evicted = []
+    for last_used, size, build_id in builds:
+        if total_bytes <= config['build_cache_max_bytes'] and num_builds <= MAX_CACHED_BUILDS:
+            break
+        if build_id == keep:
+            continue
+        fab.run('rm -rf ~/fab/cassandra_builds/{build_id}'.format(build_id=build_id))
+        total_bytes -= size
+        num_builds -= 1
+        evicted.append(build_id)
+    return evicted
+
+@fab.parallel
+def bootstrap(git_fetch=True, revisions=None, configure=True, config_options=None):
+    """Install and configure Cassandra on each host
+
+    git_fetch - fetch the git remotes before checking out the revision
+    revisions - every revision the caller intends to run, used to limit
+                which branches are fetched (see git_fetch_remotes)
+    configure - configure the hosts that are part of the cluster. If
+                False, only install the build, see configure_cassandra.
+    config_options - the list of valid cassandra.yaml options for the
+                     build, see get_cassandra_config_options.
+    
+    Returns a dictionary with the git id for the version checked out,
+    and the build cache statistics.
+    """
+    stats = {}
+    git_id = build(git_fetch=git_fetch, revisions=revisions, stats=stats)
+
+    # If host has no config, don't configure it. This is used for
+    # compiling the source on the controlling node which is
+    # usually not a part of the cluster.
+    if configure and fab.env.host in config['hosts']:
+        configure_host(config_options, git_id)
+    return {'git_id': git_id, 'build_cache': stats}
+
+def build_artifact(git_fetch=True, revisions=None):
+    """Build the configured revision on the current host and package it for distribution
+
+    Intended to be run only on the controlling node, see install_artifact.
+
+    Returns a dictionary describing the artifact: git_id, path and
+    sha256, along with the build cache statistics.
+    """
+    stats = {}
+    git_id = build(git_fetch=git_fetch, revisions=revisions, stats=stats)
+
+    fab.run('mkdir -p ~/fab/cassandra_artifacts')
+    path = fab.run('readlink -m ~/fab/cassandra_artifacts/{git_id}.tar.gz'.format(git_id=git_id)).strip()
+    if fab.run('test -f {path}'.format(path=path), quiet=True).return_code != 0:
+        # Write to a temporary name first, so an interrupted packaging
+        # is never mistaken for a complete artifact:
+        fab.run('tar czf {path}.tmp -C ~/fab/cassandra_builds/{git_id} . && mv {path}.tmp {path}'.format(
+            path=path, git_id=git_id))
+    sha256 = fab.run('sha256sum {path}'.format(path=path)).split()[0]
+    return {'git_id': git_id, 'path': path, 'sha256': sha256, 'build_cache': stats}
+
+@fab.parallel
+def install_artifact(artifact, config_options=None):
+    """Install and configure a build artifact from build_artifact on each host
+
+    The artifact is copied from the controlling node and verified
+    against it's checksum before it's installed, unless the host already
+    has the build cached.
+
+    Returns a dictionary with the git id of the installed build, and
+    the build cache statistics.
+    """
+    git_id = artifact['git_id']
+    stats = {}
+    script = RemoteScript()
+    script.run('mkdir -p fab ~/fab/cassandra_builds ~/fab/cassandra_artifacts')
+    script.run('rm -rf ~/fab/cassandra')
+    script.run('test -d ~/fab/cassandra_builds/{git_id}'.format(git_id=git_id), name='cached', ignore_errors=True)
+    if result_by_name(script.execute(), 'cached').return_code != 0:
+        stats['hit'] = False
+        start = time.time()
+        remote_path = '~/fab/cassandra_artifacts/{git_id}.tar.gz'.format(git_id=git_id)
+        ssh_pool.put(artifact['path'], remote_path)
+        script = RemoteScript()
+        script.run('echo "{sha256}  $HOME/fab/cassandra_artifacts/{git_id}.tar.gz" | sha256sum -c --status || '
+                   '{{ echo "Checksum mismatch for build artifact {git_id}: expected {sha256}, got $(sha256sum {remote_path})"; '
+                   'rm -f {remote_path}; exit 1; }}'.format(sha256=artifact['sha256'], remote_path=remote_path, git_id=git_id))
+        script.run('mkdir ~/fab/cassandra && tar xzf {remote_path} -C ~/fab/cassandra'.format(remote_path=remote_path))
+        script.run('rm -f {remote_path}'.format(remote_path=remote_path))
+        script.execute()
+        stats['transfer_seconds'] = time.time() - start
+        cache_build(git_id, stats)
+    else:
+        restore_cached_build(git_id, stats)
+
+    if fab.env.host in config['hosts']:
+        configure_host(config_options, git_id)
+    return {'git_id': git_id, 'build_cache': stats}
+
+@fab.parallel
+def configure_cassandra(config_options=None):
+    """Configure the Cassandra already installed on each host of the cluster"""
+    if fab.env.host in config['hosts']:
+        configure_host(config_options)
+
+def configure_host(config_options=None, git_id=None):
+    """Configure the Cassandra installed in ~/fab/cassandra for the current host
+
+    config_options - the list of valid cassandra.yaml options for the
+                     build. Found with get_cassandra_config_options if
+                     not given.
+    git_id - the git id of the build, used to cache the config options
+    """
+    partitioner = config['partitioner']
+    cfg = config['hosts'][fab.env.host]
+
+    # Read what's needed from the host in one round trip, the rest of
+    # the configuration is written in another:
+    query = RemoteScript()
+    query.run('cat ~/fab/cassandra/conf/cassandra.yaml', name='yaml')
+    # Get absolute path to log dir:
+    query.run('readlink -m {log_dir}'.format(log_dir=config['log_dir']), name='log_dir')
+    results = query.execute()
+    script = RemoteScript()
 
     #Ensure JNA is available:
     if config['use_jna']:
-        # Check if JNA already exists:
-        jna_exists = fab.run('ls ~/fab/cassandra/lib/jna*.jar', quiet=True)
-        if jna_exists.return_code != 0:
-            # Symlink system JNA to cassandra lib dir:
-            jna_candidates = ['/usr/share/java/jna/jna.jar', '/usr/share/java/jna.jar']
-            for jar in jna_candidates:
-                if fab.run('ls {jar}'.format(jar=jar), quiet=True).return_code == 0:
-                    fab.run('ln -s {jar} ~/fab/cassandra/lib/jna.jar'.format(jar=jar))
-                    break
-            else:
-                raise AssertionError('Could not force JNA loading, no JNA jar found.')
+        # Check if JNA already exists, otherwise symlink system JNA to
+        # cassandra lib dir:
+        jna_candidates = ['/usr/share/java/jna/jna.jar', '/usr/share/java/jna.jar']
+        script.run(
+            'ls ~/fab/cassandra/lib/jna*.jar > /dev/null 2>&1 && exit 0; '
+            'for jar in {jars}; do [ -e $jar ] && ln -s $jar ~/fab/cassandra/lib/jna.jar && exit 0; done; '
+            'echo "Could not force JNA loading, no JNA jar found."; exit 1'.format(jars=" ".join(jna_candidates)))
     else:
-        fab.run('rm -f ~/fab/cassandra/lib/jna*')
+        script.run('rm -f ~/fab/cassandra/lib/jna*')
 
     # Configure cassandra.yaml:
-    conf_file = StringIO()
-    fab.get('~/fab/cassandra/conf/cassandra.yaml', conf_file)
-    conf_file.seek(0)
-    cass_yaml = yaml.load(conf_file.read())
+    cass_yaml = yaml.load(result_by_name(results, 'yaml').output)
 
     # Get the canonical list of options from the c* source code:
-    cstar_config_opts = get_cassandra_config_options()
+    if config_options is None:
+        config_options = get_cassandra_config_options(git_id)
+    cstar_config_opts = config_options
 
     # Cassandra YAML values can come from two places: 
     # 1) Set as options at the top level of the config. This is how
@@ -377,58 +685,185 @@ def bootstrap(git_fetch=True):
 
     if config['endpoint_snitch'] == 'PropertyFileSnitch':
         cass_yaml['endpoint_snitch'] = 'PropertyFileSnitch'
-        fab.run("echo 'default=dc1:r1' > fab/cassandra/conf/cassandra-topology.properties")
+        topology = ['default=dc1:r1']
         for node in config['hosts'].values():
-            line = '%s=%s:%s' % (node['external_ip'], node.get('datacenter', 'dc1'), node.get('rack', 'r1'))
-            fab.run("echo '%s' >> fab/cassandra/conf/cassandra-topology.properties" % line)
+            topology.append('%s=%s:%s' % (node['external_ip'], node.get('datacenter', 'dc1'), node.get('rack', 'r1')))
+        script.put("\n".join(topology) + "\n", 'fab/cassandra/conf/cassandra-topology.properties')
     if config['endpoint_snitch'] == "GossipingPropertyFileSnitch":
         cass_yaml['endpoint_snitch'] = 'GossipingPropertyFileSnitch'
-        fab.run("echo 'dc={dc}\nrack={rack}' > fab/cassandra/conf/cassandra-rackdc.properties".format(
-            dc=cfg.get('datacenter','dc1'), rack=cfg.get('rack','r1')))
+        script.put('dc={dc}\nrack={rack}\n'.format(dc=cfg.get('datacenter','dc1'), rack=cfg.get('rack','r1')),
+                   'fab/cassandra/conf/cassandra-rackdc.properties')
 
     # Save config:
-    conf_file = StringIO()
-    conf_file.write(yaml.safe_dump(cass_yaml, encoding='utf-8', allow_unicode=True))
-    conf_file.seek(0)
-    fab.put(conf_file, '~/fab/cassandra/conf/cassandra.yaml')
+    script.put(yaml.safe_dump(cass_yaml, encoding='utf-8', allow_unicode=True),
+               '~/fab/cassandra/conf/cassandra.yaml')
 
     # Configure logback:
-    logback_conf = StringIO()
-    # Get absolute path to log dir:
-    log_dir = fab.run("readlink -m {log_dir}".format(log_dir=config['log_dir']))
-    logback_conf.write(logback_template.replace("${cassandra.logdir}",log_dir))
-    logback_conf.seek(0)
-    fab.put(logback_conf, '~/fab/cassandra/conf/logback.xml')
+    log_dir = result_by_name(results, 'log_dir').output.strip()
+    script.put(logback_template.replace("${cassandra.logdir}",log_dir), '~/fab/cassandra/conf/logback.xml')
 
     # Configure log4j:
-    log4j_conf = StringIO()
-    log4j_conf.write(log4j_template.replace("${cassandra.logdir}",log_dir))
-    log4j_conf.seek(0)
-    fab.put(log4j_conf, '~/fab/cassandra/conf/log4j-server.properties')
+    script.put(log4j_template.replace("${cassandra.logdir}",log_dir),
+               '~/fab/cassandra/conf/log4j-server.properties')
 
     # Copy fincore utility:
     fincore_script = os.path.join(os.path.dirname(os.path.realpath(__file__)),'fincore_capture.py')
-    fab.put(fincore_script, '~/fab/fincore_capture.py')
-    return git_id
+    script.put_file(fincore_script, '~/fab/fincore_capture.py')
+    # Copy sysstat utility:
+    sysstat_script = os.path.join(os.path.dirname(os.path.realpath(__file__)),'sysstat_capture.py')
+    script.put_file(sysstat_script, '~/fab/sysstat_capture.py')
+    script.execute()
 
 @fab.parallel
 def destroy(leave_data=False):
-    """Uninstall Cassandra and clean up data and logs"""
+    """Uninstall Cassandra and clean up data and logs
+
+    Returns the result of each remote step, see RemoteScript."""
+    script = RemoteScript()
     # We used to have a better pattern match for the Cassandra
     # process, but it got fragile if you put too many JVM params. 
-    fab.run('killall -9 java', quiet=True)
-    fab.run('pkill -f "python.*fincore_capture"', quiet=True)
-    fab.run('rm -rf fab/cassandra')
-    fab.run('rm -rf fab/scripts')
-    fab.run('rm -f fab/nohup.log')
+    script.run('killall -9 java', ignore_errors=True)
+    script.run('pkill -f "python.*fincore_capture"', ignore_errors=True)
+    script.run('pkill -f "python.*sysstat_capture"', ignore_errors=True)
+    script.run('rm -rf fab/cassandra')
+    script.run('rm -rf fab/scripts')
+    script.run('rm -f fab/nohup.log')
     if not leave_data:
         for d in config['data_file_directories']:
-            fab.run('rm -rf {data}/*'.format(data=d))
-        fab.run('rm -rf {saved_caches_directory}/*'.format(saved_caches_directory=config['saved_caches_directory']))
-        fab.run('rm -rf {commitlog}/*'.format(commitlog=config['commitlog_directory']))
-        fab.run('rm -rf {flushdir}/*'.format(flushdir=config['flush_directory']))
-    fab.run('rm -rf {log_dir}'.format(log_dir=config['log_dir']))
-    fab.run('rm -f /tmp/fincore.stats.log')
+            script.run('rm -rf {data}/*'.format(data=d))
+        script.run('rm -rf {saved_caches_directory}/*'.format(saved_caches_directory=config['saved_caches_directory']))
+        script.run('rm -rf {commitlog}/*'.format(commitlog=config['commitlog_directory']))
+        script.run('rm -rf {flushdir}/*'.format(flushdir=config['flush_directory']))
+    script.run('rm -rf {log_dir}'.format(log_dir=config['log_dir']))
+    script.run('rm -f /tmp/fincore.stats.log')
+    script.run('rm -f /tmp/sysstat.log')
+    return script.execute()
+
+@fab.parallel
+def save_installation(slot):
+    """Move the installed Cassandra to ~/fab/cassandra_revisions/<slot>
+
+    Several revisions can be installed side by side this way, and
+    switched between with activate_installation, without rebuilding or
+    reinstalling them."""
+    script = RemoteScript()
+    script.run('mkdir -p ~/fab/cassandra_revisions')
+    script.run('rm -rf ~/fab/cassandra_revisions/{slot}'.format(slot=slot))
+    script.run('mv ~/fab/cassandra ~/fab/cassandra_revisions/{slot}'.format(slot=slot))
+    return script.execute()
+
+@fab.parallel
+def activate_installation(slot):
+    """Make ~/fab/cassandra a link to the installation saved as slot, see save_installation"""
+    script = RemoteScript()
+    script.run('test -d ~/fab/cassandra_revisions/{slot}'.format(slot=slot))
+    script.run('rm -rf ~/fab/cassandra')
+    script.run('ln -s ~/fab/cassandra_revisions/{slot} ~/fab/cassandra'.format(slot=slot))
+    return script.execute()
+
+@fab.parallel
+def remove_installations():
+    """Remove all the installations saved with save_installation"""
+    script = RemoteScript()
+    script.run('test -L ~/fab/cassandra && rm -f ~/fab/cassandra', ignore_errors=True)
+    script.run('rm -rf ~/fab/cassandra_revisions')
+    return script.execute()
+
+# Matches the format version in an sstable component name, eg. 'jb' in
+# ks-cf-jb-1-Data.db, or 'ma' in ma-1-big-Data.db:
+sstable_version_re = re.compile(r'(?:^|-)([a-z]{2})-\d+-(?:[a-z]+-)?Data\.db$')
+
+def sstable_version(filename):
+    """Get the format version of an sstable from one of it's file names, or None"""
+    match = sstable_version_re.search(os.path.basename(filename))
+    return match.group(1) if match else None
+
+@fab.parallel
+def get_sstable_format_version():
+    """Get the sstable format version the running node writes, from the system keyspace"""
+    java_home = config['java_home']
+    ssh_pool.run('JAVA_HOME={java_home} ~/fab/cassandra/bin/nodetool flush system'.format(java_home=java_home))
+    listing = ssh_pool.run('find {directories} -path "*/system/*" -name "*Data.db"'.format(
+        directories=" ".join(config['data_file_directories'])), quiet=True)
+    versions = [sstable_version(f) for f in listing.splitlines()]
+    versions = sorted(set(v for v in versions if v is not None))
+    return versions[-1] if versions else None
+
+def dataset_directories():
+    """The directories a dataset snapshot is taken of"""
+    return config['data_file_directories'] + [config['flush_directory']]
+
+@fab.parallel
+def has_dataset(key):
+    """Is a complete snapshot of the dataset with this key on the node?"""
+    tests = " && ".join('test -f {d}.datasets/{key}.complete'.format(d=d, key=key) for d in dataset_directories())
+    return ssh_pool.run(tests, quiet=True).return_code == 0
+
+@fab.parallel
+def capture_dataset(key, cluster_name):
+    """Snapshot the data directories of the stopped node as the dataset with this key
+
+    Each data directory is hardlinked to <directory>.datasets/<key>,
+    which takes no time or space until the sstables are compacted
+    away. A <key>.complete file, holding the cluster name recorded in
+    the system keyspace, marks the snapshot as usable.
+
+    Returns the datasets evicted, see 'dataset_cache_keep'."""
+    script = RemoteScript()
+    for d in dataset_directories():
+        snapshot = '{d}.datasets/{key}'.format(d=d, key=key)
+        script.run('mkdir -p {d}.datasets && rm -rf {snapshot} {snapshot}.tmp {snapshot}.complete'.format(
+            d=d, snapshot=snapshot))
+        # Directories on another filesystem can't be hardlinked:
+        script.run('cp -al {d} {snapshot}.tmp || (rm -rf {snapshot}.tmp && cp -a {d} {snapshot}.tmp)'.format(
+            d=d, snapshot=snapshot))
+        script.run('mv {snapshot}.tmp {snapshot}'.format(snapshot=snapshot))
+    for d in dataset_directories():
+        script.run('echo {cluster_name} > {d}.datasets/{key}.complete'.format(
+            cluster_name=pipes.quote(cluster_name), d=d, key=key))
+    script.execute()
+    return evict_datasets(keep=key)
+
+def evict_datasets(keep=None):
+    """Remove the least recently used dataset snapshots beyond the 'dataset_cache_keep' setting"""
+    first = dataset_directories()[0]
+    listing = ssh_pool.run('ls -t {d}.datasets/*.complete'.format(d=first), quiet=True)
+    if listing.return_code != 0:
+        return []
+    keys = [os.path.basename(f)[:-len('.complete')] for f in listing.split()]
+    evicted = [k for k in keys if k != keep][max(0, config['dataset_cache_keep'] - 1):]
+    for key in evicted:
+        ssh_pool.run(" && ".join('rm -rf {d}.datasets/{key}.complete {d}.datasets/{key}'.format(d=d, key=key)
+                                 for d in dataset_directories()))
+    return evicted
+
+@fab.parallel
+def restore_dataset(key):
+    """Replace the data of the stopped node with the dataset snapshot with this key
+
+    Data and index files are hardlinked from the snapshot, and the
+    other components (which cassandra may rewrite in place) are copied.
+    The cluster name is set to the one recorded in the snapshot's
+    system keyspace.
+
+    Returns the cluster name of the dataset."""
+    script = RemoteScript()
+    for d in dataset_directories():
+        snapshot = '{d}.datasets/{key}'.format(d=d, key=key)
+        script.run('rm -rf {d}/*'.format(d=d))
+        script.run('cp -al {snapshot}/. {d}/ || cp -a {snapshot}/. {d}/'.format(d=d, snapshot=snapshot))
+        script.run('find {d} -type f ! -name "*-Data.db" ! -name "*-Index.db" -exec sh -c '
+                   '\'cp -p "$1" "$1.tmp" && mv "$1.tmp" "$1"\' _ {{}} \\;'.format(d=d))
+        # The marker's mtime records when the dataset was last used:
+        script.run('touch {snapshot}.complete'.format(snapshot=snapshot))
+    script.run('rm -rf {commitlog}/* {saved_caches}/*'.format(
+        commitlog=config['commitlog_directory'], saved_caches=config['saved_caches_directory']))
+    marker = '{d}.datasets/{key}.complete'.format(d=dataset_directories()[0], key=key)
+    script.run('cat {marker}'.format(marker=marker), name='cluster_name')
+    script.run('sed -i "s|^cluster_name:.*|cluster_name: \'$(cat {marker})\'|" ~/fab/cassandra/conf/cassandra.yaml'.format(
+        marker=marker))
+    results = script.execute()
+    return result_by_name(results, 'cluster_name').output.strip()
 
 @fab.parallel
 def start():
@@ -444,73 +879,54 @@ def start():
     env += "\n"
     if not config['use_jna']:
         env = 'JVM_EXTRA_OPTS=-Dcassandra.boot_without_jna=true\n\n' + env
+    env_script = "~/fab/scripts/{name}.sh".format(name=uuid.uuid1())
+    script = RemoteScript()
+    script.run('mkdir -p ~/fab/cassandra/logs ~/fab/scripts')
     # Turn on GC logging:
-    fab.run("mkdir -p ~/fab/cassandra/logs")
-    log_dir = fab.run("readlink -m {log_dir}".format(log_dir=config['log_dir']))
-    env = "JVM_OPTS=\"$JVM_OPTS -Djava.rmi.server.hostname={hostname} -Xloggc:{log_dir}/gc.log\"\n\n".format(
-        hostname=fab.env.host, log_dir=log_dir) + env
-
-    env_script = "{name}.sh".format(name=uuid.uuid1())
-    env_file = StringIO(env)
-    fab.run('mkdir -p ~/fab/scripts')
-    fab.put(env_file, '~/fab/scripts/{env_script}'.format(env_script=env_script))
-
-    if len(env_script) > 0:
-        fab.run('echo >> ~/fab/scripts/{env_script}'.format(**locals()))
-        fab.run('cat ~/fab/cassandra/conf/cassandra-env.sh >> ~/fab/scripts/{env_script}'.format(**locals()))
-        fab.run('cp ~/fab/scripts/{env_script} ~/fab/cassandra/conf/cassandra-env.sh'.format(**locals()))
+    script.run('echo "JVM_OPTS=\\"\\$JVM_OPTS -Djava.rmi.server.hostname={hostname} -Xloggc:$(readlink -m {log_dir})/gc.log\\""'
+               ' > {env_script} && echo >> {env_script}'.format(
+                   hostname=fab.env.host, log_dir=config['log_dir'], env_script=env_script))
+    script.put(env, env_script, append=True)
+    script.run('echo >> {env_script}'.format(**locals()))
+    # Keep the original cassandra-env.sh, so starting the same install
+    # again (see activate_installation) doesn't prepend the environment
+    # twice:
+    script.run('test -f ~/fab/cassandra/conf/cassandra-env.sh.orig || '
+               'cp ~/fab/cassandra/conf/cassandra-env.sh ~/fab/cassandra/conf/cassandra-env.sh.orig')
+    script.run('cat ~/fab/cassandra/conf/cassandra-env.sh.orig >> {env_script}'.format(**locals()))
+    script.run('cp {env_script} ~/fab/cassandra/conf/cassandra-env.sh'.format(**locals()))
 
     fab.puts("Starting Cassandra..")
+    # Record the start time, to place the GC log uptime stamps in time
+    # (see gc_log.py):
+    script.run('mkdir -p {log_dir} && date +%s.%N > $(readlink -m {log_dir})/jvm_start_time'.format(
+        log_dir=config['log_dir']))
     cmd = 'JAVA_HOME={java_home} nohup ~/fab/cassandra/bin/cassandra'.format(java_home=config['java_home'])
-    fab.run(cmd)
+    script.run(cmd)
+    return script.execute()
 
 @fab.parallel
 def stop(clean=True):
     if clean:
-        fab.run('pkill -f "java.*org.apache.*.CassandraDaemon"', quiet=True)
-    else:
-        fab.run('pkill -9 -f "java.*org.apache.*.CassandraDaemon"', quiet=True)
-
-def ensure_running(retries=15, wait=10):
-    """Ensure cassandra is running on all nodes.
-    Runs 'nodetool ring' on a single node continuously until it 
-    reaches the specified number of retries.
-    
-    INTENDED TO BE RUN ON ONE NODE, NOT ALL.
-    """
-    time.sleep(15)
-    for attempt in range(retries):
-        ring = StringIO(fab.run('JAVA_HOME={java_home} ~/fab/cassandra/bin/nodetool ring'.format(java_home=config['java_home'])))
-        broadcast_ips = [x.get('external_ip', x['internal_ip']) for x in config['hosts'].values()]
-        nodes_up = dict((host,False) for host in broadcast_ips)
-        for line in ring:
-            for host in broadcast_ips:
-                if host in line and " Up " in line:
-                    nodes_up[host] = True
-        for node,up in nodes_up.items():
-            if not up:
-                fab.puts("Node is not up (yet): %s" % node)
-        if False not in nodes_up.values():
-            fab.puts("All nodes available!")
-            return
-        fab.puts("waiting %d seconds to try again.." % wait)
-        time.sleep(wait)
+        ssh_pool.run('pkill -f "java.*org.apache.*.CassandraDaemon"', quiet=True)
     else:
-        fab.abort("Timed out waiting for all nodes to startup")
+        ssh_pool.run('pkill -9 -f "java.*org.apache.*.CassandraDaemon"', quiet=True)
 
 @fab.parallel
-def ensure_stopped(retries=15, wait=10):
+def ensure_stopped(timeout=150, interval=0.5):
     """Ensure cassandra is stopped on all nodes.
-    Checks continuously until it reaches the specified number of retries."""
-    for attempt in range(retries):
-        pgrep = fab.run('pgrep -f "java.*org.apache.*.CassandraDaemon"', quiet=True)
-        if pgrep.return_code != 0:
-            fab.puts('Cassandra shutdown.')
-            return
-        fab.puts("waiting %d seconds to try again.." % wait)
-        time.sleep(wait)
-    else:
+    Checks every interval seconds, on the node itself, until timeout.
+
+    Returns the number of seconds it took for cassandra to stop."""
+    start = time.time()
+    # [j]ava keeps pgrep from matching the bash running this loop:
+    result = ssh_pool.run('for i in $(seq {checks}); do pgrep -f "[j]ava.*org.apache.*.CassandraDaemon" > /dev/null || exit 0; '
+                          'sleep {interval}; done; exit 1'.format(checks=int(timeout / interval) + 1, interval=interval),
+                          quiet=True)
+    if result.return_code != 0:
         fab.abort("Timed out waiting for all nodes to stop")
+    fab.puts('Cassandra shutdown.')
+    return time.time() - start
 
 @fab.parallel
 def install_java(packages=None):
@@ -550,25 +966,171 @@ def copy_logs(local_directory):
     cfg = config['hosts'][fab.env.host]
     host_log_dir = os.path.join(local_directory, cfg['hostname'])
     os.mkdir(host_log_dir)
-    fab.get(os.path.join(config['log_dir'],'*'), host_log_dir)
+    ssh_pool.get(os.path.join(config['log_dir'],'*'), host_log_dir)
+
+# The number of bytes at the start of a log file fingerprinted, to
+# notice files truncated or replaced in place (see fetch_log_segments):
+LOG_FINGERPRINT_BYTES = 4096
+
+def log_fingerprints(lengths):
+    """Get the md5 of the first bytes of remote files
+
+    lengths - a list of (path, number of bytes) to fingerprint
+
+    Returns a dictionary of (path, number of bytes) -> md5"""
+    if not lengths:
+        return {}
+    output = ssh_pool.run("; ".join('echo "{n} {length} $(head -c {length} {path} | md5sum)"'.format(
+        n=n, length=length, path=pipes.quote(path)) for n, (path, length) in enumerate(lengths)), quiet=True)
+    fingerprints = {}
+    for line in output.splitlines():
+        fields = line.strip().split()
+        if len(fields) >= 3 and fields[0].isdigit() and int(fields[0]) < len(lengths):
+            fingerprints[lengths[int(fields[0])]] = fields[2]
+    return fingerprints
+
+@fab.parallel
+def fetch_log_segments(paths, known, local_directory):
+    """Copy the parts of the node's log files not fetched before, compressed on the node
+
+    paths - the remote files to collect (which may be globs)
+    known - a dictionary of host -> {path: [inode, size, mtime, fingerprint]}
+            of the files fetched before, see log_collector.mirror_state
+    local_directory - where to copy the bundle of new segments to
+
+    Files that grew since they were last fetched only have their new
+    bytes copied. New files, and files that were replaced, truncated
+    or rewritten, are copied whole. A file is only taken to be the same
+    one grown if it has the same inode, and it's first bytes (up to
+    LOG_FINGERPRINT_BYTES, as many as were fetched before) are
+    unchanged: the JVM truncates gc.log in place on every start, and a
+    new log can reuse the inode of a removed one.
+
+    Returns the files found, as path -> [inode, size, mtime, index of
+    the path they matched, fingerprint], and, if anything changed, the segments
+    copied, as path -> [offset, member], and the local path of the
+    bundle (a tar.gz of the segments)."""
+    cfg = config['hosts'][fab.env.host]
+    known = known.get(fab.env.host, {})
+    files = {}
+    for i, path in enumerate(paths):
+        listing = ssh_pool.run('find {path} -maxdepth 0 -type f -printf "%i %s %T@ %p\\n"'.format(path=path),
+                               quiet=True)
+        for line in listing.splitlines():
+            fields = line.strip().split(' ', 3)
+            if len(fields) == 4 and not files.has_key(fields[3]):
+                files[fields[3]] = [int(fields[0]), int(fields[1]), float(fields[2]), i]
+    # Fingerprint the start of each file, both as far as it was fetched
+    # before and as far as it is now:
+    lengths = set()
+    for path, (inode, size, mtime, i) in files.items():
+        lengths.add((path, min(size, LOG_FINGERPRINT_BYTES)))
+        previous = known.get(path)
+        if previous is not None and previous[0] == inode and previous[1] <= size:
+            lengths.add((path, min(previous[1], LOG_FINGERPRINT_BYTES)))
+    fingerprints = log_fingerprints(sorted(lengths))
+    for path, entry in files.items():
+        entry.append(fingerprints.get((path, min(entry[1], LOG_FINGERPRINT_BYTES))))
+    bundle = '/tmp/cstar_log_segments.{marker}'.format(marker=uuid.uuid1())
+    script = RemoteScript()
+    script.run('mkdir -p {bundle}'.format(bundle=bundle))
+    segments = {}
+    for member, (path, (inode, size, mtime, i, fingerprint)) in enumerate(sorted(files.items())):
+        previous = known.get(path)
+        if (previous is not None and previous[0] == inode and previous[1] <= size and
+                fingerprint is not None and
+                fingerprints.get((path, min(previous[1], LOG_FINGERPRINT_BYTES))) == previous[3]):
+            if previous[1] == size and previous[2] == mtime:
+                continue
+            # Appended to since (or rewritten, if the size is unchanged):
+            offset = previous[1] if previous[1] < size else 0
+        else:
+            offset = 0
+        segments[path] = [offset, str(member)]
+        script.run('tail -c +{start} {path} | head -c {length} > {bundle}/{member}'.format(
+            start=offset + 1, path=pipes.quote(path), length=size - offset, bundle=bundle, member=member))
+    if not segments:
+        return {'files': files}
+    script.run('tar czf {bundle}.tar.gz -C {bundle} . && rm -rf {bundle}'.format(bundle=bundle))
+    script.execute()
+    local_bundle = os.path.join(local_directory, "{hostname}.tar.gz".format(hostname=cfg['hostname']))
+    try:
+        ssh_pool.get(bundle + '.tar.gz', local_bundle)
+    finally:
+        ssh_pool.run('rm -f {bundle}.tar.gz'.format(bundle=bundle), quiet=True)
+    return {'files': files, 'segments': segments, 'bundle': local_bundle}
 
 @fab.parallel
 def start_fincore_capture(interval=10):
     """Start fincore_capture utility on each node"""
     fab.puts("Starting fincore_capture daemon...")
-    fab.run('python2.7 fab/fincore_capture.py -i {interval}'.format(interval=interval))
+    directories = config['data_file_directories'] + [config['flush_directory']]
+    ssh_pool.run('python2.7 fab/fincore_capture.py -i {interval} {directories}'.format(
+        interval=interval, directories=" ".join("-d {d}".format(d=d) for d in directories)))
 
 @fab.parallel
 def stop_fincore_capture():
     """Stop fincore_capture utility on each node"""
     fab.puts("Stopping fincore_capture.")
-    fab.run('pkill -f ".*python.*fincore_capture"', quiet=True)
+    ssh_pool.run('pkill -f ".*python.*fincore_capture"', quiet=True)
 
 @fab.parallel
 def copy_fincore_logs(local_directory):
     cfg = config['hosts'][fab.env.host]
     location = os.path.join(local_directory, "fincore.{host}.log".format(host=cfg['hostname']))
-    fab.get('/tmp/fincore.stats.log', location)
+    ssh_pool.get('/tmp/fincore.stats.log', location)
+
+@fab.parallel
+def start_sysstat_capture(interval=1):
+    """Start sysstat_capture utility on each node, replacing the previous log
+
+    Returns how far ahead of the controller's clock the node's clock is, in seconds."""
+    fab.puts("Starting sysstat_capture daemon...")
+    ssh_pool.run('rm -f /tmp/sysstat.log && python2.7 fab/sysstat_capture.py -i {interval}'.format(interval=interval))
+    before = time.time()
+    node_time = float(ssh_pool.run('date +%s.%N', quiet=True).strip())
+    return node_time - (before + time.time()) / 2
+
+@fab.parallel
+def stop_sysstat_capture():
+    """Stop sysstat_capture utility on each node"""
+    fab.puts("Stopping sysstat_capture.")
+    ssh_pool.run('pkill -f ".*python.*sysstat_capture"', quiet=True)
+
+@fab.parallel
+def copy_sysstat_logs(local_directory):
+    cfg = config['hosts'][fab.env.host]
+    location = os.path.join(local_directory, "sysstat.{host}.log".format(host=cfg['hostname']))
+    ssh_pool.get('/tmp/sysstat.log', location)
+
+@fab.parallel
+def run_stress(cmd, start_at, hdr_log=None):
+    """Run a cassandra-stress command on a load generator, starting at a given time
+
+    start_at - the controller time to start stress at, the clients'
+               clocks may differ from the controller's
+    hdr_log - the path of the histogram log the command writes, if any
+
+    Returns the stress output and return code, the histogram log
+    contents, and the client clock offset."""
+    before = time.time()
+    client_time = float(ssh_pool.run('date +%s.%N', quiet=True).strip())
+    clock_offset = client_time - (before + time.time()) / 2
+    script = RemoteScript()
+    # Wait for the start time, in the client's clock:
+    script.run('sleep $(awk "BEGIN {{ d = {start} - $(date +%s.%N); print (d > 0 ? d : 0) }}")'.format(
+        start=start_at + clock_offset))
+    script.run('JAVA_HOME=~/fab/java ~/fab/stress/default/tools/bin/cassandra-stress {cmd}'.format(cmd=cmd),
+               name='stress', ignore_errors=True)
+    if hdr_log is not None:
+        script.run('cat {hdr_log}; rm -f {hdr_log}'.format(hdr_log=hdr_log), name='hdr_log', ignore_errors=True)
+    results = script.execute(pty=False)
+    stress_result = result_by_name(results, 'stress')
+    hdr_result = result_by_name(results, 'hdr_log')
+    return {'output': stress_result.output,
+            'return_code': stress_result.return_code,
+            'hdr_log': hdr_result.output if hdr_result and hdr_result.return_code == 0 else None,
+            'clock_offset': clock_offset}
 
 @fab.parallel
 def whoami():
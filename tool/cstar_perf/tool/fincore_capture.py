@@ -1,43 +1,142 @@
 #!/bin/env python
 
-"""Tool to continuously capture fincore stats from Cassandra data files related to stress"""
+"""Tool to continuously capture the page cache residency of Cassandra data files
 
-import subprocess
-import shlex
+Every interval, each sstable component (*.db) found under the given
+directories is mmap'd and checked with mincore(2), and a single json
+record is appended to the log file:
+
+  {"timestamp": 1419283940.12,
+   "page_size": 4096,
+   "files": {"<path>": {"table": "Keyspace1.Standard1", "size": 1048576,
+                        "resident": 524288, "delta": 4096}, ...},
+   "tables": {"Keyspace1.Standard1": {"size": 1048576, "resident": 524288,
+                                      "delta": 4096}, ...},
+   "removed": ["<path>", ...]}
+
+Sizes are in bytes. Deltas are the change in resident bytes since the
+previous record, and removed lists the files that have disappeared
+since then (eg. compacted away).
+"""
+
+import os
+import json
 import time
 import argparse
-from daemonize import Daemonize
+import ctypes
+import ctypes.util
+import mmap
+
+libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+libc.mmap.restype = ctypes.c_void_p
+libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+
+PAGE_SIZE = mmap.PAGESIZE
+MAP_FAILED = ctypes.c_void_p(-1).value
+# Maps each mincore() vector byte to its residency bit, so pages can be
+# counted with translate() and count() instead of a loop per page:
+RESIDENT_TABLE = bytes(bytearray(i & 1 for i in range(256)))
+
+def resident_bytes(path):
+    """Return the size of a file, and how many bytes of it are in the page cache"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        if size == 0:
+            return 0, 0
+        addr = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+        if addr == MAP_FAILED:
+            raise OSError(ctypes.get_errno(), 'mmap failed: {path}'.format(path=path))
+        try:
+            pages = (size + PAGE_SIZE - 1) // PAGE_SIZE
+            vec = (ctypes.c_ubyte * pages)()
+            if libc.mincore(addr, size, vec) != 0:
+                raise OSError(ctypes.get_errno(), 'mincore failed: {path}'.format(path=path))
+            resident_pages = ctypes.string_at(vec, pages).translate(RESIDENT_TABLE).count(b'\x01')
+        finally:
+            libc.munmap(addr, size)
+    finally:
+        os.close(fd)
+    return size, min(size, resident_pages * PAGE_SIZE)
+
+def table_name(directory, path):
+    """Return the keyspace.table an sstable under a data directory belongs to"""
+    parts = os.path.relpath(path, directory).split(os.sep)
+    if len(parts) < 3:
+        return None
+    # 2.1+ table directories are suffixed with the table id:
+    return "{keyspace}.{table}".format(keyspace=parts[0], table=parts[1].split('-')[0])
 
-import logging
+def find_sstables(directories):
+    """Generate (path, table) for every sstable component under the directories"""
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            # Skip snapshots and incremental backups, they're hardlinks
+            # to the live sstables:
+            dirs[:] = [d for d in dirs if d not in ('snapshots', 'backups')]
+            for name in files:
+                if name.endswith('.db'):
+                    path = os.path.join(root, name)
+                    yield path, table_name(directory, path)
 
-def capture_stats():
-    while True:
-        proc = subprocess.Popen("/usr/local/bin/linux-fincore /mnt/d*/cassandra/{data,flush}/Keyspace1/Standard1*/*", 
-                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-        stdout,stderr = proc.communicate()
-        logger.info("linux-fincore stats : \n"+stdout)
-        time.sleep(int(args.interval))
+def sample(directories, previous=None):
+    """Take a single residency record of all the sstables, see the module documentation
+
+    previous - the previous record, to compute the deltas from"""
+    previous_files = previous['files'] if previous else {}
+    previous_tables = previous['tables'] if previous else {}
+    record = {'timestamp': time.time(), 'page_size': PAGE_SIZE, 'files': {}, 'tables': {}}
+    for path, table in find_sstables(directories):
+        try:
+            size, resident = resident_bytes(path)
+        except OSError:
+            # Removed since it was found, or unreadable:
+            continue
+        delta = resident - previous_files.get(path, {}).get('resident', 0)
+        record['files'][path] = {'table': table, 'size': size, 'resident': resident, 'delta': delta}
+        table_stats = record['tables'].setdefault(table, {'size': 0, 'resident': 0})
+        table_stats['size'] += size
+        table_stats['resident'] += resident
+    for table, table_stats in record['tables'].items():
+        table_stats['delta'] = table_stats['resident'] - previous_tables.get(table, {}).get('resident', 0)
+    record['removed'] = sorted(path for path in previous_files if path not in record['files'])
+    return record
+
+def capture_stats(directories, logfile, interval):
+    """Append a residency record to the logfile every interval seconds"""
+    previous = None
+    with open(logfile, 'a') as log:
+        while True:
+            previous = sample(directories, previous)
+            log.write(json.dumps(previous) + "\n")
+            log.flush()
+            time.sleep(interval)
+
+def read_records(logfile):
+    """Generate the records from a log written by capture_stats"""
+    with open(logfile) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A partially written last line:
+                continue
 
 if __name__ == "__main__":
-    pid = "/tmp/fincore_capture.pid"
-    logger = logging.getLogger(__name__)
+    from daemonize import Daemonize
     parser = argparse.ArgumentParser(description='fincore_capture')
-    parser.add_argument('-f', '--file', default='/tmp/fincore.stats.log', 
+    parser.add_argument('-f', '--file', default='/tmp/fincore.stats.log',
                         help='File to log to', dest='logfile')
-    parser.add_argument('-i', '--interval', dest='interval', 
-                        default='10', help='Time interval, in seconds, to run fincore.')    
+    parser.add_argument('-i', '--interval', dest='interval', type=float,
+                        default=10, help='Time interval, in seconds, between samples.')
+    parser.add_argument('-d', '--directory', dest='directories', action='append',
+                        help='Directory to find sstables in, may be given multiple times.')
     args = parser.parse_args()
+    directories = [os.path.abspath(os.path.expanduser(d)) for d in args.directories or []]
+    logfile = os.path.abspath(args.logfile)
 
-    logger.setLevel(logging.DEBUG)
-    logger.propagate = False
-    fh = logging.FileHandler(args.logfile, "a")
-    formatter = logging.Formatter("%(levelname)s:%(funcName)s:%(asctime) -8s %(message)s")
-    fh.setFormatter(formatter)
-    fh.setLevel(logging.DEBUG)
-    logger.addHandler(fh)
-    keep_fds = [fh.stream.fileno()]
-
-    daemon = Daemonize(app="fincore_capture", pid='/tmp/fincore_capture.pid', action=capture_stats, keep_fds=keep_fds)
+    daemon = Daemonize(app="fincore_capture", pid='/tmp/fincore_capture.pid',
+                       action=lambda: capture_stats(directories, logfile, args.interval))
     daemon.start()
-
-
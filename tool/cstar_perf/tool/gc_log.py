@@ -0,0 +1,138 @@
+"""
+Parse HotSpot GC logs into pause time statistics.
+
+Handles the logs written with -Xloggc, with or without
+-XX:+PrintGCDetails and -XX:+PrintGCDateStamps, for the throughput,
+CMS and G1 collectors. Concurrent phases (which don't pause the
+application) are ignored.
+
+Event times come from the date stamps when they're present. Otherwise
+the JVM uptime stamps are added to the time the JVM was started,
+which start() records to a jvm_start_time file in the log directory.
+"""
+
+import calendar
+import datetime
+import os
+import re
+from collections import namedtuple
+
+from util import percentile
+
+# A single stop the world collection. timestamp is seconds since the
+# epoch, pause is in seconds, and heap sizes are in bytes (None when
+# not logged):
+GCEvent = namedtuple('GCEvent', 'timestamp pause heap_before heap_after full')
+
+date_stamp_re = re.compile(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{3})([+-]\d{4}): ')
+uptime_stamp_re = re.compile(r'^(?:\S+: )?(\d+\.\d+): \[')
+event_re = re.compile(r'\[(Full GC|GC)')
+pause_re = re.compile(r', (\d+\.\d+) secs\]')
+# Heap transition, eg. 123456K->23456K(1234567K) or 1024.0M->512.0M(2048.0M):
+heap_re = re.compile(r'([\d.]+)([BKMG])->([\d.]+)([BKMG])\(([\d.]+)([BKMG])\)')
+# G1 with PrintGCDetails logs the heap on a separate line:
+g1_heap_re = re.compile(r'Heap: ([\d.]+)([BKMG])\([\d.]+[BKMG]\)->([\d.]+)([BKMG])')
+
+UNITS = {'B': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3}
+
+def to_bytes(value, unit):
+    return float(value) * UNITS[unit]
+
+def parse_date_stamp(stamp, tz):
+    """Convert a GC log date stamp to seconds since the epoch"""
+    dt = datetime.datetime.strptime(stamp, '%Y-%m-%dT%H:%M:%S.%f')
+    offset = (int(tz[1:3]) * 3600 + int(tz[3:5]) * 60) * (1 if tz[0] == '+' else -1)
+    return calendar.timegm(dt.timetuple()) + dt.microsecond / 1e6 - offset
+
+def parse_gc_log(lines, jvm_start_time=None):
+    """Generate a GCEvent for each pause in a GC log
+
+    jvm_start_time - seconds since the epoch the JVM started at, needed
+                     if the log has no date stamps."""
+    event = None
+    for line in lines:
+        g1_heap = g1_heap_re.search(line)
+        if g1_heap and event is not None and event.heap_before is None:
+            event = event._replace(heap_before=to_bytes(*g1_heap.group(1, 2)),
+                                   heap_after=to_bytes(*g1_heap.group(3, 4)))
+            continue
+        if 'CMS-concurrent' in line or 'GC concurrent' in line:
+            continue
+        kind = event_re.search(line)
+        pauses = pause_re.findall(line)
+        if not kind or not pauses:
+            continue
+        date_stamp = date_stamp_re.match(line)
+        if date_stamp:
+            timestamp = parse_date_stamp(*date_stamp.groups())
+        else:
+            uptime_stamp = uptime_stamp_re.match(line)
+            if not uptime_stamp or jvm_start_time is None:
+                continue
+            timestamp = jvm_start_time + float(uptime_stamp.group(1))
+        if event is not None:
+            yield event
+        # The outermost event is the last one on the line:
+        heaps = heap_re.findall(line)
+        heap_before = heap_after = None
+        if heaps:
+            before, before_unit, after, after_unit, size, size_unit = heaps[-1]
+            heap_before, heap_after = to_bytes(before, before_unit), to_bytes(after, after_unit)
+        event = GCEvent(timestamp, float(pauses[-1]), heap_before, heap_after, kind.group(1) == 'Full GC')
+    if event is not None:
+        yield event
+
+def read_gc_logs(directory):
+    """Read the events of all the GC logs (gc.log*, including rotated ones) in a directory, in time order"""
+    jvm_start_time = None
+    start_time_file = os.path.join(directory, 'jvm_start_time')
+    if os.path.exists(start_time_file):
+        with open(start_time_file) as f:
+            jvm_start_time = float(f.read().strip())
+    events = []
+    for name in os.listdir(directory):
+        if name.startswith('gc.log'):
+            with open(os.path.join(directory, name)) as f:
+                events.extend(parse_gc_log(f, jvm_start_time))
+    return sorted(events)
+
+def read_gc_archive(tar, directory):
+    """Read the events of all the GC logs in a directory of an open tarfile, in time order"""
+    members = dict((os.path.basename(m.name), m) for m in tar.getmembers()
+                   if m.isfile() and os.path.dirname(m.name) == directory)
+    jvm_start_time = None
+    if members.has_key('jvm_start_time'):
+        jvm_start_time = float(tar.extractfile(members['jvm_start_time']).read().strip())
+    events = []
+    for name, member in members.items():
+        if name.startswith('gc.log'):
+            events.extend(parse_gc_log(tar.extractfile(member), jvm_start_time))
+    return sorted(events)
+
+def gc_stats(events, start, end):
+    """Summarize the events between two times (seconds since the epoch)
+
+    Returns the count of pauses, of which full GCs, the total, p50, p99
+    and max pause in seconds, and the allocation rate in MB/s."""
+    pauses = []
+    full_gcs = 0
+    allocated = 0
+    previous = None
+    for event in events:
+        if start <= event.timestamp <= end:
+            pauses.append(event.pause)
+            if event.full:
+                full_gcs += 1
+            # Anything the heap grew by since the previous collection
+            # was allocated in between:
+            if previous is not None and event.heap_before is not None and previous.heap_after is not None:
+                allocated += max(0, event.heap_before - previous.heap_after)
+        previous = event
+    duration = end - start
+    return {'count': len(pauses),
+            'full_gcs': full_gcs,
+            'total_pause': sum(pauses),
+            'p50_pause': percentile(pauses, 50),
+            'p99_pause': percentile(pauses, 99),
+            'max_pause': max(pauses) if pauses else None,
+            'allocation_rate': allocated / 1024.0**2 / duration if duration > 0 else None}
@@ -0,0 +1,368 @@
+"""
+HdrHistogram latency histograms, compatible with the Java implementation.
+
+cassandra-stress versions that support '-log hdrfile=<file>' write an
+HdrHistogram interval log: one compressed histogram per tag (eg.
+WRITE-rt for response times and WRITE-st for service times) per
+interval. Unlike the fixed percentiles stress prints, histograms can
+be merged without losing accuracy, so the latency distribution of
+several stress clients, or of repeated trials, can be combined before
+taking the high percentiles.
+
+Histograms are stored in the HdrHistogram V2 compressed encoding,
+base64 encoded, the same format as the lines of the interval log (and
+readable by any other HdrHistogram implementation):
+
+  {"format": "hdr",
+   "version": 2,
+   "unit": "ns",
+   "histogram": "HISTFAAAA..."}
+"""
+
+import base64
+import math
+import re
+import struct
+import zlib
+
+HDR_FORMAT = 'hdr'
+HDR_VERSION = 2
+
+V2_ENCODING_COOKIE = 0x1c849303 | 0x10
+V2_COMPRESSED_ENCODING_COOKIE = 0x1c849304 | 0x10
+V2_HEADER = struct.Struct('>iiiiqqd')
+COMPRESSED_HEADER = struct.Struct('>ii')
+
+# Percentiles summarized by default, see summarize():
+SUMMARY_PERCENTILES = (50, 90, 95, 99, 99.9, 99.99)
+
+# Nanoseconds per unit the summaries are given in:
+UNIT_RATIOS = {'ns': 1, 'us': 1000, 'ms': 1000000, 's': 1000000000}
+
+# A line of an interval log, optionally tagged:
+log_line_re = re.compile(r'^(?:Tag=(?P<tag>[^,]*),)?(?P<start>[\d.]+),(?P<length>[\d.]+),[\d.]+,(?P<histogram>\S+)$')
+
+
+class Histogram(object):
+    """A histogram of integer values, with the bucket layout of HdrHistogram
+
+    Values are counted with significant_digits of precision, from
+    lowest_value up. There is no upper bound, the histogram grows to
+    accomodate the values recorded."""
+
+    def __init__(self, significant_digits=3, lowest_value=1, highest_value=2):
+        if not 0 <= significant_digits <= 5:
+            raise ValueError('significant_digits must be between 0 and 5')
+        self.significant_digits = significant_digits
+        self.lowest_value = lowest_value
+        self.highest_value = max(highest_value, 2 * lowest_value)
+        largest_single_unit_value = 2 * 10 ** significant_digits
+        self.unit_magnitude = int(math.floor(math.log(lowest_value, 2)))
+        sub_bucket_count_magnitude = int(math.ceil(math.log(largest_single_unit_value, 2)))
+        self.sub_bucket_half_count_magnitude = max(sub_bucket_count_magnitude, 1) - 1
+        self.sub_bucket_count = 2 ** (self.sub_bucket_half_count_magnitude + 1)
+        self.sub_bucket_half_count = self.sub_bucket_count // 2
+        self.sub_bucket_mask = (self.sub_bucket_count - 1) << self.unit_magnitude
+        # Sparse counts, by bucket index:
+        self.counts = {}
+        self.total_count = 0
+
+    def same_layout(self, other):
+        return (self.significant_digits, self.unit_magnitude) == (other.significant_digits, other.unit_magnitude)
+
+    def bucket_index(self, value):
+        # The position of the highest bit set above the first bucket,
+        # ie. 64 - leading zeros - (unit magnitude + sub bucket count magnitude):
+        return (value | self.sub_bucket_mask).bit_length() - self.unit_magnitude - self.sub_bucket_half_count_magnitude - 1
+
+    def index_of(self, value):
+        """Return the index of the bucket counting a value"""
+        bucket_index = self.bucket_index(value)
+        sub_bucket_index = value >> (bucket_index + self.unit_magnitude)
+        return ((bucket_index + 1) << self.sub_bucket_half_count_magnitude) + (sub_bucket_index - self.sub_bucket_half_count)
+
+    def value_at_index(self, index):
+        """Return the lowest value counted by a bucket"""
+        bucket_index = (index >> self.sub_bucket_half_count_magnitude) - 1
+        sub_bucket_index = (index & (self.sub_bucket_half_count - 1)) + self.sub_bucket_half_count
+        if bucket_index < 0:
+            sub_bucket_index -= self.sub_bucket_half_count
+            bucket_index = 0
+        return sub_bucket_index << (bucket_index + self.unit_magnitude)
+
+    def bucket_size(self, value):
+        """Return the range of values counted by the same bucket as a value"""
+        bucket_index = self.bucket_index(value)
+        sub_bucket_index = value >> (bucket_index + self.unit_magnitude)
+        if sub_bucket_index >= self.sub_bucket_count:
+            bucket_index += 1
+        return 1 << (self.unit_magnitude + bucket_index)
+
+    def highest_equivalent_value(self, value):
+        lowest = self.value_at_index(self.index_of(value))
+        return lowest + self.bucket_size(lowest) - 1
+
+    def record(self, value, count=1):
+        """Count a value (or count occurences of it)"""
+        value = int(value)
+        if value < 0:
+            raise ValueError('Histograms can only record positive values: {value}'.format(value=value))
+        index = self.index_of(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total_count += count
+        self.highest_value = max(self.highest_value, value)
+
+    def add(self, other):
+        """Add the counts of another histogram to this one"""
+        if self.same_layout(other):
+            for index, count in other.counts.iteritems():
+                self.counts[index] = self.counts.get(index, 0) + count
+            self.total_count += other.total_count
+            self.highest_value = max(self.highest_value, other.highest_value)
+        else:
+            # Different precision, recount each bucket by its lowest value:
+            for index, count in other.counts.iteritems():
+                self.record(other.value_at_index(index), count)
+        return self
+
+    def min(self):
+        if not self.total_count:
+            return None
+        return self.value_at_index(min(index for index, count in self.counts.iteritems() if count > 0))
+
+    def max(self):
+        if not self.total_count:
+            return None
+        return self.highest_equivalent_value(
+            self.value_at_index(max(index for index, count in self.counts.iteritems() if count > 0)))
+
+    def mean(self):
+        if not self.total_count:
+            return None
+        total = 0
+        for index, count in self.counts.iteritems():
+            lowest = self.value_at_index(index)
+            # The middle of the bucket:
+            total += (lowest + (self.bucket_size(lowest) >> 1)) * count
+        return float(total) / self.total_count
+
+    def value_at_percentile(self, percentile):
+        """Return the value that percentile (0-100) of the recorded values are below or equal to"""
+        if not self.total_count:
+            return None
+        percentile = min(percentile, 100.0)
+        count_at_percentile = max(1, int(percentile / 100.0 * self.total_count + 0.5))
+        running_count = 0
+        for index in sorted(self.counts):
+            running_count += self.counts[index]
+            if running_count >= count_at_percentile:
+                value = self.value_at_index(index)
+                return value if percentile == 0 else self.highest_equivalent_value(value)
+
+    def encode(self):
+        """Return the V2 compressed encoding of the histogram, base64 encoded"""
+        payload = []
+        if self.counts:
+            index = 0
+            limit = max(self.counts) + 1
+            while index < limit:
+                count = self.counts.get(index, 0)
+                index += 1
+                if count == 0:
+                    zeros = 1
+                    while index < limit and self.counts.get(index, 0) == 0:
+                        zeros += 1
+                        index += 1
+                    if zeros > 1:
+                        count = -zeros
+                payload.append(encode_zigzag(count))
+        payload = "".join(payload)
+        encoded = V2_HEADER.pack(V2_ENCODING_COOKIE, len(payload), 0, self.significant_digits,
+                                 self.lowest_value, self.highest_value, 1.0) + payload
+        compressed = zlib.compress(encoded)
+        return base64.b64encode(COMPRESSED_HEADER.pack(V2_COMPRESSED_ENCODING_COOKIE, len(compressed)) + compressed)
+
+    @classmethod
+    def decode(cls, data):
+        """Create from a base64 V2 encoding, compressed or not, as written by encode() or by stress"""
+        data = base64.b64decode(data)
+        cookie, length = COMPRESSED_HEADER.unpack_from(data)
+        if cookie & ~0xf0 == V2_COMPRESSED_ENCODING_COOKIE & ~0xf0:
+            data = zlib.decompress(data[COMPRESSED_HEADER.size:COMPRESSED_HEADER.size + length])
+        cookie, length, normalizing_offset, significant_digits, lowest_value, highest_value, ratio = \
+            V2_HEADER.unpack_from(data)
+        if cookie & ~0xf0 != V2_ENCODING_COOKIE & ~0xf0:
+            raise ValueError('Not a V2 encoded HdrHistogram (cookie {cookie:#x})'.format(cookie=cookie))
+        if normalizing_offset != 0:
+            raise ValueError('Shifted HdrHistogram encodings are not supported')
+        histogram = cls(significant_digits, lowest_value, highest_value)
+        payload = data[V2_HEADER.size:V2_HEADER.size + length]
+        position = 0
+        index = 0
+        while position < len(payload):
+            count, position = decode_zigzag(payload, position)
+            if count < 0:
+                index += -count
+            else:
+                if count > 0:
+                    histogram.counts[index] = count
+                    histogram.total_count += count
+                index += 1
+        return histogram
+
+
+def encode_zigzag(value):
+    """Encode an integer as a ZigZag LEB128 varint, the way HdrHistogram does (at most 9 bytes)"""
+    value = ((value << 1) ^ (value >> 63)) & 0xffffffffffffffff
+    encoded = []
+    for i in range(8):
+        if value >> 7 == 0:
+            encoded.append(chr(value))
+            return "".join(encoded)
+        encoded.append(chr((value & 0x7f) | 0x80))
+        value >>= 7
+    # The 9th byte holds the top 8 bits:
+    encoded.append(chr(value))
+    return "".join(encoded)
+
+def decode_zigzag(data, position):
+    """Decode a varint written by encode_zigzag, returning it and the position after it"""
+    value = 0
+    for i in range(8):
+        byte = ord(data[position])
+        position += 1
+        value |= (byte & 0x7f) << (7 * i)
+        if not byte & 0x80:
+            break
+    else:
+        value |= ord(data[position]) << 56
+        position += 1
+    return (value >> 1) ^ -(value & 1), position
+
+def is_histogram(encoded):
+    """Is this a histogram in the format stored in stats?"""
+    return isinstance(encoded, dict) and encoded.get('format') == HDR_FORMAT
+
+def encode_histogram(histogram, unit='ns'):
+    """Return the json serializable representation of a histogram, to store in stats"""
+    return {'format': HDR_FORMAT,
+            'version': HDR_VERSION,
+            'unit': unit,
+            'histogram': histogram.encode()}
+
+def decode_histogram(encoded):
+    """Create a Histogram from the representation returned by encode_histogram"""
+    if encoded.get('version') != HDR_VERSION:
+        raise ValueError('Unsupported histogram version: {version}'.format(version=encoded.get('version')))
+    return Histogram.decode(encoded['histogram'])
+
+def merge_histograms(encoded_histograms):
+    """Merge histograms in the stats representation (eg. of several
+    stress clients or trials) into one, in the same representation"""
+    merged = None
+    for encoded in encoded_histograms:
+        histogram = decode_histogram(encoded)
+        if merged is None:
+            merged, unit = histogram, encoded['unit']
+        else:
+            if encoded['unit'] != unit:
+                raise ValueError('Cannot merge histograms in {a} and {b}'.format(a=unit, b=encoded['unit']))
+            merged.add(histogram)
+    if merged is None:
+        return None
+    return encode_histogram(merged, unit)
+
+def summarize(encoded, percentiles=SUMMARY_PERCENTILES, unit='ms'):
+    """Summarize a histogram in the stats representation
+
+    Returns the count, and the min, mean, max and the given percentiles
+    converted to unit, with keys like p99.9"""
+    histogram = decode_histogram(encoded)
+    ratio = float(UNIT_RATIOS[unit]) / UNIT_RATIOS[encoded['unit']]
+    def convert(value):
+        return None if value is None else value / ratio
+    summary = {'count': histogram.total_count,
+               'unit': unit,
+               'min': convert(histogram.min()),
+               'mean': convert(histogram.mean()),
+               'max': convert(histogram.max())}
+    for percentile in percentiles:
+        summary['p{p:g}'.format(p=percentile)] = convert(histogram.value_at_percentile(percentile))
+    return summary
+
+def read_interval_log(lines):
+    """Generate (tag, start, length, Histogram) for each interval of an HdrHistogram log
+
+    Untagged intervals have a tag of None. start is seconds since the
+    log's start or base time, as written."""
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#') or line.startswith('"'):
+            continue
+        match = log_line_re.match(line)
+        if match is None:
+            continue
+        try:
+            histogram = Histogram.decode(match.group('histogram'))
+        except (ValueError, TypeError, struct.error, zlib.error):
+            # A partially written last line:
+            continue
+        yield match.group('tag'), float(match.group('start')), float(match.group('length')), histogram
+
+def collect_interval_log(lines, unit='ns', intervals=False):
+    """Read an HdrHistogram log into the representation stored in stats
+
+    Returns a dictionary of tag -> {'histogram': the merged histogram
+    of the whole log, 'summary': its summary (see summarize)}. Each
+    interval's histogram takes a few KB, so they are only kept if
+    intervals is True, as 'intervals': {'start': [...], 'length':
+    [...], 'histograms': [...]}"""
+    tags = {}
+    for tag, start, length, histogram in read_interval_log(lines):
+        tag_data = tags.setdefault(tag or 'default', {'total': None, 'intervals': {'start': [], 'length': [], 'histograms': []}})
+        if tag_data['total'] is None:
+            tag_data['total'] = Histogram(histogram.significant_digits, histogram.lowest_value)
+        tag_data['total'].add(histogram)
+        if intervals:
+            tag_data['intervals']['start'].append(start)
+            tag_data['intervals']['length'].append(length)
+            tag_data['intervals']['histograms'].append(histogram.encode())
+    collected = {}
+    for tag, tag_data in tags.items():
+        total = encode_histogram(tag_data['total'], unit)
+        collected[tag] = {'histogram': total,
+                          'summary': summarize(total)}
+        if intervals:
+            collected[tag]['intervals'] = tag_data['intervals']
+    return collected
+
+def merge_interval_logs(collected_logs):
+    """Merge the histograms read by collect_interval_log from several
+    logs (eg. one per stress client) into the same representation
+
+    The intervals of each log are merged by position, so the logs
+    should have been started at the same time, and only the intervals
+    all the logs have are kept. Intervals are only merged if every log
+    kept them."""
+    merged = {}
+    tags = set()
+    for collected in collected_logs:
+        tags.update(collected.keys())
+    for tag in tags:
+        logs = [collected[tag] for collected in collected_logs if collected.has_key(tag)]
+        total = merge_histograms([log['histogram'] for log in logs])
+        merged[tag] = {'histogram': total, 'summary': summarize(total)}
+        if not all(log.has_key('intervals') for log in logs):
+            continue
+        length = min(len(log['intervals']['histograms']) for log in logs)
+        intervals = {'start': logs[0]['intervals']['start'][:length],
+                     'length': [max(log['intervals']['length'][i] for log in logs) for i in xrange(length)],
+                     'histograms': []}
+        for i in xrange(length):
+            histogram = None
+            for log in logs:
+                interval = Histogram.decode(log['intervals']['histograms'][i])
+                histogram = interval if histogram is None else histogram.add(interval)
+            intervals['histograms'].append(histogram.encode())
+        merged[tag]['intervals'] = intervals
+    return merged
@@ -0,0 +1,119 @@
+"""
+Compact columnar encoding for stress interval series.
+
+Stress intervals were traditionally stored as a list of rows, one
+list of floats per interval. The columnar encoding instead stores one
+typed array per column, compressed and base64 encoded, along with the
+column names from the stress interval header:
+
+  {"format": "columnar",
+   "version": 1,
+   "typecode": "d",
+   "length": 3600,
+   "columns": ["total ops", "op/s", ...],
+   "data": ["eJzt...", "eJzt...", ...]}
+
+Both encodings are accepted everywhere intervals are read, so older
+stats files remain readable.
+"""
+
+import array
+import base64
+import sys
+import zlib
+
+COLUMNAR_FORMAT = 'columnar'
+COLUMNAR_VERSION = 1
+
+
+class ColumnarIntervals(object):
+    """Accumulate interval rows into one typed array per column"""
+
+    def __init__(self, columns, typecode='d'):
+        self.columns = list(columns)
+        self.typecode = typecode
+        self.arrays = [array.array(typecode) for c in self.columns]
+
+    def __len__(self):
+        return len(self.arrays[0]) if self.arrays else 0
+
+    def append(self, values):
+        """Append a single interval row
+
+        Returns False, and ignores the row, if it doesn't have a value
+        for every column."""
+        if len(values) != len(self.columns):
+            return False
+        for arr, value in zip(self.arrays, values):
+            arr.append(value)
+        return True
+
+    def rows(self):
+        """Return the intervals as a list of rows"""
+        return [list(row) for row in zip(*self.arrays)]
+
+    def column(self, name):
+        """Return the values of a single column"""
+        return self.arrays[self.columns.index(name)]
+
+    def encode(self):
+        """Return the json serializable columnar representation"""
+        data = []
+        for arr in self.arrays:
+            # Always store little endian, regardless of the platform:
+            if sys.byteorder == 'big':
+                arr = array.array(self.typecode, arr)
+                arr.byteswap()
+            data.append(base64.b64encode(zlib.compress(arr.tostring())))
+        return {'format': COLUMNAR_FORMAT,
+                'version': COLUMNAR_VERSION,
+                'typecode': self.typecode,
+                'length': len(self),
+                'columns': self.columns,
+                'data': data}
+
+    @classmethod
+    def decode(cls, encoded):
+        """Create from the json representation returned by encode()"""
+        if encoded.get('version') != COLUMNAR_VERSION:
+            raise ValueError('Unsupported columnar intervals version: {version}'.format(
+                version=encoded.get('version')))
+        intervals = cls(encoded['columns'], encoded['typecode'])
+        for arr, data in zip(intervals.arrays, encoded['data']):
+            arr.fromstring(zlib.decompress(base64.b64decode(data)))
+            if sys.byteorder == 'big':
+                arr.byteswap()
+        return intervals
+
+
+def is_columnar(intervals):
+    """Are these intervals in the columnar encoding?"""
+    return isinstance(intervals, dict) and intervals.get('format') == COLUMNAR_FORMAT
+
+def interval_rows(intervals):
+    """Return intervals, in either encoding, as a list of rows"""
+    if is_columnar(intervals):
+        return ColumnarIntervals.decode(intervals).rows()
+    return intervals
+
+def interval_columns(intervals):
+    """Return the column names of the intervals, or None if not recorded"""
+    if is_columnar(intervals):
+        return intervals['columns']
+    return None
+
+def interval_count(intervals):
+    """Return the number of intervals, in either encoding"""
+    if is_columnar(intervals):
+        return intervals['length']
+    return len(intervals)
+
+def expand_stats_intervals(stats_log):
+    """Convert all the columnar intervals in a stats log to rows, in place
+
+    Used to serve stats to consumers that only understand rows."""
+    for stats in stats_log.get('stats', []):
+        if is_columnar(stats.get('intervals')):
+            stats['interval_columns'] = interval_columns(stats['intervals'])
+            stats['intervals'] = interval_rows(stats['intervals'])
+    return stats_log
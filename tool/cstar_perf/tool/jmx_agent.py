@@ -0,0 +1,270 @@
+"""
+Long lived JMX client for querying Cassandra metrics.
+
+Running nodetool starts a new JVM and opens a new JMX connection for
+every command, which takes seconds. The agent is a single Jython
+process, running on the controller, that keeps a JMX connection open
+to each node it has been asked about and answers queries over it's
+stdin/stdout in milliseconds.
+
+Protocol, one request or response per line, tab separated:
+  request:  <request_id> <host> <port> <query> [<arg> ...]
+  response: <request_id> OK <python literal of the result>
+            <request_id> ERROR <message>
+"""
+
+import ast
+import itertools
+import logging
+import os
+import select
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger('jmx_agent')
+
+JYTHON_URL = "http://search.maven.org/remotecontent?filepath=org/python/jython-standalone/2.7-b1/jython-standalone-2.7-b1.jar"
+
+# The agent itself, run by Jython. Results are converted to plain
+# python types and written with repr(), so the agent doesn't depend
+# on any modules beyond the JDK:
+AGENT_SCRIPT = r'''
+import sys
+from java.util import HashMap, Map
+from javax.management import ObjectName
+from javax.management.openmbean import CompositeData, TabularData
+from javax.management.remote import JMXConnectorFactory, JMXServiceURL
+
+connections = {}
+
+def connect(host, port):
+    key = (host, port)
+    if key not in connections:
+        url = JMXServiceURL("service:jmx:rmi:///jndi/rmi://%s:%s/jmxrmi" % (host, port))
+        connections[key] = JMXConnectorFactory.connect(url, HashMap())
+    return connections[key].getMBeanServerConnection()
+
+def disconnect(host, port):
+    connector = connections.pop((host, port), None)
+    if connector is not None:
+        try:
+            connector.close()
+        except:
+            pass
+
+def to_python(value):
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    if isinstance(value, basestring):
+        return unicode(value)
+    if isinstance(value, Map):
+        return dict([(to_python(e.getKey()), to_python(e.getValue())) for e in value.entrySet()])
+    if isinstance(value, CompositeData):
+        return dict([(unicode(k), to_python(value.get(k))) for k in value.getCompositeType().keySet()])
+    if isinstance(value, TabularData):
+        return [to_python(v) for v in value.values()]
+    try:
+        return [to_python(v) for v in value]
+    except TypeError:
+        return unicode(value)
+
+def get(mbs, name, attribute):
+    return to_python(mbs.getAttribute(ObjectName(name), attribute))
+
+def compaction(mbs, args):
+    result = {'compactions': get(mbs, "org.apache.cassandra.db:type=CompactionManager", "Compactions")}
+    try:
+        result['pending_tasks'] = get(mbs, "org.apache.cassandra.metrics:type=Compaction,name=PendingTasks", "Value")
+    except:
+        result['pending_tasks'] = get(mbs, "org.apache.cassandra.db:type=CompactionManager", "PendingTasks")
+    return result
+
+def thread_pools(mbs, args):
+    pools = {}
+    for domain in ("org.apache.cassandra.request", "org.apache.cassandra.internal"):
+        for name in mbs.queryNames(ObjectName(domain + ":type=*"), None):
+            stats = {}
+            for attribute in ("ActiveCount", "PendingTasks", "CompletedTasks",
+                              "CurrentlyBlockedTasks", "TotalBlockedTasks"):
+                try:
+                    stats[attribute] = to_python(mbs.getAttribute(name, attribute))
+                except:
+                    pass
+            pools[unicode(name.getKeyProperty("type"))] = stats
+    return pools
+
+def table(mbs, args):
+    keyspace, table = args
+    metrics = {}
+    for metric_type in ("ColumnFamily", "Table"):
+        pattern = "org.apache.cassandra.metrics:type=%s,keyspace=%s,scope=%s,name=*" % (metric_type, keyspace, table)
+        for name in mbs.queryNames(ObjectName(pattern), None):
+            attributes = [a.getName() for a in mbs.getMBeanInfo(name).getAttributes() if a.isReadable()]
+            values = {}
+            for attribute in mbs.getAttributes(name, attributes).asList():
+                values[unicode(attribute.getName())] = to_python(attribute.getValue())
+            metrics[unicode(name.getKeyProperty("name"))] = values
+    return metrics
+
+def gossip(mbs, args):
+    result = {}
+    for key, attribute in (('live', 'LiveNodes'), ('unreachable', 'UnreachableNodes'),
+                           ('joining', 'JoiningNodes'), ('leaving', 'LeavingNodes'),
+                           ('moving', 'MovingNodes')):
+        result[key] = get(mbs, "org.apache.cassandra.db:type=StorageService", attribute)
+    return result
+
+def attribute(mbs, args):
+    name, attribute = args
+    return get(mbs, name, attribute)
+
+QUERIES = {'compaction': compaction,
+           'thread_pools': thread_pools,
+           'table': table,
+           'gossip': gossip,
+           'attribute': attribute}
+
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    fields = line.rstrip("\n").split("\t")
+    request_id, host, port, query, args = fields[0], fields[1], int(fields[2]), fields[3], fields[4:]
+    try:
+        response = "%s\tOK\t%r" % (request_id, QUERIES[query](connect(host, port), args))
+    except:
+        disconnect(host, port)
+        message = " ".join(str(sys.exc_info()[1]).split())
+        response = "%s\tERROR\t%s" % (request_id, message)
+    sys.stdout.write(response + "\n")
+    sys.stdout.flush()
+'''
+
+
+class JMXAgentError(Exception):
+    pass
+
+
+class JMXAgent(object):
+    """Client for the JMX agent process"""
+
+    def __init__(self, java_home, jython_jar=os.path.expanduser("~/fab/jython.jar"),
+                 port=7199, timeout=60):
+        self.java_home = java_home
+        self.jython_jar = jython_jar
+        self.port = port
+        self.timeout = timeout
+        self.proc = None
+        self.lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.buffer = ''
+
+    def start(self):
+        """Start the agent process"""
+        agent_dir = os.path.join(os.path.expanduser("~"), ".cstar_perf")
+        if not os.path.exists(agent_dir):
+            os.makedirs(agent_dir)
+        if not os.path.exists(self.jython_jar):
+            logger.info("Downloading Jython to {jar}".format(jar=self.jython_jar))
+            subprocess.check_call(["wget", "-q", JYTHON_URL, "-O", self.jython_jar])
+        script_path = os.path.join(agent_dir, "jmx_agent.jy")
+        with open(script_path, 'w') as f:
+            f.write(AGENT_SCRIPT)
+        with open(os.path.join(agent_dir, "jmx_agent.log"), 'a') as log:
+            self.proc = subprocess.Popen(
+                [os.path.join(self.java_home, "bin", "java"), "-cp", self.jython_jar,
+                 "org.python.util.jython", script_path],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=log)
+        self.buffer = ''
+        logger.info("Started JMX agent, pid: {pid}".format(pid=self.proc.pid))
+
+    def stop(self):
+        """Stop the agent process"""
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+                self.proc.kill()
+            except (OSError, IOError):
+                pass
+            self.proc.wait()
+            self.proc = None
+
+    def is_running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def __readline(self, deadline):
+        while "\n" not in self.buffer:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise JMXAgentError("Timed out waiting for the JMX agent")
+            readable, _, _ = select.select([self.proc.stdout], [], [], remaining)
+            if readable:
+                data = os.read(self.proc.stdout.fileno(), 65536)
+                if data == '':
+                    raise JMXAgentError("JMX agent exited")
+                self.buffer += data
+        line, self.buffer = self.buffer.split("\n", 1)
+        return line
+
+    def query_multi(self, hosts, query, *args):
+        """Run the same query against several hosts
+
+        The requests are all sent before waiting on any response.
+
+        Returns a dictionary of host -> result. Raises JMXAgentError if
+        any of the hosts fail to answer."""
+        with self.lock:
+            if not self.is_running():
+                self.start()
+            requests = {}
+            try:
+                for host in hosts:
+                    request_id = str(self.request_ids.next())
+                    requests[request_id] = host
+                    self.proc.stdin.write("\t".join([request_id, host, str(self.port), query] + list(args)) + "\n")
+                self.proc.stdin.flush()
+                results = {}
+                errors = {}
+                deadline = time.time() + self.timeout
+                while len(results) + len(errors) < len(requests):
+                    fields = self.__readline(deadline).split("\t", 2)
+                    if len(fields) != 3 or fields[0] not in requests:
+                        continue
+                    request_id, status, data = fields
+                    if status == 'OK':
+                        results[requests[request_id]] = ast.literal_eval(data)
+                    else:
+                        errors[requests[request_id]] = data
+            except (IOError, OSError, JMXAgentError), e:
+                # The agent is no longer usable, a fresh one will be
+                # started for the next query:
+                self.stop()
+                raise JMXAgentError(str(e))
+        if errors:
+            raise JMXAgentError("JMX query '{query}' failed: {errors}".format(query=query, errors=errors))
+        return results
+
+    def query(self, host, query, *args):
+        """Run a query against a single host"""
+        return self.query_multi([host], query, *args)[host]
+
+    def compaction(self, host):
+        """Get the pending compaction tasks and the active compactions of a node"""
+        return self.query(host, 'compaction')
+
+    def thread_pools(self, host):
+        """Get the active, pending, completed and blocked task counts of each thread pool of a node"""
+        return self.query(host, 'thread_pools')
+
+    def table(self, host, keyspace, table):
+        """Get all the metrics of a table on a node"""
+        return self.query(host, 'table', keyspace, table)
+
+    def gossip(self, host):
+        """Get the live, unreachable, joining, leaving and moving nodes, as seen by a node"""
+        return self.query(host, 'gossip')
+
+    def attribute(self, host, object_name, attribute):
+        """Get a single MBean attribute from a node"""
+        return self.query(host, 'attribute', object_name, attribute)
@@ -0,0 +1,173 @@
+"""
+Incremental collection of node logs into per-operation archives.
+
+Every operation archives the logs of each node, which mostly repeat
+what the previous operation's archive already had: the logs only grow
+between operations. Instead of copying the whole log directory every
+time, each node compresses just the bytes written since the previous
+collection into a bundle (see fab_cassandra.fetch_log_segments), and
+the controller keeps a mirror of those compressed bundles per host.
+
+The mirror of a host is a directory of bundles, and an index.json of
+the files they hold:
+
+  {"files": {"<remote path>": {"inode": ..., "size": ..., "mtime": ..., "fingerprint": ...,
+                               "name": "<name in the archive>",
+                               "segments": [["<bundle>", "<member>", <length>], ...]}}}
+
+A file's content is the concatenation of its segments. The archive of
+an operation is written straight from the bundles, decompressing the
+segments as they're added, so no uncompressed copy of the logs is
+ever staged on the controller.
+"""
+
+import json
+import os
+import shutil
+import tarfile
+import time
+import uuid
+
+INDEX_FILE = 'index.json'
+
+
+def read_index(mirror_dir):
+    """Read the index of a host's mirror"""
+    path = os.path.join(mirror_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return {'files': {}}
+    with open(path) as f:
+        return json.loads(f.read())
+
+def write_index(mirror_dir, index):
+    path = os.path.join(mirror_dir, INDEX_FILE)
+    with open(path + '.tmp', 'w') as f:
+        f.write(json.dumps(index, sort_keys=True))
+    os.rename(path + '.tmp', path)
+
+def mirror_state(mirror_dir):
+    """Get the path -> [inode, size, mtime, fingerprint] of the files in a host's mirror, see fetch_log_segments"""
+    return dict((path, [f['inode'], f['size'], f['mtime'], f.get('fingerprint')])
+                for path, f in read_index(mirror_dir)['files'].items())
+
+def add_bundle(mirror_dir, fetched, names):
+    """Add the segments fetched from a host to it's mirror
+
+    fetched - the result of fab_cassandra.fetch_log_segments
+    names - the name template in the archive of each path fetched
+            (eg. '{hostname}/{name}'), formatted with the file name
+
+    Files no longer on the host are dropped from the mirror, along with
+    the bundles nothing refers to anymore. Returns the bytes of the
+    bundle added."""
+    if not os.path.exists(mirror_dir):
+        os.makedirs(mirror_dir)
+    index = read_index(mirror_dir)
+    bundle_bytes = 0
+    lengths = {}
+    bundle = None
+    if fetched.get('bundle'):
+        bundle = "{id}.tar.gz".format(id=uuid.uuid1())
+        shutil.move(fetched['bundle'], os.path.join(mirror_dir, bundle))
+        bundle_bytes = os.path.getsize(os.path.join(mirror_dir, bundle))
+        # The segments are as long as what was actually read on the
+        # node, in case a file changed while it was being read:
+        with tarfile.open(os.path.join(mirror_dir, bundle)) as tar:
+            for member in tar.getmembers():
+                if member.isfile():
+                    lengths[os.path.basename(member.name)] = (member.name, member.size)
+    files = {}
+    for path, (inode, size, mtime, i, fingerprint) in fetched['files'].items():
+        entry = index['files'].get(path)
+        segment = fetched.get('segments', {}).get(path)
+        if segment is not None:
+            offset, member = segment
+            if member not in lengths:
+                continue
+            member_name, length = lengths[member]
+            if entry is None or offset == 0:
+                entry = {'segments': []}
+            entry['segments'].append([bundle, member_name, length])
+            size = offset + length
+        elif entry is None:
+            continue
+        entry.update({'inode': inode, 'size': size, 'mtime': mtime, 'fingerprint': fingerprint,
+                      'name': names[i].format(name=os.path.basename(path))})
+        files[path] = entry
+    index['files'] = files
+    write_index(mirror_dir, index)
+
+    referenced = set(s[0] for f in files.values() for s in f['segments'])
+    for name in os.listdir(mirror_dir):
+        if name.endswith('.tar.gz') and name not in referenced:
+            os.remove(os.path.join(mirror_dir, name))
+    return bundle_bytes
+
+class SegmentReader(object):
+    """A file object reading the concatenated segments of a file from the bundles"""
+    def __init__(self, mirror_dir, segments, bundles):
+        self.mirror_dir = mirror_dir
+        self.segments = list(segments)
+        self.bundles = bundles
+        self.current = None
+
+    def bundle(self, name):
+        if not self.bundles.has_key(name):
+            self.bundles[name] = tarfile.open(os.path.join(self.mirror_dir, name))
+        return self.bundles[name]
+
+    def read(self, size=-1):
+        data = []
+        while size != 0:
+            if self.current is None:
+                if not self.segments:
+                    break
+                bundle, member, length = self.segments.pop(0)
+                self.current = self.bundle(bundle).extractfile(member)
+            chunk = self.current.read(size if size > 0 else -1)
+            if not chunk:
+                self.current = None
+                continue
+            data.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return ''.join(data)
+
+def write_archive(archive_path, root, mirrors):
+    """Write the tar.gz archive of the files in the mirrors
+
+    archive_path - the archive to write
+    root - the directory all the files are archived under
+    mirrors - the mirror directory of each host
+
+    Returns the bytes of the archive."""
+    now = time.time()
+    def directory(name):
+        info = tarfile.TarInfo(name)
+        info.type = tarfile.DIRTYPE
+        info.mode = 0755
+        info.mtime = now
+        return info
+    tmp_path = archive_path + '.tmp'
+    with tarfile.open(tmp_path, 'w:gz') as tar:
+        tar.addfile(directory(root))
+        added = set()
+        for mirror_dir in mirrors:
+            bundles = {}
+            try:
+                for path, entry in sorted(read_index(mirror_dir)['files'].items()):
+                    name = os.path.join(root, entry['name'])
+                    parent = os.path.dirname(name)
+                    if parent != root and parent not in added:
+                        tar.addfile(directory(parent))
+                        added.add(parent)
+                    info = tarfile.TarInfo(name)
+                    info.size = sum(length for bundle, member, length in entry['segments'])
+                    info.mtime = entry['mtime']
+                    info.mode = 0644
+                    tar.addfile(info, SegmentReader(mirror_dir, entry['segments'], bundles))
+            finally:
+                for bundle in bundles.values():
+                    bundle.close()
+    os.rename(tmp_path, archive_path)
+    return os.path.getsize(archive_path)
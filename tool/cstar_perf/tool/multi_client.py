@@ -0,0 +1,102 @@
+"""
+Merge the results of a stress command run from several clients at once.
+
+A single cassandra-stress process can saturate before the cluster it
+loads does. Running the same command from several load generators,
+started at the same time, and merging what they report gives the
+throughput and latency of the cluster as a whole.
+
+The clients are started in sync, so their intervals are merged by
+position: rates and counts are summed, latencies are averaged weighted
+by each client's op rate (except maximums, which are the maximum of
+the clients), and everything else (elapsed time, the cluster GC stats
+every client reports) is the maximum of the clients. Only the
+intervals every client reported are kept. Latency percentiles
+averaged this way are only an approximation, the merged histograms
+(see hdr_histogram.merge_interval_logs) are exact.
+"""
+
+import re
+
+from intervals import ColumnarIntervals
+
+# How each interval column is merged, by name (2.1 and 2.0 stress):
+SUMMED_COLUMNS = set(['total ops', 'adj row/s', 'op/s', 'pk/s', 'row/s', 'errors',
+                      'total', 'interval_op_rate', 'interval_key_rate'])
+LATENCY_COLUMNS = set(['mean', 'med', '.95', '.99', '.999',
+                       'latency', 'median', '95th', '99th', '99.9th'])
+OP_RATE_COLUMNS = ('op/s', 'interval_op_rate')
+
+# How each Results: aggregate is merged, the others are the first client's:
+SUMMED_AGGREGATES = set(['op rate', 'partition rate', 'row rate', 'Total partitions', 'Total errors'])
+LATENCY_AGGREGATES = set(['latency mean', 'latency median', 'latency 95th percentile',
+                          'latency 99th percentile', 'latency 99.9th percentile'])
+MAX_AGGREGATES = set(['latency max', 'Total operation time', 'Total GC count', 'Total GC memory',
+                      'Total GC time', 'Avg GC time', 'StdDev GC time'])
+
+number_re = re.compile(r'^\s*([\d.]+)')
+duration_re = re.compile(r'^\s*(\d+):(\d\d):(\d\d)')
+
+
+def merge_intervals(client_intervals):
+    """Merge the ColumnarIntervals of each client into a single ColumnarIntervals"""
+    columns = [c.strip() for c in client_intervals[0].columns]
+    for intervals in client_intervals[1:]:
+        if [c.strip() for c in intervals.columns] != columns:
+            raise ValueError('Stress clients reported different interval columns: {a} and {b}'.format(
+                a=columns, b=intervals.columns))
+    rate_index = None
+    for name in OP_RATE_COLUMNS:
+        if name in columns:
+            rate_index = columns.index(name)
+            break
+    merged = ColumnarIntervals(client_intervals[0].columns)
+    client_rows = [intervals.rows() for intervals in client_intervals]
+    length = min(len(rows) for rows in client_rows)
+    for i in xrange(length):
+        rows = [rows[i] for rows in client_rows]
+        weights = [row[rate_index] for row in rows] if rate_index is not None else [1] * len(rows)
+        if sum(weights) <= 0:
+            weights = [1] * len(rows)
+        merged_row = []
+        for c, name in enumerate(columns):
+            values = [row[c] for row in rows]
+            if name in SUMMED_COLUMNS:
+                merged_row.append(sum(values))
+            elif name in LATENCY_COLUMNS:
+                merged_row.append(sum(v * w for v, w in zip(values, weights)) / float(sum(weights)))
+            else:
+                merged_row.append(max(values))
+        merged.append(merged_row)
+    return merged
+
+def aggregate_number(value):
+    """Get the leading number of an aggregate, eg. 12345 from '12345 [WRITE:12345]'
+
+    Durations (HH:MM:SS) are converted to seconds."""
+    match = duration_re.match(value)
+    if match:
+        hours, minutes, seconds = [int(g) for g in match.groups()]
+        return hours * 3600 + minutes * 60 + seconds
+    match = number_re.match(value)
+    return float(match.group(1)) if match else None
+
+def merge_aggregates(client_aggregates):
+    """Merge the Results: aggregates of each client (dictionaries of name -> value string)"""
+    merged = dict(client_aggregates[0])
+    weights = [aggregate_number(a.get('op rate', '')) or 0 for a in client_aggregates]
+    if sum(weights) <= 0:
+        weights = [1] * len(client_aggregates)
+    for name in merged:
+        values = [aggregate_number(a.get(name, '')) for a in client_aggregates]
+        if None in values:
+            continue
+        if name in SUMMED_AGGREGATES:
+            merged[name] = "{value:.0f}".format(value=sum(values))
+        elif name in LATENCY_AGGREGATES:
+            merged[name] = "{value:.1f}".format(
+                value=sum(v * w for v, w in zip(values, weights)) / float(sum(weights)))
+        elif name in MAX_AGGREGATES:
+            # Keep the original string, with its units:
+            merged[name] = max(client_aggregates, key=lambda a: aggregate_number(a[name]))[name]
+    return merged
@@ -0,0 +1,148 @@
+"""
+Batch the remote steps of a fabric task into a single remote script.
+
+Every fab.run, fab.put and fab.get is a separate SSH round trip, which
+adds up quickly on high latency links when a task is made of dozens of
+small steps. A RemoteScript collects the steps instead, then runs them
+all on the current host with a single remote command (through the
+connection pool, if one was started, see ssh_pool), and returns the output,
+return code and duration of each step:
+
+  script = RemoteScript()
+  script.run('rm -rf fab/cassandra')
+  script.run('killall -9 java', ignore_errors=True)
+  script.put(yaml_text, '~/fab/cassandra/conf/cassandra.yaml')
+  results = script.execute()
+
+Like separate fab.run calls, each step runs in it's own shell. A failed
+step aborts the task, unless it was added with ignore_errors=True.
+"""
+
+import base64
+import os
+import tempfile
+import time
+import uuid
+from collections import namedtuple
+
+from fabric import api as fab
+import ssh_pool
+
+# The result of a single step of a RemoteScript:
+StepResult = namedtuple('StepResult', 'name command return_code output seconds')
+
+# Scripts bigger than this are uploaded, instead of being sent as part
+# of the command line:
+MAX_INLINE_SCRIPT = 64 * 1024
+
+
+class RemoteScript(object):
+    """A list of remote steps to run in a single round trip"""
+
+    def __init__(self):
+        self.steps = []
+        self.marker = "__step_{id}__".format(id=uuid.uuid4().hex)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def run(self, command, name=None, ignore_errors=False):
+        """Add a shell command to the script
+
+        name - the name to find the result by, defaults to the command
+        ignore_errors - continue with the next steps if the command fails
+        """
+        self.steps.append((name or command, command, ignore_errors))
+
+    def put(self, content, remote_path, append=False, name=None):
+        """Add a step writing the given string to a remote file"""
+        command = "base64 -d {redirect} {remote_path} <<'{marker}'\n{data}\n{marker}".format(
+            redirect='>>' if append else '>', remote_path=remote_path, marker=self.marker,
+            data=base64.encodestring(content).strip())
+        self.steps.append((name or 'put {remote_path}'.format(remote_path=remote_path), command, False))
+
+    def put_file(self, local_path, remote_path, name=None):
+        """Add a step copying a (small) local file to the remote host"""
+        with open(local_path) as f:
+            self.put(f.read(), remote_path, name=name)
+
+    def script(self):
+        """Return the bash source of the script"""
+        lines = []
+        for i, (name, command, ignore_errors) in enumerate(self.steps):
+            lines.append('echo "{marker} begin {i}"'.format(marker=self.marker, i=i))
+            lines.append('__start=$(date +%s.%N)')
+            lines.append('(\n{command}\n) < /dev/null 2>&1'.format(command=command))
+            lines.append('__rc=$?')
+            lines.append('echo')
+            lines.append('echo "{marker} end {i} $__rc $__start $(date +%s.%N)"'.format(marker=self.marker, i=i))
+            if not ignore_errors:
+                lines.append('[ $__rc -eq 0 ] || exit $__rc')
+        return "\n".join(lines) + "\n"
+
+    def execute(self, pty=True):
+        """Run the script on the current host
+
+        Returns a list of StepResult, one per step that ran. Aborts if a
+        step without ignore_errors fails."""
+        if len(self.steps) == 0:
+            return []
+        script = self.script()
+        start = time.time()
+        if len(script) > MAX_INLINE_SCRIPT:
+            remote_path = '/tmp/{marker}.sh'.format(marker=self.marker)
+            fd, local_path = tempfile.mkstemp(suffix='.sh')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(script)
+                ssh_pool.put(local_path, remote_path)
+            finally:
+                os.remove(local_path)
+            output = ssh_pool.run('bash {remote_path}; __rc=$?; rm -f {remote_path}; exit $__rc'.format(
+                remote_path=remote_path), quiet=True, pty=pty)
+        else:
+            # base64 keeps fabric's shell escaping from altering the script:
+            output = ssh_pool.run('__script=$(mktemp) && echo {data} | base64 -d > $__script && bash $__script; '
+                             '__rc=$?; rm -f $__script; exit $__rc'.format(
+                                 data=base64.b64encode(script)), quiet=True, pty=pty)
+        results = self.parse(output)
+        fab.puts("Ran {n} of {total} steps in {seconds:.2f}s".format(
+            n=len(results), total=len(self.steps), seconds=time.time() - start))
+        # The steps run in order, so results[i] is the result of steps[i]:
+        for (name, command, ignore_errors), result in zip(self.steps, results):
+            if result.return_code != 0 and not ignore_errors:
+                fab.abort("Remote step failed (return code {rc}): {command}\n{output}".format(
+                    rc=result.return_code, command=command, output=result.output))
+        if len(results) < len(self.steps):
+            fab.abort("Remote script stopped before completing all steps:\n{output}".format(output=output))
+        return results
+
+    def parse(self, output):
+        """Parse the output of the script into a list of StepResult"""
+        results = []
+        step_output = None
+        for line in output.splitlines():
+            fields = line.strip().split()
+            if len(fields) >= 3 and fields[0] == self.marker:
+                if fields[1] == 'begin':
+                    step_output = []
+                elif fields[1] == 'end' and step_output is not None:
+                    i, rc, started, ended = int(fields[2]), int(fields[3]), float(fields[4]), float(fields[5])
+                    name, command, ignore_errors = self.steps[i]
+                    # Drop the blank line echoed before the end marker:
+                    if step_output and step_output[-1] == '':
+                        step_output.pop()
+                    results.append(StepResult(name, command, rc, "\n".join(step_output), ended - started))
+                    step_output = None
+                continue
+            if step_output is not None:
+                step_output.append(line.rstrip("\r"))
+        return results
+
+
+def result_by_name(results, name):
+    """Find a step result by name, or None if that step didn't run"""
+    for result in results:
+        if result.name == name:
+            return result
+    return None
@@ -0,0 +1,240 @@
+"""
+Persistent, multiplexed SSH connections to the cluster hosts.
+
+Fabric runs @parallel tasks in forked processes and clears its
+connection cache in each one, so every execute() authenticates a new
+SSH connection to every host. The pool instead keeps one OpenSSH
+ControlMaster connection open per host for the whole run. Remote
+commands and file copies go through the master's control socket, so
+after the first use of a host they only cost a new channel on an
+already authenticated connection.
+
+The control sockets live on the filesystem, so the forked task
+processes all share them. Each use is appended to a usage log in the
+same directory, which is how reuse statistics are collected across
+processes. Every run gets its own directory, so concurrent runs don't
+close each other's connections or mix up their statistics.
+
+The master connections are opened non interactively (BatchMode), so a
+host that needs a password or an interactive key can't be pooled. Its
+commands and copies go through fabric instead, as without a pool.
+"""
+
+import hashlib
+import logging
+import os
+import pipes
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from fabric import api as fab
+from fabric.network import normalize
+
+logger = logging.getLogger('ssh_pool')
+
+# The pool in use, if any, see start_pool():
+pool = None
+
+
+class RemoteResult(str):
+    """Output of a pooled remote command, with the same attributes as fab.run's result"""
+    def __new__(cls, output, return_code):
+        result = str.__new__(cls, output)
+        result.return_code = return_code
+        result.succeeded = return_code == 0
+        result.failed = not result.succeeded
+        return result
+
+
+class SSHConnectionPool(object):
+    """A ControlMaster connection per host, shared between processes"""
+
+    def __init__(self, control_dir=None, parent_dir=os.path.expanduser("~/.cstar_perf/ssh"), persist=600):
+        """control_dir - the directory to keep control sockets and the usage log in,
+                      by default a new directory under parent_dir, removed on close()
+        persist - the number of idle seconds after which a master connection closes itself,
+                  in case the pool isn't closed cleanly"""
+        self.remove_control_dir = control_dir is None
+        if control_dir is None:
+            if not os.path.exists(parent_dir):
+                os.makedirs(parent_dir)
+            control_dir = tempfile.mkdtemp(prefix='run-', dir=parent_dir)
+        elif not os.path.exists(control_dir):
+            os.makedirs(control_dir)
+        self.control_dir = control_dir
+        self.persist = persist
+        self.usage_log = os.path.join(control_dir, 'usage.log')
+        # Hosts a master connection couldn't be opened to, in this process:
+        self.unavailable = set()
+
+    def control_path(self, host_string):
+        # Socket paths are limited to ~100 characters, so use a hash
+        # rather than the host string:
+        return os.path.join(self.control_dir, 'cm-{h}.sock'.format(
+            h=hashlib.md5(host_string).hexdigest()[:12]))
+
+    def ssh_options(self, host_string):
+        """Get the options shared by ssh and scp for a host, and the host name"""
+        user, host, port = normalize(host_string)
+        options = ['-o', 'ControlPath={path}'.format(path=self.control_path(host_string)),
+                   '-o', 'BatchMode=yes', '-o', 'User={user}'.format(user=user),
+                   '-o', 'Port={port}'.format(port=port)]
+        key_filename = fab.env.key_filename
+        if isinstance(key_filename, basestring):
+            key_filename = [key_filename]
+        for key in key_filename or []:
+            options += ['-i', key]
+        return options, host
+
+    def is_open(self, host_string):
+        """Check if there is a live master connection to the host"""
+        options, host = self.ssh_options(host_string)
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(['ssh'] + options + ['-O', 'check', host],
+                                   stdout=devnull, stderr=devnull) == 0
+
+    def connect(self, host_string):
+        """Open the master connection to a host, unless it's already open
+
+        Returns False if the connection couldn't be opened (eg. the host
+        needs a password), True otherwise."""
+        if host_string in self.unavailable:
+            return False
+        if self.is_open(host_string):
+            self.record(host_string, 'reused')
+            return True
+        options, host = self.ssh_options(host_string)
+        with open(os.devnull, 'w') as devnull:
+            returncode = subprocess.call(['ssh'] + options +
+                                         ['-o', 'ControlMaster=yes', '-o', 'ControlPersist={s}'.format(s=self.persist),
+                                          '-o', 'ConnectionAttempts={n}'.format(n=fab.env.connection_attempts),
+                                          '-f', '-N', host],
+                                         stdin=devnull, stdout=devnull, stderr=devnull)
+        if returncode != 0:
+            logger.warn("Couldn't open a pooled SSH connection to {host}, using fabric's connections instead".format(
+                host=host_string))
+            self.unavailable.add(host_string)
+            self.record(host_string, 'failed')
+            return False
+        self.record(host_string, 'opened')
+        return True
+
+    def record(self, host_string, event):
+        # Lines this short are appended atomically, even from several
+        # processes at once:
+        with open(self.usage_log, 'a') as f:
+            f.write("{host} {event}\n".format(host=host_string, event=event))
+
+    def run(self, host_string, command, pty=True):
+        """Run a command on a host, like fab.run would, see connect()
+
+        Returns a RemoteResult."""
+        options, host = self.ssh_options(host_string)
+        if pty:
+            options.append('-tt')
+        # Wrap the command like fabric does, with env.shell:
+        remote_command = "{shell} {command}".format(shell=fab.env.shell, command=pipes.quote(command))
+        proc = subprocess.Popen(['ssh'] + options + [host, remote_command], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        return RemoteResult(output.strip(), proc.returncode)
+
+    def get(self, host_string, remote_path, local_path):
+        """Copy remote files (which may be a glob) to a local path, see connect()"""
+        options, host = self.ssh_options(host_string)
+        subprocess.check_call(['scp', '-q', '-r'] + options +
+                              ['{host}:{path}'.format(host=host, path=remote_path), local_path])
+
+    def put(self, host_string, local_path, remote_path):
+        """Copy a local file to a remote path, see connect()"""
+        options, host = self.ssh_options(host_string)
+        subprocess.check_call(['scp', '-q'] + options +
+                              [local_path, '{host}:{path}'.format(host=host, path=remote_path)])
+
+    def stats(self):
+        """Get the number of connections opened, reused and failed, per host and overall"""
+        hosts = {}
+        if os.path.exists(self.usage_log):
+            with open(self.usage_log) as f:
+                for line in f:
+                    try:
+                        host, event = line.split()
+                    except ValueError:
+                        continue
+                    host_stats = hosts.setdefault(host, {'opened': 0, 'reused': 0, 'failed': 0})
+                    host_stats[event] = host_stats.get(event, 0) + 1
+        opened = sum(h['opened'] for h in hosts.values())
+        reused = sum(h['reused'] for h in hosts.values())
+        failed = sum(h['failed'] for h in hosts.values())
+        return {'hosts': hosts, 'opened': opened, 'reused': reused, 'failed': failed,
+                'reuse_ratio': float(reused) / (opened + reused) if opened + reused > 0 else None}
+
+    def close(self):
+        """Close this pool's master connections and reset its usage log"""
+        for name in os.listdir(self.control_dir):
+            if name.startswith('cm-') and name.endswith('.sock'):
+                with open(os.devnull, 'w') as devnull:
+                    subprocess.call(['ssh', '-o', 'ControlPath={path}'.format(path=os.path.join(self.control_dir, name)),
+                                     '-O', 'exit', 'pooled-host'], stdout=devnull, stderr=devnull)
+        if os.path.exists(self.usage_log):
+            os.remove(self.usage_log)
+        if self.remove_control_dir:
+            shutil.rmtree(self.control_dir, ignore_errors=True)
+
+
+def start_pool(**kwargs):
+    """Start using a connection pool for remote commands, see run(), get() and put()
+
+    Must be called before the tasks are executed, so the forked task
+    processes inherit it."""
+    global pool
+    if pool is None:
+        pool = SSHConnectionPool(**kwargs)
+        # Start from clean usage statistics, if reusing a directory:
+        if os.path.exists(pool.usage_log):
+            os.remove(pool.usage_log)
+    return pool
+
+def close_pool():
+    """Close the connection pool, returning its final statistics"""
+    global pool
+    if pool is None:
+        return None
+    stats = pool.stats()
+    pool.close()
+    pool = None
+    return stats
+
+def run(command, quiet=False, pty=True):
+    """Run a command on the current host through the pool, or with fab.run
+    if there is none or the host can't be pooled
+
+    Unless quiet, the output is printed and a failed command aborts,
+    as with fab.run."""
+    if pool is None or not pool.connect(fab.env.host_string):
+        return fab.run(command, quiet=quiet, pty=pty)
+    result = pool.run(fab.env.host_string, command, pty=pty)
+    if not quiet:
+        for line in result.splitlines():
+            sys.stdout.write("[{host}] out: {line}\n".format(host=fab.env.host_string, line=line.rstrip("\r")))
+        sys.stdout.flush()
+        if result.failed:
+            fab.abort("run() received nonzero return code {rc} while executing '{command}'".format(
+                rc=result.return_code, command=command))
+    return result
+
+def get(remote_path, local_path):
+    """Copy remote files from the current host through the pool, or with
+    fab.get if there is none or the host can't be pooled"""
+    if pool is None or not pool.connect(fab.env.host_string):
+        return fab.get(remote_path, local_path)
+    pool.get(fab.env.host_string, remote_path, local_path)
+
+def put(local_path, remote_path):
+    """Copy a local file to the current host through the pool, or with
+    fab.put if there is none or the host can't be pooled"""
+    if pool is None or not pool.connect(fab.env.host_string):
+        return fab.put(local_path, remote_path)
+    pool.put(fab.env.host_string, local_path, remote_path)
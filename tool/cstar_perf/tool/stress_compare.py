@@ -1,9 +1,16 @@
-from benchmark import (bootstrap, stress, nodetool, nodetool_multi, cqlsh, bash, teardown, 
-                       log_stats, log_set_title, log_add_data, retrieve_logs, cstar, restart,
-                       start_fincore_capture, stop_fincore_capture, retrieve_fincore_logs,
-                       drop_page_cache, wait_for_compaction)
+from benchmark import (bootstrap, switch_revision, stress, stress_multi, nodetool, nodetool_multi, cqlsh, bash, teardown, 
+                       log_set_title, collect_logs, cstar, restart,
+                       start_fincore_capture, stop_fincore_capture,
+                       drop_page_cache, wait_for_compaction, results_journal_path,
+                       start_sysstat_capture, stop_sysstat_capture, retrieve_sysstat_logs, collect_sysstat,
+                       collect_gc_stats, sstable_format_version, dataset_key, dataset_cached,
+                       capture_dataset, restore_dataset, use_controller_install,
+                       journal_stats, journal_add_data, journal_import_log, journal_finalize,
+                       journal_records)
 from benchmark import config as fab_config
+from analysis import operation_metric, trial_summary
 from fabric.tasks import execute
+import ssh_pool
 import os
 import sys
 import time
@@ -12,11 +19,12 @@ import logging
 import socket
 import copy
 import uuid
+import random
+import multiprocessing
 import argparse
 import json
-import subprocess
-import shlex
 import shutil
+import tempfile
 
 logging.basicConfig()
 logger = logging.getLogger('stress_compare')
@@ -28,6 +36,25 @@ def validate_revisions_list(revisions):
     for rev in revisions:
         assert rev.has_key('revision'), "Revision needs a 'revision' tag"
 
+def operation_stress_clients(operation):
+    """Get the load generators to run a stress operation from, or None to run it from the controller
+
+    The operation's clients can be 'all' of the configured
+    stress_clients, a number of them, a host, or a list of hosts."""
+    clients = operation.get('clients')
+    if clients is None:
+        return None
+    configured = cstar.config.get('stress_clients') or []
+    if clients in ('all', 'ALL'):
+        clients = configured
+    elif isinstance(clients, basestring):
+        clients = [clients]
+    elif isinstance(clients, int):
+        if clients > len(configured):
+            return None
+        clients = configured[:clients]
+    return list(clients) or None
+
 def validate_operations_list(operations):
     """Spot check a list of operations for required parameters"""
     for op in operations:
@@ -39,6 +66,14 @@ def validate_operations_list(operations):
                 raise AssertionError('stress operations use a nodes parameter, not node.')
             elif op.has_key('nodes'):
                 assert '-node' not in op['command'], "Stress command line cannot specify nodes if nodes is specified in operation"
+            if op.has_key('trials'):
+                assert isinstance(op['trials'], dict), "Stress operation trials must be a dictionary of settings"
+                assert op['trials'].get('scope', 'operation') == 'operation', "Stress operation trials can only have the operation scope"
+                # Every trial after the first would restore the dataset
+                # without running stress, leaving nothing to measure:
+                assert not op.get('dataset_cache'), "Stress operation can't have both trials and dataset_cache"
+            if op.has_key('clients'):
+                assert operation_stress_clients(op), "Stress operation clients must be 'all', a number, a host or a list of hosts, and stress_clients must be configured"
         elif op['type'] == 'nodetool':
             assert op.has_key('command'), "Nodetool operation missing comamnd"
             for option in [' -h',' --host']:
@@ -59,7 +94,12 @@ def stress_compare(revisions,
                    capture_fincore=False,
                    initial_destroy=True,
                    leave_data=False,
-                   keep_page_cache=False
+                   keep_page_cache=False,
+                   capture_sysstat=False,
+                   sysstat_interval=1,
+                   trials=None,
+                   interleave=None,
+                   partitions=None
                ):
     """
     Run Stress on multiple C* branches and compare them.
@@ -68,7 +108,9 @@ def stress_compare(revisions,
                 to trial. This is combined with the default config.
     title - The title of the comparison
     subtitle - A subtitle for more information (displayed smaller underneath)
-    log - The json file path to record stats to
+    log - The json file path to record stats to. Stats are appended to
+          a journal alongside it as the run progresses, and the json
+          file is built from the journal when the run finishes.
     operations - List of dictionaries indicating the operations. Example:
        [# cassandra-stress command, node defaults to cluster defined 'stress_node'
         {'type': 'stress',
@@ -79,21 +121,118 @@ def stress_compare(revisions,
         {'type': 'nodetool',
          'command': 'decomission',
          'nodes': ['node1','node2']},
+        # stress operation loading data, restored from a snapshot of an
+        # earlier identical load when there is one (see benchmark.capture_dataset):
+        {'type': 'stress',
+         'command': 'write n=19000000 -rate threads=50',
+         'dataset_cache': True},
         # cqlsh script, node defaults to cluster defined 'stress_node'
         {'type': 'cqlsh',
          'script': "use my_ks; INSERT INTO blah (col1, col2) VALUES (val1, val2);",
          'node': 'node1'}
        ]
-    capture_fincore - Enables capturing of linux-fincore logs of C* data files.
+    capture_fincore - Enables capturing the page cache residency of C* data files, see fincore_capture.py.
     initial_destroy - Destroy all data before the first revision is run.
     leave_data - Whether to leave the Cassandra data/commitlog/etc directories intact between revisions.
     keep_page_cache - Whether to leave the linux page cache intact between revisions.
+    capture_sysstat - Enables sampling system metrics (cpu, disk, network, memory) on
+                      each node during each operation, see sysstat_capture.py.
+    sysstat_interval - The time, in seconds, between system metrics samples.
+    trials - Repeat stress operations until the confidence interval of
+             their mean is narrow enough, so run to run noise isn't
+             mistaken for a regression. A dictionary of:
+               metric - the metric to converge (see analysis.METRICS), default 'op_rate'
+               target - the largest confidence interval half width, relative to the mean, default 0.02
+               confidence - the confidence level of the interval, default 0.95
+               min, max - the fewest and most trials to run, default 2 and 5
+               scope - 'operation' to repeat each stress operation on it's own,
+                       or 'revision' to repeat passes of all the operations
+             A stress operation can also have it's own trials setting
+             (with the operation scope). Operations with dataset_cache
+             can't be repeated in trials, so trials can only be set on
+             the other operations then. Every trial is recorded in the
+             stats, and the summary of the trials of each revision is
+             recorded with the revision.
+    interleave - Run the revisions in interleaved blocks, rather than one
+                 after the other, so drift of the cluster over the run
+                 affects every revision alike. Every revision is
+                 installed side by side first, so switching revisions is
+                 only a restart. A dictionary of:
+                   blocks - the number of blocks, each running every revision once, default 2
+                   order - 'alternating' to run the revisions in the same
+                           order in every block (ABAB), or 'randomized' to
+                           shuffle them in each block, default 'alternating'
+                   seed - the seed of the randomized order, recorded in
+                          the stats, default random
+                 The stats of each operation record the block they ran
+                 in, so the analysis can compare revisions within blocks.
+                 The data is left between revisions of a block only
+                 if leave_data is set.
+    partitions - Split the cluster into independent sub-clusters, and
+                 test a share of the revisions on each of them at the
+                 same time. Either a number of partitions to split the
+                 configured hosts (and stress_clients) into evenly, or a
+                 list of dictionaries of hosts and stress_clients. Each
+                 partition has it's own seed and cluster name, and runs
+                 stress from it's stress_clients (if the operations use
+                 clients) or from the controller. The stats of every
+                 partition are collected into the one log.
     """
     validate_revisions_list(revisions)
     validate_operations_list(operations)
+    if trials is not None:
+        assert not any(op.get('dataset_cache') for op in operations), \
+            "Trials can't repeat operations with dataset_cache, set trials on the other operations instead"
+    # The analysis tells revisions apart by their position, as several
+    # can have the same label:
+    for rev_num, revision_config in enumerate(revisions):
+        revision_config['revision_index'] = rev_num
+    if interleave is not None:
+        assert interleave_settings(interleave)['order'] in ('alternating', 'randomized'), \
+            "Interleave order must be 'alternating' or 'randomized'"
+    if partitions is not None:
+        assert interleave is None, "Revisions can't be both interleaved and partitioned"
+        validate_partitions(partition_hosts(partitions))
 
+    journal = results_journal_path(log)
+    if not os.path.exists(journal) and os.path.exists(log) and os.path.getsize(log) > 0:
+        # Keep the stats already in the log from previous runs:
+        journal_import_log(log, journal)
+
+    # Keep connections to the hosts open for the whole run:
+    if cstar.config.get('ssh_pool', True):
+        ssh_pool.start_pool()
+
+    try:
+        if partitions is not None:
+            run_partitioned(revisions, title, log, journal, operations, subtitle, capture_fincore,
+                            initial_destroy, leave_data, keep_page_cache, capture_sysstat, sysstat_interval,
+                            trials, partitions)
+        elif interleave is not None:
+            run_interleaved(revisions, title, log, journal, operations, subtitle, capture_fincore,
+                            initial_destroy, leave_data, keep_page_cache, capture_sysstat, sysstat_interval,
+                            trials, interleave)
+        else:
+            run_revisions(revisions, title, log, journal, operations, subtitle, capture_fincore,
+                          initial_destroy, leave_data, keep_page_cache, capture_sysstat, sysstat_interval,
+                          trials)
+    finally:
+        pool_stats = ssh_pool.close_pool()
+        if pool_stats is not None:
+            logger.info("SSH connections opened: {opened}, reused: {reused}, failed: {failed}".format(**pool_stats))
+        # Build the json log even if the run failed part way, so
+        # whatever completed is still reported:
+        if os.path.exists(journal):
+            if pool_stats is not None:
+                journal_add_data(journal, {'ssh_pool': pool_stats})
+            journal_finalize(journal, log)
+
+def run_revisions(revisions, title, log, journal, operations, subtitle, capture_fincore,
+                  initial_destroy, leave_data, keep_page_cache, capture_sysstat, sysstat_interval,
+                  trials=None):
+    """Run the operations on each revision, recording stats to the results journal"""
     pristine_config = copy.copy(fab_config)
-    
+
     if initial_destroy:
         logger.info("Cleaning up from prior runs of stress_compare ...")
         teardown(destroy=True, leave_data=False)
@@ -115,98 +254,444 @@ def stress_compare(revisions,
 
         #Only fetch from git on the first run:
         git_fetch = True if rev_num == 0 else False
-        revision_config['git_id'] = git_id = bootstrap(config, destroy=True, leave_data=leave_data, git_fetch=git_fetch)
+        revision_config['bootstrap_stats'] = bootstrap_stats = {}
+        revision_config['git_id'] = bootstrap(config, destroy=True, leave_data=leave_data, git_fetch=git_fetch,
+                                             revisions=[r['revision'] for r in revisions],
+                                             stats=bootstrap_stats)
     
         if capture_fincore:
             start_fincore_capture(interval=10)
 
-        for operation_i, operation in enumerate(operations, 1):
-            start = datetime.datetime.now()
-            stats = {"id":str(uuid.uuid1()), "type":operation['type'], 
-                     "revision": revision, "git_id": git_id, "start_date":start.isoformat(),
-                     "label":revision_config.get('label', revision_config['revision'])}
-
-            if operation['type'] == 'stress':
-                # Default to all the nodes of the cluster if no 
-                # nodes were specified in the command:
-                if operation.has_key('nodes'):
-                    cmd = "{command} -node {hosts}".format(
-                        command=operation['command'], 
-                        hosts=",".join(host=operation['nodes']))
-                elif '-node' in operation['command']:
-                    cmd = operation['command']
-                else:
-                    cmd = "{command} -node {hosts}".format(
-                        command=operation['command'], 
-                        hosts=",".join([n for n in fab_config['hosts']]))
-                stats['command'] = cmd
-                stats['intervals'] = []
-                stats['test'] = '{operation_i}_{operation}'.format(
-                    operation_i=operation_i, operation=cmd.strip().split(' ')[0]).replace(" ","_")
-                logger.info('Running stress operation : {cmd}  ...'.format(cmd=cmd))
-                # Run stress:
-                # (stress takes the stats as a parameter, and adds
-                #  more as it runs):
-                stats = stress(cmd, revision, stats)
-                # Wait for all compactions to finish (unless disabled):
-                if operation.get('wait_for_compaction', True):
-                    compaction_throughput = revision_config.get("compaction_throughput_mb_per_sec", 16)
-                    wait_for_compaction(compaction_throughput=compaction_throughput)
-
-            elif operation['type'] == 'nodetool':
-                if operation['nodes'] in ['all','ALL']:
-                    nodes = [n for n in fab_config['hosts']]
-                else:
-                    nodes = operation['nodes']
-
-                logger.info("Running nodetool on {nodes} with command: {command}".format(nodes=operation['nodes'], command=operation['command']))
-                stats['command'] = operation['command']
-                output = nodetool_multi(nodes, operation['command'])
-                stats['output'] = output
-                logger.info("Nodetool command finished on all nodes")
-
-            elif operation['type'] == 'cqlsh':
-                logger.info("Running cqlsh commands on {node}".format(node=operation['node']))
-                output = cqlsh(operation['script'], operation['node'])
-                stats['output'] = output.split("\n")
-                logger.info("Cqlsh commands finished")
-
-            elif operation['type'] == 'bash':
-                nodes = operation.get('nodes', [n for n in fab_config['hosts']])
-                logger.info("Running bash commands on {node}".format(nodes=nodes))
-                output = bash(operation['script'], nodes)
-                stats['output'] = output.split("\n")
-                logger.info("Bash commands finished")
-
-
-            end = datetime.datetime.now()
-            stats['end_date'] = end.isoformat()
-            stats['op_duration'] = str(end - start)
-            log_stats(stats, file=log)
-
-            #Copy node logs:
-            logs_dir = os.path.join(os.path.expanduser('~'),'.cstar_perf','logs')
-            log_dir = os.path.join(logs_dir, stats['id'])
-            os.makedirs(log_dir)
-            retrieve_logs(log_dir)
-            revision_config['last_log'] = stats['id']
-            #Tar them for archiving:
-            subprocess.Popen(shlex.split('tar cfvz {id}.tar.gz {id}'.format(id=stats['id'])), cwd=logs_dir).communicate()
-            shutil.rmtree(log_dir)
+        summaries = run_operations(operations, trials, revision_config, journal, capture_fincore,
+                                   capture_sysstat, sysstat_interval)
+        if summaries:
+            revision_config['trials'] = summaries
+
+        if capture_fincore:
+            stop_fincore_capture()
+
+        journal_add_data(journal, {'title':title,
+                                   'subtitle': subtitle,
+                                   'revisions': revisions})
+
+        revision_config['teardown_waves'] = teardown(destroy=True, leave_data=leave_data)
+        journal_add_data(journal, {'revisions': revisions})
+
+def partition_hosts(partitions):
+    """Get the hosts and stress clients of each partition, see stress_compare"""
+    if not isinstance(partitions, int):
+        return [{'hosts': list(p['hosts']), 'stress_clients': list(p.get('stress_clients') or [])}
+                for p in partitions]
+    hosts = sorted(fab_config['hosts'])
+    clients = list(cstar.config.get('stress_clients') or [])
+    split = []
+    for n in range(partitions):
+        split.append({'hosts': hosts[n * len(hosts) / partitions:(n + 1) * len(hosts) / partitions],
+                      'stress_clients': clients[n * len(clients) / partitions:(n + 1) * len(clients) / partitions]})
+    return split
+
+def validate_partitions(partitions):
+    """Check the partitions are disjoint, non empty sets of configured hosts, without the controller"""
+    seen = set()
+    localhost = socket.gethostname().split(".")[0]
+    for partition in partitions:
+        assert partition['hosts'], "Every partition needs at least one host"
+        for host in partition['hosts']:
+            assert fab_config['hosts'].has_key(host), "Partition host {host} isn't configured".format(host=host)
+            # Every partition installs cassandra on the controller too, a
+            # node running on it would be reinstalled by the others:
+            assert host.split(".")[0] != localhost, "Partition host {host} is the controller".format(host=host)
+            assert host not in seen, "Host {host} is in more than one partition".format(host=host)
+            seen.add(host)
+
+def partition_config(partition, number):
+    """Get the cluster configuration of a partition, to update the cluster config with"""
+    hosts = {}
+    for i, host in enumerate(partition['hosts']):
+        hosts[host] = host_config = dict(fab_config['hosts'][host])
+        # The first host is the seed, and tokens are balanced again
+        # for the size of the partition (unless using vnodes):
+        host_config['seed'] = i == 0
+        host_config.pop('initial_token', None)
+    return {'hosts': hosts,
+            'stress_clients': partition['stress_clients'],
+            'cluster_name': "{name} partition {number}".format(name=cstar.config['cluster_name'], number=number)}
+
+def run_partitioned(revisions, title, log, journal, operations, subtitle, capture_fincore,
+                    initial_destroy, leave_data, keep_page_cache, capture_sysstat, sysstat_interval,
+                    trials, partitions):
+    """Run the revisions on disjoint partitions of the cluster at the same
+    time, recording stats to the results journal
+
+    The revisions are dealt to the partitions in turn. Each partition
+    runs in it's own process, with it's own results journal, and the
+    journals are merged into this one when they all finish."""
+    partitions = partition_hosts(partitions)
+    processes = []
+    for number, partition in enumerate(partitions):
+        revision_numbers = range(number, len(revisions), len(partitions))
+        if not revision_numbers:
+            continue
+        partition_journal = "{journal}.partition{number}".format(journal=journal, number=number)
+        if os.path.exists(partition_journal):
+            os.remove(partition_journal)
+        partition_revisions = [revisions[r] for r in revision_numbers]
+        for revision_config in partition_revisions:
+            revision_config['partition'] = number
+        process = multiprocessing.Process(target=run_partition, name="partition{n}".format(n=number), args=(
+            partition, number, partition_revisions, title, log, partition_journal, operations, subtitle,
+            capture_fincore, initial_destroy, leave_data, keep_page_cache, capture_sysstat, sysstat_interval,
+            trials))
+        process.start()
+        logger.info("Started partition {number} on {hosts} for {revisions}".format(
+            number=number, hosts=partition['hosts'], revisions=[r['revision'] for r in partition_revisions]))
+        processes.append((number, revision_numbers, partition_journal, process))
+
+    failed = []
+    for number, revision_numbers, partition_journal, process in processes:
+        process.join()
+        if process.exitcode != 0:
+            failed.append(number)
+        if not os.path.exists(partition_journal):
+            continue
+        # Keep the stats and the final state of the revisions the
+        # partition ran:
+        for record in journal_records(partition_journal):
+            if record['type'] == 'stats':
+                journal_stats(journal, record['data'])
+            elif record['data'].has_key('revisions'):
+                for r, revision_config in zip(revision_numbers, record['data']['revisions']):
+                    revisions[r] = revision_config
+        os.remove(partition_journal)
+
+    journal_add_data(journal, {'title': title,
+                               'subtitle': subtitle,
+                               'revisions': revisions,
+                               'partitions': partitions})
+    if failed:
+        raise AssertionError("Partitions {failed} failed, see the log above".format(failed=failed))
+
+def run_partition(partition, number, revisions, title, log, journal, operations, subtitle, capture_fincore,
+                  initial_destroy, leave_data, keep_page_cache, capture_sysstat, sysstat_interval, trials):
+    """Run revisions on one partition of the cluster, in a process of it's own"""
+    # This process has it's own copy of the configuration, limit it to
+    # the partition:
+    fab_config.update(partition_config(partition, number))
+    cstar.setup(fab_config)
+    cstar.fab.env.hosts = list(partition['hosts'])
+    # Use nodetool and cqlsh from a copy of the controller's install the
+    # other partitions won't replace:
+    install_dir = os.path.expanduser("~/fab/cassandra_partitions/{pid}".format(pid=os.getpid()))
+    use_controller_install(install_dir)
+    try:
+        run_revisions(revisions, title, log, journal, operations, subtitle, capture_fincore,
+                      initial_destroy, leave_data, keep_page_cache, capture_sysstat, sysstat_interval, trials)
+    finally:
+        shutil.rmtree(install_dir, ignore_errors=True)
+
+def interleave_settings(interleave):
+    """Fill in the defaults of an interleave setting, see stress_compare"""
+    settings = {'blocks': 2, 'order': 'alternating', 'seed': None}
+    settings.update(interleave)
+    return settings
+
+def interleaved_schedule(num_revisions, settings):
+    """Get the order to run the revisions in, in each block, as lists of revision indexes"""
+    schedule = []
+    rng = random.Random(settings['seed'])
+    for block in range(settings['blocks']):
+        order = range(num_revisions)
+        if settings['order'] == 'randomized':
+            rng.shuffle(order)
+        schedule.append(order)
+    return schedule
+
+def run_interleaved(revisions, title, log, journal, operations, subtitle, capture_fincore,
+                    initial_destroy, leave_data, keep_page_cache, capture_sysstat, sysstat_interval,
+                    trials, interleave):
+    """Install every revision side by side, then run the operations on
+    each of them in interleaved blocks, recording stats to the results
+    journal"""
+    pristine_config = copy.copy(fab_config)
+    settings = interleave_settings(interleave)
+    if settings['seed'] is None:
+        settings['seed'] = random.randint(0, 2**31)
+    schedule = interleaved_schedule(len(revisions), settings)
+
+    if initial_destroy:
+        logger.info("Cleaning up from prior runs of stress_compare ...")
+        teardown(destroy=True, leave_data=False)
+    execute(cstar.remove_installations)
+
+    configs = []
+    for rev_num, revision_config in enumerate(revisions):
+        config = copy.copy(pristine_config)
+        config.update(revision_config)
+        config['log'] = log
+        config['title'] = title
+        config['subtitle'] = subtitle
+        configs.append(config)
+
+        logger.info("Installing {revision} ...".format(revision=revision_config['revision']))
+        revision_config['bootstrap_stats'] = bootstrap_stats = {}
+        revision_config['git_id'] = bootstrap(config, destroy=True, leave_data=True, git_fetch=rev_num == 0,
+                                              revisions=[r['revision'] for r in revisions],
+                                              stats=bootstrap_stats, start=False)
+        execute(cstar.save_installation, rev_num)
+
+    journal_add_data(journal, {'title': title,
+                               'subtitle': subtitle,
+                               'interleave': {'blocks': settings['blocks'], 'order': settings['order'],
+                                              'seed': settings['seed'],
+                                              'schedule': [[revisions[r].get('label', revisions[r]['revision'])
+                                                            for r in order] for order in schedule]}})
+
+    for block, order in enumerate(schedule, 1):
+        for position, rev_num in enumerate(order, 1):
+            revision_config = revisions[rev_num]
+            logger.info("Block {block}: switching to {revision} ...".format(
+                block=block, revision=revision_config['revision']))
+            if not keep_page_cache:
+                drop_page_cache()
+            switch_stats = {}
+            switch_revision(configs[rev_num], rev_num, leave_data=leave_data,
+                            stats=switch_stats)
+
+            if capture_fincore:
+                start_fincore_capture(interval=10)
+
+            summaries = run_operations(operations, trials, revision_config, journal, capture_fincore,
+                                       capture_sysstat, sysstat_interval,
+                                       extra_stats={'block': block, 'block_position': position})
 
             if capture_fincore:
                 stop_fincore_capture()
-                retrieve_fincore_logs(log_dir)
-                # Restart fincore capture if this is not the last
-                # operation:
-                if operation_i < len(operations):
-                    start_fincore_capture(interval=10)
 
-        log_add_data(log, {'title':title,
-                           'subtitle': subtitle,
-                           'revisions': revisions})
+            revision_config.setdefault('blocks', []).append({'block': block, 'position': position,
+                                                             'switch': switch_stats, 'trials': summaries})
+            journal_add_data(journal, {'revisions': revisions})
+
+    revisions[-1]['teardown_waves'] = teardown(destroy=True, leave_data=leave_data)
+    execute(cstar.remove_installations)
+    journal_add_data(journal, {'revisions': revisions})
+
+def run_operations(operations, trials, revision_config, journal, capture_fincore, capture_sysstat,
+                   sysstat_interval, extra_stats=None):
+    """Run all the operations on a revision, repeating them in trials if configured
+
+    Returns the trial summary of each stress operation repeated, by test."""
+    run_operation_args = (revision_config, journal, capture_fincore, capture_sysstat, sysstat_interval)
+    if trials is not None and trials_settings(trials)['scope'] == 'revision':
+        return run_revision_trials(operations, trials_settings(trials), *run_operation_args,
+                                   extra_stats=extra_stats)
+    summaries = {}
+    for operation_i, operation in enumerate(operations, 1):
+        operation_trials = operation.get('trials', trials)
+        if operation['type'] == 'stress' and operation_trials is not None:
+            summary = run_operation_trials(operation, operation_i, trials_settings(operation_trials),
+                                           *run_operation_args, extra_stats=extra_stats)
+            summaries[summary['test']] = summary
+        else:
+            run_operation(operation, operation_i, *run_operation_args, extra_stats=extra_stats)
+    return summaries
+
+def run_operation(operation, operation_i, revision_config, journal, capture_fincore, capture_sysstat,
+                  sysstat_interval, extra_stats=None):
+    """Run a single operation, recording it's stats to the results journal
+
+    extra_stats - additional stats to record with the operation (eg. the trial number)
+
+    Returns the stats."""
+    revision = revision_config['revision']
+    clock_offsets = None
+    if capture_sysstat:
+        clock_offsets = start_sysstat_capture(interval=sysstat_interval)
+    start = datetime.datetime.now()
+    stats = {"id":str(uuid.uuid1()), "type":operation['type'], 
+             "revision": revision, "git_id": revision_config['git_id'], "start_date":start.isoformat(),
+             "start_timestamp": time.time(),
+             "label":revision_config.get('label', revision_config['revision']),
+             "revision_index": revision_config.get('revision_index')}
+    stats.update(extra_stats or {})
+
+    if operation['type'] == 'stress':
+        # Default to all the nodes of the cluster if no 
+        # nodes were specified in the command:
+        if operation.has_key('nodes'):
+            cmd = "{command} -node {hosts}".format(
+                command=operation['command'], 
+                hosts=",".join(host=operation['nodes']))
+        elif '-node' in operation['command']:
+            cmd = operation['command']
+        else:
+            cmd = "{command} -node {hosts}".format(
+                command=operation['command'], 
+                hosts=",".join([n for n in fab_config['hosts']]))
+        stats['command'] = cmd
+        stats['intervals'] = []
+        stats['test'] = '{operation_i}_{operation}'.format(
+            operation_i=operation_i, operation=cmd.strip().split(' ')[0]).replace(" ","_")
+        dataset = None
+        if operation.get('dataset_cache'):
+            dataset = dataset_key(cmd, sstable_format_version())
+        if dataset is not None and dataset_cached(dataset):
+            logger.info('Restoring dataset {dataset} instead of running stress operation : {cmd}  ...'.format(
+                dataset=dataset, cmd=cmd))
+            stats['dataset_cache'] = restore_dataset(dataset)
+        else:
+            logger.info('Running stress operation : {cmd}  ...'.format(cmd=cmd))
+            # Run stress:
+            # (stress takes the stats as a parameter, and adds
+            #  more as it runs):
+            clients = operation_stress_clients(operation)
+            if clients:
+                stats = stress_multi(cmd, revision, stats, clients,
+                                     capture_histograms=operation.get('capture_histograms'))
+            else:
+                stats = stress(cmd, revision, stats, capture_histograms=operation.get('capture_histograms'))
+            # Wait for all compactions to finish (unless disabled):
+            if operation.get('wait_for_compaction', True):
+                compaction_throughput = revision_config.get("compaction_throughput_mb_per_sec", 16)
+                wait_for_compaction(compaction_throughput=compaction_throughput, stats=stats)
+            if dataset is not None:
+                stats['dataset_cache'] = capture_dataset(dataset)
 
-        teardown(destroy=True, leave_data=leave_data)
+    elif operation['type'] == 'nodetool':
+        if operation['nodes'] in ['all','ALL']:
+            nodes = [n for n in fab_config['hosts']]
+        else:
+            nodes = operation['nodes']
+
+        logger.info("Running nodetool on {nodes} with command: {command}".format(nodes=operation['nodes'], command=operation['command']))
+        stats['command'] = operation['command']
+        output = nodetool_multi(nodes, operation['command'])
+        stats['output'] = output
+        logger.info("Nodetool command finished on all nodes")
+
+    elif operation['type'] == 'cqlsh':
+        logger.info("Running cqlsh commands on {node}".format(node=operation['node']))
+        output = cqlsh(operation['script'], operation['node'])
+        stats['output'] = output.split("\n")
+        logger.info("Cqlsh commands finished")
+
+    elif operation['type'] == 'bash':
+        nodes = operation.get('nodes', [n for n in fab_config['hosts']])
+        logger.info("Running bash commands on {node}".format(nodes=nodes))
+        output = bash(operation['script'], nodes)
+        stats['output'] = output.split("\n")
+        logger.info("Bash commands finished")
+
+
+    end = datetime.datetime.now()
+    stats['end_date'] = end.isoformat()
+    stats['op_duration'] = str(end - start)
+    stats['end_timestamp'] = time.time()
+
+    if capture_sysstat:
+        stop_sysstat_capture()
+        sysstat_dir = tempfile.mkdtemp()
+        try:
+            retrieve_sysstat_logs(sysstat_dir)
+            stats['sysstat'] = collect_sysstat(sysstat_dir, clock_offsets, stats['start_timestamp'])
+        finally:
+            shutil.rmtree(sysstat_dir)
+
+    #Archive node logs:
+    logs_dir = os.path.join(os.path.expanduser('~'),'.cstar_perf','logs')
+    if not os.path.exists(logs_dir):
+        os.makedirs(logs_dir)
+    if capture_fincore:
+        stop_fincore_capture()
+    log_archive = os.path.join(logs_dir, '{id}.tar.gz'.format(id=stats['id']))
+    stats['log_collection'] = collect_logs(log_archive, stats['id'], fincore=capture_fincore)
+    stats['gc'] = collect_gc_stats(log_archive, stats['start_timestamp'], stats['end_timestamp'], clock_offsets)
+
+    journal_stats(journal, stats)
+
+    revision_config['last_log'] = stats['id']
+
+    # Restart fincore capture for the next operation:
+    if capture_fincore:
+        start_fincore_capture(interval=10)
+    return stats
+
+def trials_settings(trials):
+    """Fill in the defaults of a trials setting, see stress_compare"""
+    settings = {'min': 2, 'max': 5, 'metric': 'op_rate', 'target': 0.02,
+                'confidence': 0.95, 'scope': 'operation'}
+    settings.update(trials)
+    return settings
+
+def trials_done(summary, settings):
+    """Has a trial summary converged, or reached the trial cap?"""
+    if summary['trials'] >= settings['max']:
+        return True
+    return (summary['trials'] >= settings['min'] and summary['relative_half_width'] is not None
+            and summary['relative_half_width'] <= settings['target'])
+
+def run_operation_trials(operation, operation_i, settings, revision_config, journal, capture_fincore,
+                         capture_sysstat, sysstat_interval, extra_stats=None):
+    """Repeat a stress operation until the confidence interval of the
+    metric is narrow enough, or the trial cap is reached
+
+    Returns the trial summary (see analysis.trial_summary)."""
+    trials_id = str(uuid.uuid1())
+    values = []
+    trial = 0
+    while True:
+        trial += 1
+        stats = run_operation(operation, operation_i, revision_config, journal, capture_fincore,
+                              capture_sysstat, sysstat_interval,
+                              extra_stats=dict(extra_stats or {}, trial=trial, trials_id=trials_id))
+        value = operation_metric(stats, settings['metric'])
+        if value is not None:
+            values.append(value)
+        summary = trial_summary(values, settings['confidence'])
+        summary['trials'] = trial
+        logger.info("Trial {trial} of {test}: {metric} = {value}, relative CI half width = {width}".format(
+            trial=trial, test=stats.get('test'), metric=settings['metric'], value=value,
+            width=summary['relative_half_width']))
+        if trials_done(summary, settings):
+            break
+    summary.update({'test': stats.get('test'), 'trials_id': trials_id, 'metric': settings['metric'],
+                    'target': settings['target'], 'converged': summary['relative_half_width'] is not None and
+                    summary['relative_half_width'] <= settings['target']})
+    return summary
+
+def run_revision_trials(operations, settings, revision_config, journal, capture_fincore,
+                        capture_sysstat, sysstat_interval, extra_stats=None):
+    """Repeat all the operations, in passes, until the confidence
+    interval of the metric of every stress operation is narrow enough,
+    or the trial cap is reached
+
+    Returns the trial summary of each stress operation, by test."""
+    trials_id = str(uuid.uuid1())
+    values = {}
+    summaries = {}
+    trial = 0
+    while True:
+        trial += 1
+        for operation_i, operation in enumerate(operations, 1):
+            stats = run_operation(operation, operation_i, revision_config, journal, capture_fincore,
+                                  capture_sysstat, sysstat_interval,
+                                  extra_stats=dict(extra_stats or {}, trial=trial, trials_id=trials_id))
+            if operation['type'] != 'stress':
+                continue
+            test = stats['test']
+            value = operation_metric(stats, settings['metric'])
+            if value is not None:
+                values.setdefault(test, []).append(value)
+            summaries[test] = summary = trial_summary(values.get(test, []), settings['confidence'])
+            summary['trials'] = trial
+        logger.info("Trial pass {trial}: relative CI half widths {widths}".format(
+            trial=trial, widths=dict((test, s['relative_half_width']) for test, s in summaries.items())))
+        if all(trials_done(summary, settings) for summary in summaries.values()):
+            break
+    for test, summary in summaries.items():
+        summary.update({'test': test, 'trials_id': trials_id, 'metric': settings['metric'],
+                        'target': settings['target'], 'converged': summary['relative_half_width'] is not None and
+                        summary['relative_half_width'] <= settings['target']})
+    return summaries
 
 def main():
     parser = argparse.ArgumentParser(description='stress_compare')
@@ -0,0 +1,64 @@
+"""
+Incremental parser for cassandra-stress output.
+
+Lines are fed to the parser as stress prints them, and typed records
+are produced as soon as they can be recognized, so that callers can
+make use of the intervals while the stress operation is still running.
+"""
+
+import re
+from collections import namedtuple
+
+# The column names from the interval header stress prints before the
+# first interval:
+StressHeader = namedtuple('StressHeader', 'columns')
+# A single interval row, one float per column:
+StressInterval = namedtuple('StressInterval', 'values')
+# A single 'name : value' line from the final 'Results:' block:
+StressAggregate = namedtuple('StressAggregate', 'name value')
+
+# Regex that matches 2.0 or 2.1 stress intervals:
+start_of_intervals_re = re.compile('(partitions|ops|total|total ops).*,.*(op/s|interval_op_rate|adj row/s),.*(pk/s|key/s|interval_key_rate|op/s)')
+
+
+class StressOutputParser(object):
+    """Parse cassandra-stress output one line at a time"""
+
+    def __init__(self):
+        self.collecting_aggregates = False
+        self.collecting_values = False
+
+    def feed(self, line):
+        """Parse a single line of stress output.
+
+        Returns the record the line represents (a StressHeader,
+        StressInterval or StressAggregate), or None if the line
+        carries no data."""
+        if line.startswith("Results:"):
+            self.collecting_aggregates = True
+            return None
+        if not self.collecting_aggregates:
+            if start_of_intervals_re.match(line):
+                self.collecting_values = True
+                return StressHeader([c.strip() for c in line.split(",")])
+            if self.collecting_values:
+                try:
+                    return StressInterval([float(x) for x in line.split(",")])
+                except ValueError:
+                    pass
+            return None
+        line = line.strip()
+        if line.startswith("END") or ":" not in line:
+            return None
+        # Collect aggregates:
+        stat, value = line.split(":", 1)
+        return StressAggregate(stat.strip(), value.strip())
+
+
+def parse_stress_output(lines):
+    """Generate records from an iterable of stress output lines"""
+    parser = StressOutputParser()
+    for line in lines:
+        record = parser.feed(line)
+        if record is not None:
+            yield record
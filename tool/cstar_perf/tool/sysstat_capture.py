@@ -0,0 +1,171 @@
+#!/bin/env python
+
+"""Tool to continuously capture system metrics from /proc
+
+Every interval, one line of comma separated values is appended to the
+log file, after a header line naming the columns (see COLUMNS). CPU
+columns are percentages of the interval, rates are per second, memory
+is in bytes, and disk_queue is the average number of requests in
+flight (avgqu-sz in iostat). Disks are all the whole block devices,
+except loop, ram and optical devices, and the devices built on top of
+others (device mapper, md raid), whose I/O is already counted on the
+disks under them. disk_util is the utilization of the busiest disk, as
+the utilizations of several disks don't add up. Network is all the
+interfaces, except loopback.
+"""
+
+import os
+import time
+import argparse
+
+COLUMNS = ['timestamp',
+           'cpu_user', 'cpu_system', 'cpu_iowait', 'cpu_steal', 'cpu_idle',
+           'context_switches', 'interrupts', 'procs_running', 'procs_blocked',
+           'disk_read_bytes', 'disk_write_bytes', 'disk_reads', 'disk_writes',
+           'disk_queue', 'disk_util',
+           'net_rx_bytes', 'net_tx_bytes',
+           'mem_free', 'mem_buffers', 'mem_cached', 'mem_dirty']
+
+SECTOR_SIZE = 512
+
+def block_devices():
+    """Return the whole block devices to sample"""
+    devices = []
+    for d in os.listdir('/sys/block'):
+        if d.startswith(('loop', 'ram', 'zram', 'sr')):
+            continue
+        slaves = os.path.join('/sys/block', d, 'slaves')
+        if os.path.isdir(slaves) and os.listdir(slaves):
+            continue
+        devices.append(d)
+    return devices
+
+def read_counters(devices):
+    """Read the current value of all the counters and gauges"""
+    counters = {}
+    with open('/proc/stat') as f:
+        for line in f:
+            fields = line.split()
+            if fields[0] == 'cpu':
+                # user nice system idle iowait irq softirq steal:
+                values = [int(v) for v in fields[1:9]]
+                counters['cpu'] = values + [0] * (8 - len(values))
+            elif fields[0] == 'ctxt':
+                counters['context_switches'] = int(fields[1])
+            elif fields[0] == 'intr':
+                counters['interrupts'] = int(fields[1])
+            elif fields[0] == 'procs_running':
+                counters['procs_running'] = int(fields[1])
+            elif fields[0] == 'procs_blocked':
+                counters['procs_blocked'] = int(fields[1])
+    disk = [0] * 5
+    disk_busy = {}
+    with open('/proc/diskstats') as f:
+        for line in f:
+            fields = line.split()
+            if fields[2] in devices:
+                # reads, sectors read, writes, sectors written, weighted ms doing io:
+                for i, field in enumerate((3, 5, 7, 9, 13)):
+                    disk[i] += int(fields[field])
+                # ms doing io:
+                disk_busy[fields[2]] = int(fields[12])
+    counters['disk'] = disk
+    counters['disk_busy'] = disk_busy
+    net = [0, 0]
+    with open('/proc/net/dev') as f:
+        for line in f:
+            if ':' not in line:
+                continue
+            interface, data = line.split(':', 1)
+            if interface.strip() == 'lo':
+                continue
+            fields = data.split()
+            net[0] += int(fields[0])
+            net[1] += int(fields[8])
+    counters['net'] = net
+    memory = {}
+    with open('/proc/meminfo') as f:
+        for line in f:
+            name, value = line.split(':', 1)
+            memory[name] = int(value.split()[0]) * 1024
+    counters['memory'] = memory
+    return counters
+
+def sample_row(timestamp, elapsed, previous, current):
+    """Compute a row of COLUMNS from two reads of the counters, elapsed seconds apart"""
+    cpu = [c - p for c, p in zip(current['cpu'], previous['cpu'])]
+    cpu_total = float(sum(cpu)) or 1.0
+    user, nice, system, idle, iowait, irq, softirq, steal = cpu[:8]
+    disk = [c - p for c, p in zip(current['disk'], previous['disk'])]
+    busy = max([ms - previous['disk_busy'].get(device, ms) for device, ms in current['disk_busy'].items()] or [0])
+    net = [c - p for c, p in zip(current['net'], previous['net'])]
+    memory = current['memory']
+    return [timestamp,
+            100 * (user + nice) / cpu_total, 100 * (system + irq + softirq) / cpu_total,
+            100 * iowait / cpu_total, 100 * steal / cpu_total, 100 * idle / cpu_total,
+            (current['context_switches'] - previous['context_switches']) / elapsed,
+            (current['interrupts'] - previous['interrupts']) / elapsed,
+            current['procs_running'], current['procs_blocked'],
+            disk[1] * SECTOR_SIZE / elapsed, disk[3] * SECTOR_SIZE / elapsed,
+            disk[0] / elapsed, disk[2] / elapsed,
+            disk[4] / 1000.0 / elapsed, min(100.0, busy / 10.0 / elapsed),
+            net[0] / elapsed, net[1] / elapsed,
+            memory.get('MemFree', 0), memory.get('Buffers', 0),
+            memory.get('Cached', 0), memory.get('Dirty', 0)]
+
+def format_value(value):
+    if isinstance(value, float):
+        return "{0:.6g}".format(value)
+    return str(value)
+
+def capture_stats(logfile, interval):
+    """Append a row of COLUMNS to the logfile every interval seconds"""
+    devices = block_devices()
+    with open(logfile, 'a') as log:
+        log.write(",".join(COLUMNS) + "\n")
+        log.flush()
+        previous_time = time.time()
+        previous = read_counters(devices)
+        while True:
+            time.sleep(interval)
+            now = time.time()
+            current = read_counters(devices)
+            row = sample_row(now, now - previous_time, previous, current)
+            log.write(",".join(["{0:.3f}".format(row[0])] + [format_value(v) for v in row[1:]]) + "\n")
+            log.flush()
+            previous_time, previous = now, current
+
+def read_log(logfile):
+    """Read a log written by capture_stats
+
+    Returns the column names, and a list of rows of floats."""
+    columns = None
+    rows = []
+    with open(logfile) as f:
+        for line in f:
+            fields = line.strip().split(",")
+            if fields[0] == 'timestamp':
+                columns = fields
+                continue
+            if columns is None or len(fields) != len(columns):
+                # A partially written last line:
+                continue
+            try:
+                rows.append([float(v) for v in fields])
+            except ValueError:
+                continue
+    return columns or COLUMNS, rows
+
+if __name__ == "__main__":
+    from daemonize import Daemonize
+    parser = argparse.ArgumentParser(description='sysstat_capture')
+    parser.add_argument('-f', '--file', default='/tmp/sysstat.log',
+                        help='File to log to', dest='logfile')
+    parser.add_argument('-i', '--interval', dest='interval', type=float,
+                        default=1, help='Time interval, in seconds, between samples.')
+    args = parser.parse_args()
+    logfile = os.path.abspath(args.logfile)
+
+    daemon = Daemonize(app="sysstat_capture", pid='/tmp/sysstat_capture.pid',
+                       action=lambda: capture_stats(logfile, args.interval))
+    daemon.start()
@@ -0,0 +1,133 @@
+import json
+import random
+import unittest
+
+from ..intervals import ColumnarIntervals
+from ..analysis import (mser_truncation, steady_state, t_quantile, trial_summary, welch_interval,
+                        operation_metric, analyze, regressions)
+
+def stress_stats(op_rate, intervals=200, warmup=0, noise=0.01, seed=0, **extra):
+    """Stats of a stress operation running at op_rate, after warmup
+    intervals at half that rate"""
+    rng = random.Random(seed)
+    data = ColumnarIntervals(['op/s', 'mean', 'time'])
+    for i in range(intervals):
+        rate = op_rate / 2.0 if i < warmup else op_rate
+        rate *= 1 + rng.gauss(0, noise)
+        data.append([rate, 100000.0 / rate, float(i + 1)])
+    stats = {'type': 'stress', 'test': '1_write', 'command': 'write n=1000000',
+             'id': '{seed}'.format(seed=seed), 'intervals': data.encode()}
+    stats.update(extra)
+    return stats
+
+def delta(report, label, metric='op_rate'):
+    for revision in report['operations'][0]['revisions']:
+        if revision['label'] == label:
+            return revision['deltas'][metric]
+
+class TestSteadyState(unittest.TestCase):
+    def test_mser_truncation(self):
+        rng = random.Random(0)
+        values = [50 + rng.gauss(0, 1) for i in range(40)] + [100 + rng.gauss(0, 1) for i in range(160)]
+        # The whole warm-up is trimmed, and at most a few batches of the steady state:
+        self.assertTrue(40 <= mser_truncation(values) <= 70)
+        # At most half of the series is trimmed:
+        self.assertTrue(mser_truncation(range(200, 0, -1)) <= 100)
+        self.assertEqual(mser_truncation([1, 2, 3]), 0)
+
+    def test_steady_state(self):
+        detected = steady_state(stress_stats(1000, warmup=30))
+        self.assertTrue(30 <= detected['start'] <= 60)
+        self.assertEqual(detected['end'], 200)
+        self.assertEqual(detected['start_time'], detected['start'] + 1)
+        self.assertAlmostEqual(detected['steady_state']['op_rate'], 1000, delta=5)
+        self.assertTrue(detected['whole_run']['op_rate'] < 950)
+        # The warm-up isn't part of the metric compared:
+        self.assertAlmostEqual(operation_metric(stress_stats(1000, warmup=30)), 1000, delta=5)
+        self.assertTrue(operation_metric(stress_stats(1000, warmup=30), window='whole_run') < 950)
+
+class TestTrialStatistics(unittest.TestCase):
+    def test_t_quantile(self):
+        self.assertEqual(t_quantile(0.95, 1), 12.706)
+        self.assertEqual(t_quantile(0.95, 30), 2.042)
+        # Approximated beyond the table:
+        self.assertAlmostEqual(t_quantile(0.95, 60), 2.000, places=2)
+        self.assertAlmostEqual(t_quantile(0.95, 10000), 1.960, places=2)
+
+    def test_trial_summary(self):
+        summary = trial_summary([10.0, 12.0, 11.0])
+        self.assertEqual(summary['mean'], 11.0)
+        self.assertEqual(summary['stdev'], 1.0)
+        half_width = 4.303 / 3 ** 0.5
+        self.assertAlmostEqual(summary['ci_low'], 11.0 - half_width)
+        self.assertAlmostEqual(summary['ci_high'], 11.0 + half_width)
+        self.assertAlmostEqual(summary['relative_half_width'], half_width / 11.0)
+        self.assertEqual(trial_summary([10.0])['relative_half_width'], None)
+        self.assertEqual(trial_summary([])['mean'], None)
+
+    def test_welch_interval(self):
+        low, high = welch_interval([90.0, 91.0, 89.0], [100.0, 101.0, 99.0], 0.95)
+        self.assertTrue(low < -0.1 < high < 0)
+        low, high = welch_interval([100.0, 100.0], [100.0, 100.0], 0.95)
+        self.assertEqual((low, high), (0.0, 0.0))
+
+class TestAnalyze(unittest.TestCase):
+    def test_regression(self):
+        stats_log = {'stats': [stress_stats(1000, seed=1, label='base', revision_index=0),
+                               stress_stats(800, seed=2, label='slow', revision_index=1),
+                               stress_stats(1002, seed=3, label='same', revision_index=2)]}
+        report = analyze(stats_log)
+        self.assertEqual(report['baseline'], 'base')
+        self.assertEqual(delta(report, 'slow')['verdict'], 'regression')
+        self.assertAlmostEqual(delta(report, 'slow')['relative'], -0.2, delta=0.01)
+        # Latency is lower is better:
+        self.assertEqual(delta(report, 'slow', 'mean_latency')['verdict'], 'regression')
+        self.assertEqual(delta(report, 'same')['verdict'], 'unchanged')
+        self.assertEqual([(label, metric) for test, label, metric, d in regressions(report)],
+                         [('slow', 'mean_latency'), ('slow', 'op_rate')])
+        # The report is reproducible, and json serializable:
+        self.assertEqual(json.dumps(report, sort_keys=True), json.dumps(analyze(stats_log), sort_keys=True))
+
+    def test_baseline(self):
+        stats_log = {'stats': [stress_stats(1000, seed=1, label='base', revision_index=0),
+                               stress_stats(800, seed=2, label='slow', revision_index=1)]}
+        report = analyze(stats_log, baseline='slow')
+        self.assertEqual(report['baseline'], 'slow')
+        self.assertEqual(delta(report, 'base')['verdict'], 'improvement')
+
+    def test_same_label(self):
+        stats_log = {'stats': [stress_stats(1000, seed=1, label='trunk', revision_index=0),
+                               stress_stats(800, seed=2, label='trunk', revision_index=1)]}
+        revisions = analyze(stats_log)['operations'][0]['revisions']
+        self.assertEqual(len(revisions), 2)
+        self.assertEqual(revisions[1]['deltas']['op_rate']['verdict'], 'regression')
+
+    def test_trials(self):
+        stats = []
+        for trial, base in enumerate([1000, 1040, 980], 1):
+            stats.append(stress_stats(base, seed=trial, label='base', revision_index=0,
+                                      trial=trial, trials_id='a'))
+        for trial, other in enumerate([950, 930, 960], 1):
+            stats.append(stress_stats(other, seed=10 + trial, label='other', revision_index=1,
+                                      trial=trial, trials_id='b'))
+        revisions = analyze({'stats': stats})['operations'][0]['revisions']
+        self.assertEqual(revisions[0]['trials'], 3)
+        # The interval comes from the variation between trials, not within them:
+        base_metric = revisions[0]['metrics']['op_rate']
+        summary = trial_summary([operation_metric(s) for s in stats[:3]])
+        self.assertAlmostEqual(base_metric['ci_low'], summary['ci_low'])
+        self.assertAlmostEqual(base_metric['ci_high'], summary['ci_high'])
+        d = revisions[1]['deltas']['op_rate']
+        self.assertTrue(d['ci_low'] < d['relative'] < d['ci_high'])
+        self.assertTrue(d['ci_high'] - d['ci_low'] > 0.03)
+
+    def test_interleaved_blocks(self):
+        stats = []
+        # The cluster slows down over the run, but other is always 10% slower:
+        for block, drift in enumerate([1.0, 0.8, 0.6]):
+            stats.append(stress_stats(1000 * drift, seed=block, label='base', revision_index=0, block=block))
+            stats.append(stress_stats(900 * drift, seed=10 + block, label='other', revision_index=1, block=block))
+        d = delta(analyze({'stats': stats}), 'other')
+        self.assertEqual(d['paired_blocks'], 3)
+        self.assertEqual(d['verdict'], 'regression')
+        self.assertAlmostEqual(d['relative'], -0.1, delta=0.01)
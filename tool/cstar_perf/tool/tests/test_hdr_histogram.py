@@ -0,0 +1,119 @@
+import random
+import unittest
+
+from ..hdr_histogram import (Histogram, encode_zigzag, decode_zigzag, encode_histogram, decode_histogram,
+                             merge_histograms, summarize, read_interval_log, collect_interval_log,
+                             merge_interval_logs)
+
+def histogram_of(values, significant_digits=3):
+    histogram = Histogram(significant_digits)
+    for value in values:
+        histogram.record(value)
+    return histogram
+
+def interval_log(histograms, tag=None, start=0.0):
+    lines = ['#[StartTime: 1440000000.000 (seconds since epoch)]',
+             '"StartTimestamp","Interval_Length","Interval_Max","Interval_Compressed_Histogram"']
+    for i, histogram in enumerate(histograms):
+        line = '{start:.3f},1.000,{max:.3f},{data}'.format(start=start + i, max=histogram.max() / 1e6,
+                                                          data=histogram.encode())
+        if tag is not None:
+            line = 'Tag={tag},{line}'.format(tag=tag, line=line)
+        lines.append(line)
+    return lines
+
+class TestHistogram(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.values = [int(rng.expovariate(1 / 2e6)) + 1 for i in range(5000)]
+
+    def test_zigzag(self):
+        for value in (0, 1, -1, 63, -64, 64, 2 ** 31, -2 ** 31, 2 ** 62, -2 ** 63):
+            encoded = encode_zigzag(value)
+            self.assertTrue(len(encoded) <= 9)
+            self.assertEqual(decode_zigzag(encoded + 'trailing', 0), (value, len(encoded)))
+
+    def test_percentiles_within_precision(self):
+        histogram = histogram_of(self.values)
+        self.assertEqual(histogram.total_count, len(self.values))
+        ordered = sorted(self.values)
+        for percentile in (50, 90, 99, 99.9):
+            exact = ordered[int(percentile / 100.0 * len(ordered) + 0.5) - 1]
+            self.assertAlmostEqual(histogram.value_at_percentile(percentile), exact, delta=exact * 1e-3)
+        self.assertAlmostEqual(histogram.max(), ordered[-1], delta=ordered[-1] * 1e-3)
+        self.assertAlmostEqual(histogram.min(), ordered[0], delta=ordered[0] * 1e-3)
+        self.assertEqual(Histogram().value_at_percentile(99), None)
+
+    def test_round_trip(self):
+        histogram = histogram_of(self.values)
+        decoded = Histogram.decode(histogram.encode())
+        self.assertEqual(decoded.counts, histogram.counts)
+        self.assertEqual(decoded.total_count, histogram.total_count)
+        self.assertEqual(decoded.significant_digits, 3)
+        decoded = decode_histogram(encode_histogram(histogram, 'us'))
+        self.assertEqual(decoded.counts, histogram.counts)
+
+    def test_unsupported_version(self):
+        encoded = encode_histogram(histogram_of(self.values))
+        encoded['version'] = 1
+        with self.assertRaises(ValueError):
+            decode_histogram(encoded)
+
+    def test_merge(self):
+        half = len(self.values) / 2
+        merged = merge_histograms([encode_histogram(histogram_of(self.values[:half])),
+                                   encode_histogram(histogram_of(self.values[half:]))])
+        self.assertEqual(decode_histogram(merged).counts, histogram_of(self.values).counts)
+        self.assertEqual(merge_histograms([]), None)
+        with self.assertRaises(ValueError):
+            merge_histograms([encode_histogram(histogram_of([1]), 'ns'),
+                              encode_histogram(histogram_of([1]), 'us')])
+
+    def test_summarize_units(self):
+        summary = summarize(encode_histogram(histogram_of([1000000, 2000000, 3000000]), 'ns'), unit='ms')
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['unit'], 'ms')
+        self.assertAlmostEqual(summary['p50'], 2.0, delta=2.0 * 1e-3)
+        self.assertAlmostEqual(summary['max'], 3.0, delta=3.0 * 1e-3)
+        self.assertTrue('p99.9' in summary)
+
+class TestIntervalLog(unittest.TestCase):
+    def setUp(self):
+        self.intervals = [histogram_of([1000 * (i + 1), 2000 * (i + 1)]) for i in range(3)]
+
+    def test_read_interval_log(self):
+        lines = interval_log(self.intervals, tag='WRITE-rt')
+        # A partially written last line is skipped:
+        lines.append(lines[-1][:len(lines[-1]) / 2])
+        read = list(read_interval_log(lines))
+        self.assertEqual([(tag, start, length) for tag, start, length, h in read],
+                         [('WRITE-rt', 0.0, 1.0), ('WRITE-rt', 1.0, 1.0), ('WRITE-rt', 2.0, 1.0)])
+        self.assertEqual([h.counts for t, s, l, h in read], [h.counts for h in self.intervals])
+
+    def test_collect_interval_log(self):
+        collected = collect_interval_log(interval_log(self.intervals))
+        self.assertEqual(collected.keys(), ['default'])
+        self.assertEqual(collected['default']['summary']['count'], 6)
+        self.assertFalse(collected['default'].has_key('intervals'))
+        collected = collect_interval_log(interval_log(self.intervals), intervals=True)
+        self.assertEqual(collected['default']['summary']['count'], 6)
+        self.assertEqual(len(collected['default']['intervals']['histograms']), 3)
+
+    def test_merge_interval_logs(self):
+        first = collect_interval_log(interval_log(self.intervals, tag='WRITE-rt'), intervals=True)
+        second = collect_interval_log(interval_log(self.intervals[:2], tag='WRITE-rt') +
+                                      interval_log(self.intervals, tag='WRITE-st'), intervals=True)
+        merged = merge_interval_logs([first, second])
+        self.assertEqual(sorted(merged.keys()), ['WRITE-rt', 'WRITE-st'])
+        # Only the intervals every log has are kept:
+        self.assertEqual(len(merged['WRITE-rt']['intervals']['histograms']), 2)
+        self.assertEqual(merged['WRITE-rt']['summary']['count'], 10)
+        self.assertEqual(Histogram.decode(merged['WRITE-rt']['intervals']['histograms'][0]).total_count, 4)
+        self.assertEqual(merged['WRITE-st']['summary']['count'], 6)
+
+    def test_merge_interval_logs_totals_only(self):
+        first = collect_interval_log(interval_log(self.intervals, tag='WRITE-rt'), intervals=True)
+        second = collect_interval_log(interval_log(self.intervals[:2], tag='WRITE-rt'))
+        merged = merge_interval_logs([first, second])
+        self.assertEqual(merged['WRITE-rt']['summary']['count'], 10)
+        self.assertFalse(merged['WRITE-rt'].has_key('intervals'))
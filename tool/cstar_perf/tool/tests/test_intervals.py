@@ -0,0 +1,59 @@
+import json
+import unittest
+
+from ..intervals import (ColumnarIntervals, is_columnar, interval_rows, interval_columns,
+                         interval_count, expand_stats_intervals)
+
+COLUMNS = ['total ops', 'op/s', 'mean', 'time']
+ROWS = [[1000.0, 1000.0, 1.5, 1.0],
+        [2100.0, 1100.0, 1.25, 2.0],
+        [3050.0, 950.0, 2.75, 3.0]]
+
+class TestIntervals(unittest.TestCase):
+    def encoded(self):
+        intervals = ColumnarIntervals(COLUMNS)
+        for row in ROWS:
+            intervals.append(row)
+        return intervals.encode()
+
+    def test_round_trip(self):
+        encoded = self.encoded()
+        self.assertTrue(is_columnar(encoded))
+        self.assertEqual(encoded['length'], len(ROWS))
+        # The encoding survives a trip through the stats json:
+        decoded = ColumnarIntervals.decode(json.loads(json.dumps(encoded)))
+        self.assertEqual(decoded.columns, COLUMNS)
+        self.assertEqual(decoded.rows(), ROWS)
+        self.assertEqual(list(decoded.column('op/s')), [1000.0, 1100.0, 950.0])
+
+    def test_incomplete_rows_ignored(self):
+        intervals = ColumnarIntervals(COLUMNS)
+        self.assertTrue(intervals.append(ROWS[0]))
+        self.assertFalse(intervals.append(ROWS[1][:2]))
+        self.assertEqual(len(intervals), 1)
+
+    def test_unsupported_version(self):
+        encoded = self.encoded()
+        encoded['version'] = 0
+        with self.assertRaises(ValueError):
+            ColumnarIntervals.decode(encoded)
+
+    def test_either_encoding(self):
+        encoded = self.encoded()
+        self.assertEqual(interval_rows(encoded), ROWS)
+        self.assertEqual(interval_rows(ROWS), ROWS)
+        self.assertEqual(interval_columns(encoded), COLUMNS)
+        self.assertEqual(interval_columns(ROWS), None)
+        self.assertEqual(interval_count(encoded), 3)
+        self.assertEqual(interval_count(ROWS), 3)
+        self.assertFalse(is_columnar(ROWS))
+
+    def test_expand_stats_intervals(self):
+        stats_log = {'stats': [{'type': 'stress', 'intervals': self.encoded()},
+                               {'type': 'stress', 'intervals': ROWS},
+                               {'type': 'nodetool'}]}
+        expand_stats_intervals(stats_log)
+        self.assertEqual(stats_log['stats'][0]['intervals'], ROWS)
+        self.assertEqual(stats_log['stats'][0]['interval_columns'], COLUMNS)
+        self.assertEqual(stats_log['stats'][1]['intervals'], ROWS)
+        self.assertFalse(stats_log['stats'][1].has_key('interval_columns'))
@@ -0,0 +1,90 @@
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from .. import log_collector
+
+class TestLogCollector(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.mirror = os.path.join(self.tmp, 'mirror', 'node1')
+        self.bundles = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def fetch(self, logs, segments):
+        """Mimic fab_cassandra.fetch_log_segments
+
+        logs - path -> (inode, content) of the files on the node
+        segments - path -> offset of the segments fetched"""
+        files = {}
+        for path, (inode, content) in logs.items():
+            files[path] = [inode, len(content), 1000.0 + len(content), 0,
+                           hashlib.md5(content[:4096]).hexdigest()]
+        if not segments:
+            return {'files': files}
+        self.bundles += 1
+        bundle = os.path.join(self.tmp, 'bundle{n}.tar.gz'.format(n=self.bundles))
+        fetched = {}
+        with tarfile.open(bundle, 'w:gz') as tar:
+            for member, (path, offset) in enumerate(sorted(segments.items())):
+                data = logs[path][1][offset:]
+                info = tarfile.TarInfo('./{member}'.format(member=member))
+                info.size = len(data)
+                tar.addfile(info, StringIO(data))
+                fetched[path] = [offset, str(member)]
+        return {'files': files, 'segments': fetched, 'bundle': bundle}
+
+    def collect(self, logs, segments):
+        return log_collector.add_bundle(self.mirror, self.fetch(logs, segments), ['node1/{name}'])
+
+    def archived(self):
+        archive = os.path.join(self.tmp, 'logs.tar.gz')
+        log_collector.write_archive(archive, 'cassandra_logs', [self.mirror])
+        with tarfile.open(archive) as tar:
+            return dict((m.name, tar.extractfile(m).read()) for m in tar.getmembers() if m.isfile())
+
+    def bundle_files(self):
+        return sorted(name for name in os.listdir(self.mirror) if name.endswith('.tar.gz'))
+
+    def test_incremental(self):
+        logs = {'/logs/system.log': (10, 'started\n'), '/logs/gc.log': (11, 'gc 1\n')}
+        self.assertTrue(self.collect(logs, {'/logs/system.log': 0, '/logs/gc.log': 0}) > 0)
+        self.assertEqual(self.archived(), {'cassandra_logs/node1/system.log': 'started\n',
+                                           'cassandra_logs/node1/gc.log': 'gc 1\n'})
+        state = log_collector.mirror_state(self.mirror)
+        self.assertEqual(state['/logs/system.log'][:2], [10, 8])
+        self.assertEqual(state['/logs/system.log'][3], hashlib.md5('started\n').hexdigest())
+
+        # Only the bytes appended since are fetched:
+        logs['/logs/system.log'] = (10, 'started\nflushed\n')
+        self.collect(logs, {'/logs/system.log': 8})
+        self.assertEqual(self.archived()['cassandra_logs/node1/system.log'], 'started\nflushed\n')
+        self.assertEqual(len(self.bundle_files()), 2)
+        self.assertEqual(log_collector.mirror_state(self.mirror)['/logs/system.log'][1], 16)
+
+        # Nothing changed:
+        self.assertEqual(self.collect(logs, {}), 0)
+        self.assertEqual(self.archived()['cassandra_logs/node1/gc.log'], 'gc 1\n')
+
+    def test_refetched_whole(self):
+        logs = {'/logs/gc.log': (11, 'gc 1\ngc 2\n'), '/logs/system.log': (10, 'started\n')}
+        self.collect(logs, {'/logs/gc.log': 0, '/logs/system.log': 0})
+        # gc.log truncated in place by a restart, system.log rotated away:
+        logs = {'/logs/gc.log': (11, 'gc 3\n')}
+        self.collect(logs, {'/logs/gc.log': 0})
+        self.assertEqual(self.archived(), {'cassandra_logs/node1/gc.log': 'gc 3\n'})
+        # The first bundle isn't referenced anymore:
+        self.assertEqual(len(self.bundle_files()), 1)
+
+    def test_unknown_files_skipped(self):
+        # A file found but not fetched (eg. it vanished while being
+        # read) isn't added to the mirror:
+        logs = {'/logs/system.log': (10, 'started\n'), '/logs/debug.log': (12, 'debug\n')}
+        self.collect(logs, {'/logs/system.log': 0})
+        self.assertEqual(sorted(log_collector.mirror_state(self.mirror)), ['/logs/system.log'])
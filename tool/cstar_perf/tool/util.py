@@ -4,3 +4,13 @@ import random
 def random_token(length=10):
     return ''.join(random.choice(string.ascii_uppercase + string.digits)
                    for x in xrange(length))
+
+def percentile(values, p):
+    """Return the p-th percentile (0-100) of a list of numbers, interpolating between the closest ranks"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * p / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
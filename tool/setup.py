@@ -24,6 +24,7 @@ setup(
     ],
     entry_points = {'console_scripts': 
                     ['cstar_perf_stress = cstar_perf.tool.stress_compare:main',
-                     'cstar_perf_bootstrap = cstar_perf.tool.bootstrap:main']},
+                     'cstar_perf_bootstrap = cstar_perf.tool.bootstrap:main',
+                     'cstar_perf_analyze = cstar_perf.tool.analysis:main']},
 )
 